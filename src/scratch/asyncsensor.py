@@ -0,0 +1,777 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Non-blocking alternative to the thread based @RemoteSensor. Any number of
+@AsyncRemoteSensor instances share one @SensorLoop (a single thread waiting in
+select), and incoming frames are handled as soon as they arrive.
+
+Minimal Usage example:
+----------------------
+
+from scratch.asyncsensor import SensorLoop, AsyncRemoteSensor
+
+loop = SensorLoop()
+
+for i in range(20):
+	rs = AsyncRemoteSensor(loop = loop)
+	rs.connect(True)
+	rs.start()
+	rs.values.a = i
+
+loop.run()
+'''
+
+import os
+import fcntl
+import errno
+import heapq
+import select
+import socket
+import threading
+import logging
+import time
+
+from scratch.remotesensor import RemoteSensor, DEFAULT_HOST, DEFAULT_PORT
+from scratch.framing import HEADER, FrameReader
+from scratch.prototrace import TRACE
+from scratch.liveness import setKeepalive
+
+CONNECT_TIMEOUT = 5		# seconds a single connect attempt may take
+
+class SensorLoop:
+	'''
+	Select based I/O loop serving many @AsyncRemoteSensor instances from a single
+	thread. Besides socket I/O, the loop runs timed callbacks (see @callLater) and
+	periodic tasks (see @schedule). If nothing is due, the loop sleeps until the
+	next timer.
+
+	All methods except @run and @runOnce may be called from any thread.
+	'''
+
+	def __init__(self):
+		'''
+		Construct a new (not yet running) loop.
+		'''
+
+		self.__sensors 	= {}	# file descriptor -> sensor
+		self.__timers 	= []	# heap of [latest, seq, callback, args, active, earliest]
+		self.__seq 		= 0		# tie breaker for timers with equal deadline
+		self.__slack 	= 0		# number of timers with earliest < latest
+		self.__lock 	= threading.Lock()
+		self.__stop 	= False
+		self.__thread 	= None	# thread currently running the loop
+
+		# self-pipe used to wake up select from other threads
+		(self.__wakeRd, self.__wakeWr) = os.pipe()
+
+		for fd in (self.__wakeRd, self.__wakeWr):
+			fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+			fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+
+	def register(self, sensor):
+		'''
+		Start watching the socket of a connected sensor.
+
+		@param	sensor	connected @AsyncRemoteSensor
+		'''
+
+		self.__sensors[sensor.fileno()] = sensor
+		self.wakeup()
+
+	def unregister(self, sensor):
+		'''
+		Stop watching the socket of a sensor.
+
+		@param	sensor	@AsyncRemoteSensor to remove
+		'''
+
+		for fd in self.__sensors.keys():
+			if self.__sensors[fd] is sensor:
+				del self.__sensors[fd]
+
+	def callLater(self, delay, callback, *args):
+		'''
+		Run callback(*args) within the loop thread after delay seconds.
+
+		@param	delay		delay in seconds
+		@param	callback	callable to run
+		@return				handle which could be passed to @cancel
+		'''
+
+		return self.__addTimer(time.time() + delay, 0, callback, args)
+
+	def __addTimer(self, when, slack, callback, args):
+		'''
+		Add a timer running callback(*args) at when, or up to slack seconds later
+		(if this saves a wakeup).
+
+		@return		handle which could be passed to @cancel
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			self.__seq = self.__seq + 1
+			timer = [when + slack, self.__seq, callback, args, True, when]
+			heapq.heappush(self.__timers, timer)
+
+			if slack > 0:
+				self.__slack = self.__slack + 1
+		finally:
+			self.__lock.release()
+
+		if not threading.currentThread() is self.__thread:
+			self.wakeup()
+
+		return timer
+
+	def callSoon(self, callback, *args):
+		'''
+		Run callback(*args) within the loop thread as soon as possible.
+
+		@param	callback	callable to run
+		@return				handle which could be passed to @cancel
+		'''
+
+		return self.callLater(0, callback, *args)
+
+	def cancel(self, timer):
+		'''
+		Cancel a callback scheduled by @callLater.
+
+		@param	timer	handle returned by @callLater
+		'''
+
+		timer[4] = False
+
+	def schedule(self, task):
+		'''
+		Run a periodic task within the loop thread (first run one period from now)
+		until @unschedule is called.
+
+		@param	task	@scratch.tasks.PeriodicTask
+		@return			task
+		'''
+
+		task.start(time.time())
+		task.timer = self.__addTimer(task.due, task.jitter, self.__runTask, (task,))
+
+		return task
+
+	def unschedule(self, task):
+		'''
+		Stop running a periodic task.
+
+		@param	task	@scratch.tasks.PeriodicTask passed to @schedule
+		'''
+
+		task.active = False
+
+		if not task.timer == None:
+			self.cancel(task.timer)
+
+	def __runTask(self, task):
+		'''
+		Timed callback running a periodic task and scheduling its next run.
+		'''
+
+		if not task.active:
+			return
+
+		due = task.run()
+
+		if task.active:
+			task.timer = self.__addTimer(due, task.jitter, self.__runTask, (task,))
+
+	def wakeup(self):
+		'''
+		Interrupt a select call currently blocking the loop thread.
+		'''
+
+		try:
+			os.write(self.__wakeWr, 'x')
+		except OSError:
+			# pipe full, loop will wake up anyway
+			pass
+
+	def stop(self):
+		'''
+		Ask the loop to return from @run.
+		'''
+
+		self.__stop = True
+		self.wakeup()
+
+	def runOnce(self, timeout = None):
+		'''
+		Wait for I/O or the next timer (but at most timeout seconds), then dispatch
+		everything that is ready.
+
+		@param	timeout		max. seconds to wait, None to wait for the next event
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			if self.__timers:
+				due = max(0, self.__timers[0][0] - time.time())
+
+				if timeout == None or due < timeout:
+					timeout = due
+		finally:
+			self.__lock.release()
+
+		rd = [self.__wakeRd] + self.__sensors.keys()
+		wr = [fd for (fd, s) in self.__sensors.items() if s.wantsWrite()]
+
+		try:
+			(r, w, x) = select.select(rd, wr, [], timeout)
+		except select.error as e:
+			if e.args[0] == errno.EINTR:
+				return
+			raise
+
+		for fd in r:
+			if fd == self.__wakeRd:
+				try:
+					while os.read(self.__wakeRd, 512):
+						pass
+				except OSError:
+					pass
+			else:
+				# sensors may be unregistered by other threads meanwhile
+				sensor = self.__sensors.get(fd)
+				if not sensor == None:
+					sensor.handleRead()
+
+		for fd in w:
+			sensor = self.__sensors.get(fd)
+			if not sensor == None:
+				sensor.handleWrite()
+
+		self.__runTimers()
+
+	def __runTimers(self):
+		'''
+		Run all timed callbacks which are due. Since the loop is awake anyway, this
+		includes timers with slack whose earliest time passed.
+		'''
+
+		now = time.time()
+		due = []
+
+		self.__lock.acquire()
+
+		try:
+			timers = self.__timers
+
+			while timers and timers[0][0] <= now:
+				due.append(heapq.heappop(timers))
+
+			if self.__slack:
+				early = [t for t in timers if t[5] <= now]
+
+				if early:
+					self.__timers = [t for t in timers if t[5] > now]
+					heapq.heapify(self.__timers)
+					due.extend(early)
+
+			for timer in due:
+				if timer[5] < timer[0]:
+					self.__slack = self.__slack - 1
+		finally:
+			self.__lock.release()
+
+		# run in the order the timers got due
+		due.sort(key = lambda t: (t[5], t[1]))
+
+		for timer in due:
+
+			if not timer[4]:
+				continue
+
+			try:
+				timer[2](*timer[3])
+			except Exception as e:
+				logging.error("Error in timed callback %s: %s" % (timer[2], e))
+
+	def run(self):
+		'''
+		Run the loop until @stop is called.
+		'''
+
+		self.__stop 	= False
+		self.__thread 	= threading.currentThread()
+
+		try:
+			while not self.__stop:
+				self.runOnce()
+		finally:
+			self.__thread = None
+
+__defaultLoop = None
+
+def defaultLoop():
+	'''
+	Get the process wide default loop (created on first use).
+
+	@return		@SensorLoop instance
+	'''
+
+	global __defaultLoop
+
+	if __defaultLoop == None:
+		__defaultLoop = SensorLoop()
+
+	return __defaultLoop
+
+class AsyncRemoteSensor(RemoteSensor):
+	'''
+	Remote sensor driven by a @SensorLoop instead of an own receiver thread. It offers
+	the same interface as @RemoteSensor (values, sendMsg, bcastMsg, updateHandler,
+	messageHandler, setupVariables, worker), but calling @start registers the sensor
+	with its loop instead of starting a thread.
+
+	Outgoing messages are buffered and written when the socket is ready, thus @sendMsg
+	never blocks and may be called from any thread.
+	'''
+
+	workerInterval 	= None	# if set, call @worker every workerInterval seconds
+
+	def __init__(self, host = DEFAULT_HOST, port = DEFAULT_PORT, args = {}, loop = None):
+		'''
+		Construct new asynchronous remote sensor.
+
+		@param	host	IP/hostname of Scratch sensor server
+		@param	port	port of Scratch sensor server
+		@param	args	additional wrapper arguments (host, port)
+		@param	loop	@SensorLoop to use, if None the @defaultLoop is used
+		'''
+
+		RemoteSensor.__init__(self, host, port, args)
+
+		self.attachLoop(loop)
+
+	def attachLoop(self, loop = None):
+		'''
+		Set up the loop related state of the sensor. Called by the constructor (and by
+		the constructors of the classes created with @asyncVariant).
+
+		@param	loop	@SensorLoop to use, if None the @defaultLoop is used
+		'''
+
+		if loop == None:
+			loop = defaultLoop()
+
+		self.loop 		= loop
+
+		self.__sock 	= None
+		self.__pending 	= None	# socket of a connect in progress
+		self.__timeout 	= None	# timer aborting the connect in progress
+		self.__reader 	= None
+		self.__wbuf 	= bytearray()
+		self.__wlock 	= threading.Lock()
+		self.__retry 	= False
+		self.__started 	= False
+		self.__tasks 	= []
+
+	def fileno(self):
+		'''
+		@return		file descriptor of the socket connected to the server (or of the
+					socket connecting to it)
+		'''
+
+		if self.__sock == None and not self.__pending == None:
+			return self.__pending.fileno()
+
+		return self.__sock.fileno()
+
+	def isConnected(self):
+		'''
+		@return		True if currently connected to the server
+		'''
+
+		return not self.__sock == None
+
+	def connect(self, tryHard = False):
+		'''
+		Try to connect to a sensor server. Without tryHard, this blocks (at most
+		CONNECT_TIMEOUT seconds) and raises socket.error on failure, like
+		@RemoteSensor.connect. With tryHard set, the connect never blocks: it is
+		completed by the loop once the socket gets writable (or aborted after
+		CONNECT_TIMEOUT seconds), and a failed attempt schedules the next one.
+
+		@param	tryHard		on True, retry (and later reconnect) over and over again
+		@return				True if connected, False if the connect is in progress or
+							a retry was scheduled
+		'''
+
+		(host, port) = self.getAddress()
+
+		logging.info("Connecting to Scratch at %s:%d" % (host, port))
+
+		self.__retry = tryHard
+
+		if not tryHard:
+			self.__connected(socket.create_connection((host, port), CONNECT_TIMEOUT))
+			return True
+
+		sock = None
+
+		try:
+			(family, socktype, proto, name, addr) = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+			sock = socket.socket(family, socktype, proto)
+			sock.setblocking(False)
+			err = sock.connect_ex(addr)
+		except socket.error as e:
+			if not sock == None:
+				sock.close()
+			self.__connectFailed(e)
+			return False
+
+		if err == 0:
+			self.__connected(sock)
+			return True
+
+		if not err in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EINTR):
+			sock.close()
+			self.__connectFailed(os.strerror(err))
+			return False
+
+		# wait for the socket to get writable
+		self.__pending = sock
+		self.__timeout = self.loop.callLater(CONNECT_TIMEOUT, self.__connectTimedOut, sock)
+		self.loop.register(self)
+
+		return False
+
+	def __finishConnect(self):
+		'''
+		Called by the loop when the socket of the connect in progress is ready: check
+		whether the connect succeeded.
+		'''
+
+		sock = self.__pending
+
+		self.__pending = None
+		self.loop.cancel(self.__timeout)
+		self.loop.unregister(self)
+
+		err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+		if err:
+			sock.close()
+			self.__connectFailed(os.strerror(err))
+			return
+
+		self.__connected(sock)
+
+	def __connectTimedOut(self, sock):
+		'''
+		Timed callback aborting a connect which did not complete in time.
+		'''
+
+		if not self.__pending is sock:
+			return
+
+		self.__pending = None
+		self.loop.unregister(self)
+		sock.close()
+
+		self.__connectFailed("timed out")
+
+	def __connectFailed(self, reason):
+		'''
+		Schedule the next connect attempt (unless the sensor was shut down).
+		'''
+
+		if not self.__retry:
+			return
+
+		delay = self.backoff.next()
+		logging.info("Connect failed (%s). Retrying in %.1f sec.!" % (reason, delay))
+		self.loop.callLater(delay, self.__reconnect)
+
+	def __connected(self, sock):
+		'''
+		Take over the socket of a successful connect.
+		'''
+
+		sock.setblocking(False)
+		setKeepalive(sock)
+
+		self.__sock = sock
+		self.__reader = FrameReader(sock)
+
+		logging.info("Successfully connected!")
+
+		self.stats.connects = self.stats.connects + 1
+		self.backoff.reset()
+
+		if not self.probe == None:
+			self.probe.reset()
+
+		# log levels are likely to be configured by now
+		TRACE.refresh()
+
+		if self.__started:
+			self.loop.register(self)
+
+		# send what the server missed, then initially setup variables
+		self.resync()
+		self.setupVariables()
+
+	def __reconnect(self):
+		'''
+		Timed callback for retrying a connect.
+		'''
+
+		if self.__retry and self.__sock == None and self.__pending == None:
+			self.connect(True)
+
+	def start(self):
+		'''
+		Register the sensor with its loop (replaces starting the receiver thread), and
+		schedule its periodic tasks (see @tasks) on the loop.
+		'''
+
+		self.__started = True
+
+		if not self.__sock == None:
+			self.loop.register(self)
+
+		self.__tasks = self.tasks()
+
+		for task in self.__tasks:
+			task.onError = self.__taskFailed
+			self.loop.schedule(task)
+
+	def shutdown(self):
+		'''
+		Shutdown remote sensor connection
+		'''
+
+		if not self.__started:
+			return
+
+		logging.info("Shutting down connection to Scratch")
+
+		self.__started 	= False
+		self.__retry 	= False
+
+		for task in self.__tasks:
+			self.loop.unschedule(task)
+
+		self.__tasks = []
+
+		self.__close()
+
+	def __close(self):
+		'''
+		Remove socket from loop and close it.
+		'''
+
+		self.loop.unregister(self)
+
+		if not self.__pending == None:
+			self.loop.cancel(self.__timeout)
+			self.__pending.close()
+			self.__pending = None
+
+		self.__wlock.acquire()
+
+		try:
+			if not self.__sock == None:
+				self.__sock.close()
+			self.__sock = None
+			self.__wbuf = bytearray()
+		finally:
+			self.__wlock.release()
+
+	def __lost(self):
+		'''
+		Called when the connection to the server is gone.
+		'''
+
+		logging.warn("Lost connection to Scratch server!")
+
+		self.__close()
+
+		if self.__retry:
+			self.loop.callLater(self.backoff.next(), self.__reconnect)
+
+	def __taskFailed(self, task, e):
+		'''
+		Error handler of the periodic tasks: a socket error means the connection is lost.
+		'''
+
+		if isinstance(e, socket.error):
+			if not self.__sock == None:
+				self.__lost()
+		else:
+			logging.error("Task %s failed: %s" % (task.name, e))
+
+	def _writeFrame(self, msg):
+		'''
+		Queue an encoded message for sending (called by @RemoteSensor.sendRawMsg, which
+		did the encoding and tracing). Raises socket.error if not connected.
+
+		@param	msg		message as byte string (without the length header)
+		'''
+
+		self.__wlock.acquire()
+
+		try:
+			if self.__sock == None:
+				raise socket.error(errno.ENOTCONN, "Not connected to Scratch server")
+
+			self.__wbuf += HEADER.pack(len(msg))
+			self.__wbuf += msg
+
+			self.stats.framesOut = self.stats.framesOut + 1
+			self.stats.bytesOut = self.stats.bytesOut + len(msg)
+
+			self.__flush()
+			pending = len(self.__wbuf) > 0
+		finally:
+			self.__wlock.release()
+
+		if pending:
+			self.loop.wakeup()
+
+	def sendQueueBytes(self):
+		'''
+		@return		number of bytes waiting to be sent
+		'''
+
+		return len(self.__wbuf)
+
+	def __flush(self):
+		'''
+		Write as much of the output buffer as the socket accepts. Must be called with
+		the write lock held.
+		'''
+
+		try:
+			n = self.__sock.send(self.__wbuf)
+			del self.__wbuf[:n]
+		except socket.error as e:
+			if not e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				raise
+
+	def wantsWrite(self):
+		'''
+		@return		True if there is buffered output waiting for the socket (or a
+					connect in progress)
+		'''
+
+		return len(self.__wbuf) > 0 or not self.__pending == None
+
+	def handleWrite(self):
+		'''
+		Called by the loop when the socket is writable.
+		'''
+
+		if not self.__pending == None:
+			self.__finishConnect()
+			return
+
+		lost = False
+
+		self.__wlock.acquire()
+
+		try:
+			if not self.__sock == None:
+				self.__flush()
+		except socket.error:
+			lost = True
+		finally:
+			self.__wlock.release()
+
+		if lost:
+			self.__lost()
+
+	def handleRead(self):
+		'''
+		Called by the loop when the socket is readable. Parses every complete frame
+		received so far.
+		'''
+
+		if not self.__pending == None:
+			self.__finishConnect()
+			return
+
+		try:
+			n = self.__reader.fill()
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				return
+			n = 0
+
+		if not n:
+			self.__lost()
+			return
+
+		try:
+			msgs = self.__reader.frames(n)
+		except ValueError as e:
+			logging.error("Receiving from Scratch server failed: %s" % e)
+			self.__lost()
+			return
+
+		for msg in msgs:
+			try:
+				self.parseMsg(msg)
+			except Exception as e:
+				logging.error("Failed to handle message [%s]: %s" % (msg, e))
+
+__variants = {}
+
+def asyncVariant(cls):
+	'''
+	Create a variant of a @RemoteSensor subclass (e.g. a wrapper) which runs on a
+	@SensorLoop. The variant uses connect, start, shutdown and sending from
+	@AsyncRemoteSensor, everything else (handlers, worker, setupVariables) from cls.
+	The constructor of the variant takes the wrapper arguments and the loop:
+
+		MonitoringOnLoop = asyncVariant(MonitoringRemoteSensor)
+		rs = MonitoringOnLoop({ 'host' : 'localhost' }, loop)
+
+	@param	cls		@RemoteSensor subclass with a constructor taking the wrapper args
+	@return			new class derived from @AsyncRemoteSensor and cls
+	'''
+
+	if issubclass(cls, AsyncRemoteSensor):
+		return cls
+
+	if not __variants.has_key(cls):
+
+		def __init__(self, myArgs = {}, loop = None):
+			cls.__init__(self, myArgs)
+			self.attachLoop(loop)
+
+		__variants[cls] = type("Async" + cls.__name__, (AsyncRemoteSensor, cls), 
+			{ '__init__' : __init__ })
+
+	return __variants[cls]
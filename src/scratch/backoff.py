@@ -0,0 +1,98 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Delays between reconnect attempts. The delay doubles with every failed attempt
+(up to a maximum), and is randomized, thus many sensors losing the same server
+at once do not retry in lockstep when it comes back.
+
+The limits could be configured through the wrapper arguments:
+
+	reconnectmin=0.5:reconnectmax=30
+'''
+
+import random
+import logging
+
+DEFAULT_MIN = 0.5	# delay before the first retry (seconds)
+DEFAULT_MAX = 30.0	# max. delay between two retries (seconds)
+
+class Backoff:
+	'''
+	Exponential backoff with jitter: the n-th delay is randomly chosen between half
+	and all of min(maximum, initial * factor^n).
+	'''
+
+	def __init__(self, initial = DEFAULT_MIN, maximum = DEFAULT_MAX, factor = 2.0, jitter = 0.5):
+		'''
+		@param	initial		base delay of the first retry
+		@param	maximum		max. delay
+		@param	factor		growth of the delay per failed attempt
+		@param	jitter		fraction of the delay which is randomized (0 for none)
+		'''
+
+		self.initial 	= initial
+		self.maximum 	= maximum
+		self.factor 	= factor
+		self.jitter 	= jitter
+		self.attempts 	= 0
+
+	def next(self):
+		'''
+		@return		delay before the next attempt (in seconds)
+		'''
+
+		delay = min(self.maximum, self.initial * self.factor ** min(self.attempts, 64))
+
+		self.attempts = self.attempts + 1
+
+		return delay * (1.0 - self.jitter * random.random())
+
+	def reset(self):
+		'''
+		Start over with the initial delay (call after a successful connect).
+		'''
+
+		self.attempts = 0
+
+def backoffFromArgs(args):
+	'''
+	Build a @Backoff from wrapper arguments (see module documentation).
+
+	@param	args	dictionary of wrapper arguments
+	@return			@Backoff instance
+	'''
+
+	limits = { 'reconnectmin' : DEFAULT_MIN, 'reconnectmax' : DEFAULT_MAX }
+
+	for k in limits.keys():
+
+		if not args.has_key(k):
+			continue
+
+		try:
+			limits[k] = float(args[k])
+		except ValueError:
+			logging.warn("Invalid value [%s] for %s ignored" % (args[k], k))
+
+	return Backoff(limits['reconnectmin'], max(limits['reconnectmin'], limits['reconnectmax']))
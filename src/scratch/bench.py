@@ -0,0 +1,721 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Benchmarks for the remote sensor stack. Usage:
+
+	python -m scratch.bench parser [--count N]
+	python -m scratch.bench encoder [--count N]
+	python -m scratch.bench load [--clients N] [--rate R] [--duration S] [--mix MIX] 
+		[--engine async|thread] [--server HOST:PORT] [--json FILE] [--compare FILE]
+	python -m scratch.bench gpio [--rate R] [--duration S] [--pins N] [--inputs event|poll]
+
+The load benchmark starts a local stand-in server (unless --server is given) and
+N simulated clients, each sending R sensor-updates per second. Every update carries
+a probe variable, the time until the server echoes it back to the sender is taken
+as round-trip latency. Note that without --server, server and clients share one 
+process (and its CPU time).
+
+The GPIO benchmark runs the Raspberry Pi wrapper on the fake GPIO backend (see
+@scratch.gpio), toggles R inputs per second (round robin over N pins), and takes
+the time until a second client sees the update as input latency. Edges missed
+(e.g. a pin toggled twice between two polls) are counted as lost.
+'''
+
+import sys
+import time
+import json
+import resource
+import threading
+import argparse
+
+from scratch import msgparser
+
+# message mix used by the micro benchmarks
+SAMPLE_MSGS = [
+	'sensor-update "x" 12',
+	'sensor-update "x" 12 "y" -3 "speed" 0.75 "name" "robot"',
+	'sensor-update "a" 1 "b" 2 "c" 3 "d" 4 "e" 5 "f" 6 "g" 7 "h" 8',
+	'broadcast "go"',
+	'broadcast "turn left"',
+]
+
+def legacyParse(msg):
+	'''
+	Tokenizer as used by RemoteSensor.parseMsg up to version 0.1 (split based,
+	exceptions for numeric detection, per token debug logging). Kept as reference
+	for the parser benchmark.
+
+	@param	msg		raw message
+	@return			tuple (type, dict of variables or broadcasted message)
+	'''
+
+	import logging
+
+	melemRaw = msg.split()
+	melem = {}
+	mtype = None
+	mkey  = None
+	mval  = None
+
+	for e in melemRaw:
+
+		se = e.strip()
+
+		if mtype == None:
+			mtype = se.lower()
+		elif mkey == None:
+			mkey = se[1:-1]
+		else:
+			try:
+				if se[0:1] == '"':
+					mval = se[1:-1]
+				elif '.' in se:
+					mval = float(se)
+				else:
+					mval = int(se)
+			except:
+				mval = se
+
+			melem[mkey] = mval
+			mkey = None
+			mval = None
+
+		logging.debug("Element: %s" % se)
+
+	if mtype == 'sensor-update':
+		return (mtype, melem)
+
+	return (mtype, mkey)
+
+def timeit(func, msgs, count):
+	'''
+	Call func for count messages taken round robin from msgs.
+
+	@param	func	function to call with each message
+	@param	msgs	list of messages
+	@param	count	number of calls
+	@return			messages per second
+	'''
+
+	n = len(msgs)
+	start = time.time()
+
+	for i in xrange(count):
+		func(msgs[i % n])
+
+	return count / (time.time() - start)
+
+def benchParser(count, rounds = 5):
+	'''
+	Compare the msgparser module against the legacy tokenizer. The candidates take
+	turns for a number of rounds, and the best round of each counts (single rounds
+	vary a lot with the load of the machine).
+
+	@param	count	number of messages to parse per candidate and round
+	@param	rounds	number of rounds
+	@return			dictionary of results (messages per second)
+	'''
+
+	results = { 'legacy' : 0, 'msgparser' : 0 }
+
+	for i in range(rounds):
+		for (k, func) in (('legacy', legacyParse), ('msgparser', msgparser.parseMsg)):
+			results[k] = max(results[k], timeit(func, SAMPLE_MSGS, count))
+
+	for k in sorted(results.keys()):
+		print("%-12s %12.0f msg/s" % (k, results[k]))
+
+	print("%-12s %12.2fx" % ('speedup', results['msgparser'] / results['legacy']))
+
+	return results
+
+def legacyEncodeValue(value):
+	'''
+	Value encoding as used by RemoteSensor.encodeValue up to version 0.1. Kept as
+	reference for the encoder benchmark (together with @legacyEncodeUpdate).
+
+	@param	value	int, float or string value
+	@return			value as string
+	'''
+
+	if isinstance(value, (int, long)):
+		return "%d" % value 
+	elif isinstance(value, (float)):
+		return "%f" % value 
+	else:
+		return '"' +  value + '"'
+
+def legacyEncodeUpdate(values):
+	'''
+	Message building as used by RemoteSensor.encodeUpdate up to version 0.1 (name
+	quoted and value type dispatched on every call).
+
+	@param	values	list of name/value tuples
+	@return			message as string
+	'''
+
+	msg = 'sensor-update'
+
+	for (k, v) in values:
+		msg = msg + ' "' + k + '" ' + legacyEncodeValue(v)
+
+	return msg
+
+# updates for the encoder benchmark: candidate name -> list of name/value tuples
+SAMPLE_UPDATES = {
+	'int' 		: [ ('DIO17', 1) ],
+	'float' 	: [ ('temp', 21.5) ],
+	'string' 	: [ ('name', 'robot') ],
+	'multi' 	: [ ('m%d' % j, j * 3) for j in range(8) ],
+}
+
+def benchEncoder(count):
+	'''
+	Compare encoding updates through the variable encoders of @SensorValues (see
+	@scratch.encoding) against the legacy string building.
+
+	@param	count	number of messages to encode per candidate
+	@return			dictionary of results (messages per second)
+	'''
+
+	from scratch.remotesensor import SensorValues
+
+	sv 		= SensorValues(None)
+	results = {}
+
+	for (kind, values) in sorted(SAMPLE_UPDATES.items()):
+
+		legacy = legacyEncodeUpdate
+
+		if len(values) == 1:
+			encode = lambda values: sv.encodeVariable(*values[0])
+			legacy = lambda values: legacyEncodeUpdate(values)
+		else:
+			encode = sv.encodeUpdate
+
+		if not encode(values) == legacyEncodeUpdate(values):
+			raise AssertionError("Encoders disagree on %s: %r" % (kind, values))
+
+		results[kind] = { 
+			'legacy' 	: timeit(legacy, [values], count), 
+			'encoder' 	: timeit(encode, [values], count),
+		}
+
+		print("%-8s legacy %10.0f msg/s  encoder %10.0f msg/s  %6.2fx" % (kind, 
+			results[kind]['legacy'], results[kind]['encoder'], results[kind]['encoder'] / results[kind]['legacy']))
+
+	return results
+
+# payloads for the load benchmark: sequence number -> variables to update
+PAYLOADS = {
+	'int' 	: lambda i: { 'ival' : i },
+	'float' : lambda i: { 'fval' : i * 0.5 },
+	'string': lambda i: { 'sval' : 'value %d' % i },
+	'multi' : lambda i: dict(('m%d' % j, i + j) for j in range(8)),
+}
+
+def percentile(values, p):
+	'''
+	@param	values	sorted list of values
+	@param	p		percentile as fraction (e.g. 0.99)
+	@return			value at percentile p, None for an empty list
+	'''
+
+	if not values:
+		return None
+
+	return values[min(len(values) - 1, int(round(p * (len(values) - 1))))]
+
+class LoadClient:
+	'''
+	A simulated client of the load benchmark: a remote sensor plus the bookkeeping
+	for sent probes and measured round-trip times.
+	'''
+
+	def __init__(self, cid, sensor):
+		'''
+		@param	cid		client id
+		@param	sensor	connected remote sensor (using the inline dispatcher)
+		'''
+
+		self.sensor 	= sensor
+		self.probe 		= 'bench-rtt-%d' % cid
+		self.seq 		= 0
+		self.sent 		= {}	# probe sequence number -> time sent
+		self.rtts 		= []
+		self.framesIn 	= 0
+		self.bytesIn 	= 0
+
+		parseMsg = sensor.parseMsg
+
+		def countingParseMsg(msg):
+			self.framesIn 	= self.framesIn + 1
+			self.bytesIn 	= self.bytesIn + len(msg) + 4
+			parseMsg(msg)
+
+		sensor.parseMsg 		= countingParseMsg
+		sensor.updateHandler 	= self.update
+
+	def update(self, name, value):
+		'''
+		Update handler of the sensor, takes the time for echoed probes.
+		'''
+
+		if name == self.probe:
+			t = self.sent.pop(value, None)
+			if not t == None:
+				self.rtts.append(time.time() - t)
+
+	def send(self, payload):
+		'''
+		Send one update (payload plus probe).
+
+		@param	payload		function building the variables from the sequence number
+		@return				number of bytes sent (including header)
+		'''
+
+		self.seq = self.seq + 1
+
+		values = payload(self.seq)
+		values[self.probe] = self.seq
+
+		msg = self.sensor.encodeUpdate(values)
+
+		self.sent[self.seq] = time.time()
+		self.sensor.sendRawMsg(msg)
+
+		return len(msg) + 4
+
+def cpuTime():
+	'''
+	@return		user plus system CPU seconds used by this process
+	'''
+
+	r = resource.getrusage(resource.RUSAGE_SELF)
+	return r.ru_utime + r.ru_stime
+
+def waitFor(condition, timeout, what):
+	'''
+	Wait until a condition holds.
+
+	@param	condition	function returning True once the condition holds
+	@param	timeout		max. seconds to wait
+	@param	what		description of the condition (for the error raised on timeout)
+	'''
+
+	end = time.time() + timeout
+
+	while not condition():
+
+		if time.time() > end:
+			raise RuntimeError("Timed out waiting for %s" % what)
+
+		time.sleep(0.01)
+
+def benchLoad(clients, rate, duration, mix, engine = 'async', server = None, drain = 1.0):
+	'''
+	Run the end-to-end load benchmark.
+
+	@param	clients		number of simulated clients
+	@param	rate		updates per second sent by every client
+	@param	duration	seconds to send updates
+	@param	mix			list of payload names (see PAYLOADS) used round robin
+	@param	engine		'async' (all clients on one @SensorLoop) or 'thread' (@RemoteSensor)
+	@param	server		tuple (host, port) of server to use, None to start a local one
+	@param	drain		seconds to wait for outstanding echoes after sending
+	@return				dictionary of results
+	'''
+
+	from scratch.remotesensor import RemoteSensor
+	from scratch.asyncsensor import SensorLoop, AsyncRemoteSensor
+	from scratch.rsdummysrv import RemoteSensorServer
+
+	srv = None
+	threads = []
+
+	if server == None:
+		srv = RemoteSensorServer('127.0.0.1', 0, True)
+		threads.append(threading.Thread(target = srv.serve_forever))
+		server = srv.address
+
+	args = { 'host' : server[0], 'port' : str(server[1]), 'dispatcher' : 'inline' }
+	loop = None
+
+	if engine == 'async':
+		loop = SensorLoop()
+
+	load = []
+
+	for i in range(clients):
+
+		if loop == None:
+			sensor = RemoteSensor(args = args)
+		else:
+			sensor = AsyncRemoteSensor(args = args, loop = loop)
+
+		sensor.connect()
+		load.append(LoadClient(i, sensor))
+		sensor.start()
+
+	if not loop == None:
+		threads.append(threading.Thread(target = loop.run))
+
+	for t in threads:
+		t.daemon = True
+		t.start()
+
+	payloads 	= [PAYLOADS[m] for m in mix]
+	framesOut 	= 0
+	bytesOut 	= 0
+	interval 	= 1.0 / rate
+	tick 		= 0
+
+	cpuStart 	= cpuTime()
+	start 		= time.time()
+	due 		= start
+
+	while due < start + duration:
+
+		payload = payloads[tick % len(payloads)]
+
+		for c in load:
+			bytesOut = bytesOut + c.send(payload)
+
+		framesOut 	= framesOut + len(load)
+		tick 		= tick + 1
+		due 		= due + interval
+
+		time.sleep(max(0, due - time.time()))
+
+	sendTime = time.time() - start
+
+	time.sleep(drain)
+
+	elapsed = time.time() - start
+	cpu 	= cpuTime() - cpuStart
+
+	for c in load:
+		c.sensor.shutdown()
+
+	if not loop == None:
+		loop.stop()
+
+	if not srv == None:
+		srv.shutdown()
+
+	for t in threads:
+		t.join(1)
+
+	if loop == None:
+		for c in load:
+			c.sensor.join(1)
+
+	rtts = []
+
+	for c in load:
+		rtts.extend(c.rtts)
+
+	rtts.sort()
+
+	framesIn 	= sum([c.framesIn for c in load])
+	bytesIn 	= sum([c.bytesIn for c in load])
+	lost 		= sum([len(c.sent) for c in load])
+
+	def ms(v):
+		if v == None:
+			return None
+		return v * 1000.0
+
+	return {
+		'bench' 		: 'load',
+		'engine' 		: engine,
+		'clients' 		: clients,
+		'rate' 			: rate,
+		'duration' 		: duration,
+		'mix' 			: mix,
+		'localServer' 	: not srv == None,
+		'framesOut' 	: framesOut,
+		'framesIn' 		: framesIn,
+		'bytesOut' 		: bytesOut,
+		'bytesIn' 		: bytesIn,
+		'sendRate' 		: framesOut / sendTime,
+		'framesPerSec' 	: (framesOut + framesIn) / elapsed,
+		'bytesPerSec' 	: (bytesOut + bytesIn) / elapsed,
+		'cpuPerFrameUs' : cpu * 1000000.0 / max(1, framesOut + framesIn),
+		'latencyMs' 	: {
+			'samples' 	: len(rtts),
+			'lost' 		: lost,
+			'p50' 		: ms(percentile(rtts, 0.5)),
+			'p99' 		: ms(percentile(rtts, 0.99)),
+			'p999' 		: ms(percentile(rtts, 0.999)),
+			'max' 		: ms(percentile(rtts, 1.0)),
+		},
+	}
+
+def benchGpio(rate, duration, pins, inputs = 'event', drain = 1.0):
+	'''
+	Run the GPIO input benchmark.
+
+	@param	rate		input edges per second
+	@param	duration	seconds to toggle inputs
+	@param	pins		number of input pins to toggle
+	@param	inputs		'event' (edge events) or 'poll' (inputs polled by the worker)
+	@param	drain		seconds to wait for outstanding updates after toggling
+	@return				dictionary of results
+	'''
+
+	from scratch.asyncsensor import SensorLoop, AsyncRemoteSensor, asyncVariant
+	from scratch.rsdummysrv import RemoteSensorServer
+	from scratch.wrappers.rpi import PiRemoteSensor, PINS
+	from scratch.hub import WORKER_INTERVAL
+
+	srv = RemoteSensorServer('127.0.0.1', 0, True)
+	loop = SensorLoop()
+
+	threads = [threading.Thread(target = srv.serve_forever), threading.Thread(target = loop.run)]
+
+	# the server must accept the sensors before anything is published
+	for t in threads:
+		t.daemon = True
+		t.start()
+
+	args = { 'host' : srv.address[0], 'port' : str(srv.address[1]), 'dispatcher' : 'inline' }
+
+	pi = asyncVariant(PiRemoteSensor)(dict(args, gpio = 'fake', inputs = inputs), loop)
+	pi.workerInterval = WORKER_INTERVAL
+
+	# (variable, value) -> times the edges were driven, in order
+	pending = {}
+	latencies = []
+
+	def seen(var, value):
+		# an update reports the latest edge, earlier ones were missed
+		times = pending.pop((var, value), None)
+		if times:
+			latencies.append(time.time() - times[-1])
+
+	observer = AsyncRemoteSensor(args = args, loop = loop)
+	observer.updateHandler = seen
+
+	for sensor in (pi, observer):
+		sensor.connect()
+		sensor.start()
+
+	waitFor(lambda: len(srv.clients) == 2, 5, "the server to accept the sensors")
+
+	used = PINS[:pins]
+
+	srv.publish('sensor-update ' + ' '.join(['"DIO%d" 1' % pin for pin in used]))
+
+	waitFor(lambda: not [pin for pin in used if not pi.values.get('DIO%d' % pin) == 1], 5,
+		"the pins to become inputs")
+
+	interval 	= 1.0 / rate
+	edges 		= 0
+
+	cpuStart 	= cpuTime()
+	start 		= time.time()
+	due 		= start
+
+	while due < start + duration:
+
+		pin 	= used[edges % len(used)]
+		value 	= 1 - pi.gpio.input(pin)
+
+		pending.setdefault(('IO%d' % pin, value), []).append(time.time())
+		pi.gpio.drive(pin, value)
+
+		edges 	= edges + 1
+		due 	= due + interval
+
+		time.sleep(max(0, due - time.time()))
+
+	time.sleep(drain)
+
+	elapsed = time.time() - start
+	cpu 	= cpuTime() - cpuStart
+
+	for sensor in (pi, observer):
+		sensor.shutdown()
+
+	loop.stop()
+	srv.shutdown()
+
+	for t in threads:
+		t.join(1)
+
+	latencies.sort()
+
+	def ms(v):
+		if v == None:
+			return None
+		return v * 1000.0
+
+	return {
+		'bench' 		: 'gpio',
+		'inputs' 		: inputs,
+		'rate' 			: rate,
+		'duration' 		: duration,
+		'pins' 			: len(used),
+		'edges' 		: edges,
+		'edgesPerSec' 	: len(latencies) / elapsed,
+		'cpuPerEdgeUs' 	: cpu * 1000000.0 / max(1, edges),
+		'latencyMs' 	: {
+			'samples' 	: len(latencies),
+			'lost' 		: edges - len(latencies),
+			'p50' 		: ms(percentile(latencies, 0.5)),
+			'p99' 		: ms(percentile(latencies, 0.99)),
+			'max' 		: ms(percentile(latencies, 1.0)),
+		},
+	}
+
+def flatten(results, prefix = ''):
+	'''
+	@param	results		(nested) dictionary of results
+	@return				flat dictionary of the numeric results, nested keys joined by '.'
+	'''
+
+	flat = {}
+
+	for (k, v) in results.items():
+		if isinstance(v, dict):
+			flat.update(flatten(v, prefix + k + '.'))
+		elif isinstance(v, (int, long, float)) and not isinstance(v, bool):
+			flat[prefix + k] = v
+
+	return flat
+
+def report(results, previous = None):
+	'''
+	Print results, if previous results are given, together with the change.
+
+	@param	results		dictionary of results
+	@param	previous	dictionary of results of a previous run (or None)
+	'''
+
+	flat 	= flatten(results)
+	old 	= {}
+
+	if not previous == None:
+		old = flatten(previous)
+
+	for k in sorted(flat.keys()):
+
+		line = "%-24s %14.3f" % (k, flat[k])
+
+		if old.has_key(k) and not old[k] == None:
+			line = line + " %14.3f" % old[k]
+			if old[k]:
+				line = line + " %+8.1f%%" % ((flat[k] - old[k]) * 100.0 / old[k])
+
+		print(line)
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description='Scratch Remote Sensor benchmarks')
+
+	parser.add_argument('bench', metavar='BENCH', type=str,
+		help='Benchmark to run: parser, encoder, load, gpio')
+
+	parser.add_argument('--count', dest='count', metavar='N', default=200000, type=int,
+		help='Number of operations per candidate (parser, encoder)')
+
+	parser.add_argument('--rounds', dest='rounds', metavar='N', default=5, type=int,
+		help='Number of rounds, the best one counts (parser)')
+
+	parser.add_argument('--clients', dest='clients', metavar='N', default=10, type=int,
+		help='Number of simulated clients (load)')
+
+	parser.add_argument('--rate', dest='rate', metavar='R', default=20.0, type=float,
+		help='Updates per second sent by every client (load), input edges per second (gpio)')
+
+	parser.add_argument('--duration', dest='duration', metavar='SEC', default=10.0, type=float,
+		help='Seconds to send updates (load, gpio)')
+
+	parser.add_argument('--mix', dest='mix', metavar='MIX', default='int,float,string,multi', 
+		type=str, help='Comma separated payload mix: int, float, string, multi (load)')
+
+	parser.add_argument('--engine', dest='engine', metavar='ENGINE', default='async', type=str,
+		help='Client engine: async or thread (load)')
+
+	parser.add_argument('--server', dest='server', metavar='HOST:PORT', default=None, type=str,
+		help='Use this server instead of starting a local one (load)')
+
+	parser.add_argument('--pins', dest='pins', metavar='N', default=8, type=int,
+		help='Number of input pins to toggle (gpio)')
+
+	parser.add_argument('--inputs', dest='inputs', metavar='MODE', default='event', type=str,
+		help='Input mode of the Pi wrapper: event or poll (gpio)')
+
+	parser.add_argument('--json', dest='json', metavar='FILE', default=None, type=str,
+		help='Write results as JSON to FILE')
+
+	parser.add_argument('--compare', dest='compare', metavar='FILE', default=None, type=str,
+		help='Compare results with JSON results of a previous run')
+
+	args = parser.parse_args()
+
+	if args.bench == 'parser':
+		results = benchParser(args.count, args.rounds)
+	elif args.bench == 'encoder':
+		results = benchEncoder(args.count)
+	elif args.bench == 'load':
+
+		server = None
+
+		if args.server:
+			(host, port) = args.server.split(':')
+			server = (host, int(port))
+
+		mix = [m.strip() for m in args.mix.split(',')]
+
+		for m in mix:
+			if not PAYLOADS.has_key(m):
+				sys.stderr.write("Unknown payload [%s]\n" % m)
+				sys.exit(1)
+
+		results = benchLoad(args.clients, args.rate, args.duration, mix, args.engine, server)
+
+		previous = None
+
+		if args.compare:
+			previous = json.load(open(args.compare))
+
+		report(results, previous)
+	elif args.bench == 'gpio':
+
+		results = benchGpio(args.rate, args.duration, args.pins, args.inputs)
+
+		previous = None
+
+		if args.compare:
+			previous = json.load(open(args.compare))
+
+		report(results, previous)
+	else:
+		sys.stderr.write("Unknown benchmark [%s]\n" % args.bench)
+		sys.exit(1)
+
+	if args.json:
+		json.dump(results, open(args.json, 'w'), indent=4, sort_keys=True)
@@ -0,0 +1,397 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Capture of protocol traffic to a compact binary file, and time accurate replay
+of such captures. Usage:
+
+	python -m scratch.capture info FILE
+	python -m scratch.capture replay FILE [--speed N|max] [--server HOST:PORT]
+	python -m scratch.capture replay FILE [--speed N|max] [--wrap WRAPPER] [--wrapargs ARGS]
+
+Replaying to a server sends the outgoing frames of the capture (as sent by the
+sensor) to the server. Replaying to a wrapper feeds the incoming frames (as
+received by the sensor) to the parser and call-back handlers of a new wrapper
+instance, without connecting it.
+
+File format (all numbers in network byte order):
+
+	header		8 bytes magic "SRSCAP01", 8 bytes start time (double, seconds
+				since the epoch)
+	record		8 bytes time offset to start (double, seconds, never decreasing),
+				1 byte direction ('>' outgoing, '<' incoming), 4 bytes payload
+				length, payload
+
+Captures are enabled through the protocol trace facility:
+
+	TRACE.configure(capture = CaptureWriter('/tmp/srs.cap'))
+'''
+
+import sys
+import time
+import mmap
+import struct
+import socket
+import logging
+import threading
+import argparse
+
+from scratch.framing import packFrames
+
+MAGIC 	= 'SRSCAP01'
+HEADER 	= struct.Struct('!8sd')		# magic, start time
+RECORD 	= struct.Struct('!dcI')		# time offset, direction, payload length
+
+class CaptureWriter:
+	'''
+	Writes frames to a capture file. May be used from many threads. Frames are
+	buffered, but written to the file at least every flushInterval seconds (thus
+	a capture is usable even if the process gets killed).
+	'''
+
+	flushInterval = 1.0
+
+	def __init__(self, path):
+		'''
+		Create (or truncate) a capture file.
+
+		@param	path	file to write
+		'''
+
+		self.path 		= path
+		self.frames 	= 0
+
+		self.__lock 	= threading.Lock()
+		self.__file 	= open(path, 'wb')
+		self.__start 	= time.time()
+		self.__last 	= 0.0
+		self.__flushed 	= 0.0
+
+		self.__file.write(HEADER.pack(MAGIC, self.__start))
+
+	def record(self, direction, msg):
+		'''
+		Append a frame to the capture.
+
+		@param	direction	'>' for outgoing, '<' for incoming frames
+		@param	msg			message as byte string (without length header), the length
+							recorded is its number of bytes
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			if self.__file == None:
+				return
+
+			# the wall clock may be set back, offsets must not go back with it
+			offset = time.time() - self.__start
+
+			if offset < self.__last:
+				offset = self.__last
+
+			self.__last 	= offset
+			self.frames 	= self.frames + 1
+
+			self.__file.write(RECORD.pack(offset, direction, len(msg)))
+			self.__file.write(msg)
+
+			if offset - self.__flushed >= self.flushInterval:
+				self.__file.flush()
+				self.__flushed = offset
+		finally:
+			self.__lock.release()
+
+	def flush(self):
+		'''
+		Write buffered frames to the file.
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			if not self.__file == None:
+				self.__file.flush()
+		finally:
+			self.__lock.release()
+
+	def close(self):
+		'''
+		Close the capture file. Frames recorded afterwards are dropped.
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			if not self.__file == None:
+				self.__file.close()
+				self.__file = None
+		finally:
+			self.__lock.release()
+
+class CaptureReader:
+	'''
+	Reads a capture file through a memory map.
+	'''
+
+	def __init__(self, path):
+		'''
+		Open a capture file.
+
+		@param	path	file to read
+		'''
+
+		self.path = path
+
+		f = open(path, 'rb')
+
+		try:
+			self.__map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		finally:
+			f.close()
+
+		if len(self.__map) < HEADER.size:
+			raise ValueError("%s is not a capture file" % path)
+
+		(magic, self.start) = HEADER.unpack_from(self.__map, 0)
+
+		if not magic == MAGIC:
+			raise ValueError("%s is not a capture file" % path)
+
+	def __iter__(self):
+		'''
+		Iterate over all records of the capture. A record truncated at the end of the
+		file (e.g. from a capture still being written) ends the iteration.
+
+		@return		iterator over (offset, direction, msg) tuples
+		'''
+
+		m 	= self.__map
+		end = len(m)
+		pos = HEADER.size
+
+		while pos + RECORD.size <= end:
+
+			(offset, direction, l) = RECORD.unpack_from(m, pos)
+			pos = pos + RECORD.size
+
+			if pos + l > end:
+				break
+
+			yield (offset, direction, m[pos:pos + l])
+			pos = pos + l
+
+	def frames(self, direction = None):
+		'''
+		Iterate over the records of one direction.
+
+		@param	direction	'>' or '<', None for both
+		@return				iterator over (offset, direction, msg) tuples
+		'''
+
+		for r in self:
+			if direction == None or r[1] == direction:
+				yield r
+
+	def close(self):
+		'''
+		Release the memory map.
+		'''
+
+		self.__map.close()
+
+def paced(records, speed = 1.0):
+	'''
+	Yield records at the pace they were captured.
+
+	@param	records		iterable of (offset, direction, msg) tuples
+	@param	speed		replay speed (2.0 is twice as fast), None for max. speed
+	@return				iterator over the records
+	'''
+
+	start 	= None
+	first 	= None
+
+	for r in records:
+
+		if not speed == None:
+
+			if start == None:
+				start = time.time()
+				first = r[0]
+
+			delay = start + (r[0] - first) / speed - time.time()
+
+			if delay > 0:
+				time.sleep(delay)
+
+		yield r
+
+def replayToServer(reader, host, port, speed = 1.0):
+	'''
+	Send the outgoing frames of a capture to a sensor server.
+
+	@param	reader		@CaptureReader
+	@param	host		server host
+	@param	port		server port
+	@param	speed		replay speed, None for max. speed
+	@return				number of frames sent
+	'''
+
+	sock = socket.create_connection((host, port))
+	sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+	buf = bytearray()
+	n 	= 0
+
+	try:
+		for (offset, direction, msg) in paced(reader.frames('>'), speed):
+			l = packFrames(buf, [msg])
+			sock.sendall(buffer(buf, 0, l))
+			n = n + 1
+	finally:
+		sock.close()
+
+	return n
+
+def replayToSensor(reader, sensor, speed = 1.0):
+	'''
+	Feed the incoming frames of a capture to the parser (and call-back handlers) of
+	a remote sensor.
+
+	@param	reader		@CaptureReader
+	@param	sensor		@RemoteSensor (needs not to be connected)
+	@param	speed		replay speed, None for max. speed
+	@return				number of frames parsed
+	'''
+
+	n = 0
+
+	for (offset, direction, msg) in paced(reader.frames('<'), speed):
+		sensor.parseMsg(msg)
+		n = n + 1
+
+	return n
+
+def info(reader):
+	'''
+	Summarize a capture.
+
+	@param	reader		@CaptureReader
+	@return				dictionary with 'start', 'duration', 'frames', 'bytes', and
+						frames per direction ('out', 'in')
+	'''
+
+	s = { 'start' : reader.start, 'duration' : 0.0, 'frames' : 0, 'bytes' : 0, 'out' : 0, 'in' : 0 }
+
+	for (offset, direction, msg) in reader:
+
+		s['duration'] 	= offset
+		s['frames'] 	= s['frames'] + 1
+		s['bytes'] 		= s['bytes'] + len(msg)
+
+		if direction == '>':
+			s['out'] = s['out'] + 1
+		else:
+			s['in'] = s['in'] + 1
+
+	return s
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description='Scratch Remote Sensor Capture Tool')
+
+	parser.add_argument('command', metavar='COMMAND', type=str, choices=['info', 'replay'],
+		help='info or replay')
+
+	parser.add_argument('file', metavar='FILE', type=str, help='Capture file')
+
+	parser.add_argument('--speed', dest='speed', metavar='N', default='1', type=str,
+		help='Replay speed factor, or max to replay as fast as possible')
+
+	parser.add_argument('--server', dest='server', metavar='HOST:PORT', default=None,
+		type=str, help='Replay outgoing frames to this server')
+
+	parser.add_argument('--wrap', dest='wrapper', metavar='WRAPPER',
+		default='scratch.wrappers.mon#MonitoringRemoteSensor', type=str,
+		help='Replay incoming frames to this wrapper (if no server is given)')
+
+	parser.add_argument('--wrapargs', metavar='ARGS', dest='wrapargs', type=str,
+		help='Arguments to pass to wrapper instance for configuration')
+
+	parser.add_argument('--loglevel', dest='loglevel', metavar='NUMBER', default='WARN',
+		type=str, help='Loglevel to use')
+
+	args = parser.parse_args()
+
+	logging.basicConfig(level=args.loglevel, format='%(asctime)s %(levelname)-8s %(message)s')
+
+	try:
+		reader = CaptureReader(args.file)
+	except (IOError, ValueError) as e:
+		sys.stderr.write("%s\n" % e)
+		sys.exit(1)
+
+	if args.command == 'info':
+
+		s = info(reader)
+
+		print("start     %s" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(s['start'])))
+		print("duration  %.3f sec." % s['duration'])
+		print("frames    %d (%d out, %d in)" % (s['frames'], s['out'], s['in']))
+		print("bytes     %d" % s['bytes'])
+
+		sys.exit(0)
+
+	if args.speed == 'max':
+		speed = None
+	else:
+		speed = float(args.speed)
+
+	start = time.time()
+
+	if not args.server == None:
+
+		(host, port) = args.server.rsplit(':', 1)
+		n = replayToServer(reader, host, int(port), speed)
+
+	else:
+
+		from scratch.wrappers.daemon import importWrapper
+
+		wa = {}
+
+		if args.wrapargs:
+			for a in args.wrapargs.split(':'):
+				kv = a.split('=')
+				wa[kv[0].strip()] = kv[1].strip()
+
+		# run handlers inline, thus the replay measures them too
+		if not wa.has_key('dispatcher'):
+			wa['dispatcher'] = 'inline'
+
+		n = replayToSensor(reader, importWrapper(args.wrapper)(wa), speed)
+
+	elapsed = time.time() - start
+
+	print("replayed %d frames in %.3f sec. (%.0f frames/sec.)" % (n, elapsed, n / max(elapsed, 1e-9)))
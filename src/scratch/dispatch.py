@@ -0,0 +1,338 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Dispatchers decide in which thread the call-back handlers of a @RemoteSensor
+are run:
+
+	inline		handler runs in the receiving thread (no extra threads at all)
+	thread		a new thread per call (behaviour up to version 0.1)
+	pool		bounded pool of worker threads fed by a bounded queue
+	serial		bounded pool, but calls with the same key (e.g. the same
+				variable) are run one after the other in order of arrival
+'''
+
+import threading
+import thread
+import logging
+import Queue
+import time
+
+from collections import deque
+
+from scratch.metrics import HANDLERS
+
+DEFAULT_WORKERS 	= 4		# worker threads used by the pooled dispatchers
+DEFAULT_DISPATCHER 	= 'serial'	# dispatcher used for unknown names
+DEFAULT_MAX_QUEUE 	= 1000	# max. calls queued before dispatch blocks
+TIMING_SAMPLE 		= 8		# run time of one out of this many handler calls is measured
+
+class Dispatcher:
+	'''
+	Base class for dispatchers. Runs the calls inline.
+	'''
+
+	def __init__(self):
+
+		self._lock 			= threading.Lock()
+		self._dispatched 	= 0		# calls dispatched so far
+		self._queued 		= 0		# calls queued but not yet finished
+		self._maxQueued 	= 0		# high water mark of _queued
+		self._slots 		= None	# semaphore bounding _queued (if any)
+		self._calls 		= 0		# handler calls so far (for sampling the run time)
+
+	def dispatch(self, key, func, args):
+		'''
+		Run func(*args).
+
+		@param	key		calls with the same key are related (e.g. variable name)
+		@param	func	handler to call
+		@param	args	tuple of arguments for func
+		'''
+
+		self._dispatched = self._dispatched + 1
+		self._call(func, args)
+
+	def _call(self, func, args):
+		'''
+		Run a handler, log exceptions raised by it. The run time of every TIMING_SAMPLE'th
+		call is added to the handler metrics.
+		'''
+
+		# not locked: a lost increment only shifts the sampling
+		timed = not self._calls % TIMING_SAMPLE
+		self._calls = self._calls + 1
+
+		if timed:
+			start = time.time()
+
+		try:
+			func(*args)
+		except Exception as e:
+			logging.error("Handler %s%s failed: %s" % (getattr(func, '__name__', repr(func)), args, e))
+
+		if timed:
+			HANDLERS.observe(time.time() - start)
+
+	def _enqueued(self):
+		'''
+		Account for a queued call. Must be called with _lock held.
+		'''
+
+		self._dispatched 	= self._dispatched + 1
+		self._queued 		= self._queued + 1
+
+		if self._queued > self._maxQueued:
+			self._maxQueued = self._queued
+
+	def _finished(self):
+		'''
+		Account for a finished queued call.
+		'''
+
+		self._lock.acquire()
+		self._queued = self._queued - 1
+		self._lock.release()
+
+		if not self._slots == None:
+			self._slots.release()
+
+	def stats(self):
+		'''
+		@return		dictionary with 'dispatched' (calls so far), 'queued' (calls not yet
+					finished), 'maxQueued' (high water mark of queued) and 'threads'
+		'''
+
+		return {
+			'dispatched': self._dispatched,
+			'queued' 	: self._queued,
+			'maxQueued' : self._maxQueued,
+			'threads' 	: 0,
+		}
+
+class InlineDispatcher(Dispatcher):
+	'''
+	Runs every handler directly within the receiving thread. Handlers must not block.
+	'''
+	pass
+
+class ThreadDispatcher(Dispatcher):
+	'''
+	Starts a new thread for every call (no limit, no ordering).
+	'''
+
+	def dispatch(self, key, func, args):
+
+		self._lock.acquire()
+		self._enqueued()
+		self._lock.release()
+
+		thread.start_new_thread(self.__run, (func, args))
+
+	def __run(self, func, args):
+
+		try:
+			self._call(func, args)
+		finally:
+			self._finished()
+
+	def stats(self):
+
+		s = Dispatcher.stats(self)
+		s['threads'] = self._queued
+		return s
+
+class PoolDispatcher(Dispatcher):
+	'''
+	Runs handlers in a bounded pool of worker threads (started on first use). If
+	maxQueue calls are waiting, dispatch blocks until a worker catches up.
+	'''
+
+	def __init__(self, workers = DEFAULT_WORKERS, maxQueue = DEFAULT_MAX_QUEUE):
+		'''
+		@param	workers		number of worker threads
+		@param	maxQueue	max. number of waiting calls
+		'''
+
+		Dispatcher.__init__(self)
+
+		self._workers 	= workers
+		self._threads 	= []
+		self._queue 	= Queue.Queue()
+		self._slots 	= threading.Semaphore(maxQueue)
+
+	def _startWorkers(self):
+		'''
+		Start worker threads if not done yet. Must be called with _lock held.
+		'''
+
+		while len(self._threads) < self._workers:
+			t = threading.Thread(target = self._work)
+			t.daemon = True
+			t.start()
+			self._threads.append(t)
+
+	def dispatch(self, key, func, args):
+
+		self._slots.acquire()
+		self._lock.acquire()
+
+		try:
+			self._startWorkers()
+			self._enqueued()
+		finally:
+			self._lock.release()
+
+		self._queue.put((func, args))
+
+	def _work(self):
+		'''
+		Worker thread main loop.
+		'''
+
+		while True:
+
+			(func, args) = self._queue.get()
+
+			try:
+				self._call(func, args)
+			finally:
+				self._finished()
+
+	def stats(self):
+
+		s = Dispatcher.stats(self)
+		s['threads'] = len(self._threads)
+		return s
+
+class SerialDispatcher(PoolDispatcher):
+	'''
+	Like @PoolDispatcher, but calls sharing the same key are run strictly one after the
+	other (in order of arrival). Calls with different keys run in parallel.
+	'''
+
+	def __init__(self, workers = DEFAULT_WORKERS, maxQueue = DEFAULT_MAX_QUEUE):
+
+		PoolDispatcher.__init__(self, workers, maxQueue)
+
+		self.__keys 	= {}	# key -> deque of pending calls, first one is running
+		self.__maxDepth = 0		# high water mark of a single key queue
+
+	def dispatch(self, key, func, args):
+
+		self._slots.acquire()
+		self._lock.acquire()
+
+		try:
+			self._startWorkers()
+			self._enqueued()
+
+			q = self.__keys.get(key)
+
+			if q == None:
+				q = deque()
+				self.__keys[key] = q
+
+			q.append((func, args))
+
+			if len(q) > self.__maxDepth:
+				self.__maxDepth = len(q)
+
+			# only the first call of a key is handed to the workers, the others
+			# are handed over when their predecessor finished
+			ready = len(q) == 1
+		finally:
+			self._lock.release()
+
+		if ready:
+			self._queue.put(key)
+
+	def _work(self):
+
+		while True:
+
+			key = self._queue.get()
+
+			self._lock.acquire()
+			(func, args) = self.__keys[key][0]
+			self._lock.release()
+
+			try:
+				self._call(func, args)
+			finally:
+
+				self._lock.acquire()
+
+				try:
+					q = self.__keys[key]
+					q.popleft()
+
+					if q:
+						again = True
+					else:
+						again = False
+						del self.__keys[key]
+				finally:
+					self._lock.release()
+
+				self._finished()
+
+				if again:
+					self._queue.put(key)
+
+	def stats(self):
+		'''
+		@return		like @Dispatcher.stats, additionally 'keys' (keys with pending calls)
+					and 'maxKeyDepth' (high water mark of calls pending for one key)
+		'''
+
+		s = PoolDispatcher.stats(self)
+		s['keys'] 			= len(self.__keys)
+		s['maxKeyDepth'] 	= self.__maxDepth
+		return s
+
+DISPATCHERS = {
+	'inline': InlineDispatcher,
+	'thread': ThreadDispatcher,
+	'pool'	: PoolDispatcher,
+	'serial': SerialDispatcher,
+}
+
+def createDispatcher(name, workers = DEFAULT_WORKERS):
+	'''
+	Create a dispatcher by name. For an unknown name, a warning is logged and the
+	DEFAULT_DISPATCHER is created.
+
+	@param	name		one of 'inline', 'thread', 'pool' or 'serial'
+	@param	workers		number of worker threads for 'pool' and 'serial'
+	@return				dispatcher instance
+	'''
+
+	if not DISPATCHERS.has_key(name):
+		logging.warn("Unknown dispatcher [%s] ignored, using %s" % (name, DEFAULT_DISPATCHER))
+		name = DEFAULT_DISPATCHER
+
+	if name in ('pool', 'serial'):
+		return DISPATCHERS[name](workers)
+
+	return DISPATCHERS[name]()
@@ -0,0 +1,109 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Encoding of 'sensor-update' messages. A sensor updates the same few variables
+over and over, thus every variable gets a @VariableEncoder holding its quoted
+name and one format string per value type, built once:
+
+	enc = VariableEncoder('temp')
+
+	enc.update(21.5)		# 'sensor-update "temp" 21.500000'
+	enc.encode(21.5)		# ' "temp" 21.500000' (to join many into one message)
+
+Values are encoded the same way as by @RemoteSensor.encodeValue: integers
+(and booleans) as "%d", floats as "%f", strings enclosed in double quotes.
+'''
+
+UPDATE = 'sensor-update'
+
+# value type -> value format (subclasses are looked up through their base)
+VALUE_FORMATS = {
+	int 	: '%d',
+	long 	: '%d',
+	bool 	: '%d',
+	float 	: '%f',
+	str 	: '"%s"',
+	unicode : '"%s"',
+}
+
+class VariableEncoder:
+	'''
+	Encodes the values of one variable.
+	'''
+
+	def __init__(self, name):
+		'''
+		@param	name	name of the variable
+		'''
+
+		self.name 		= name
+		self.prefix 	= ' "' + name + '" '
+
+		# the name must not be taken as format
+		escaped = self.prefix.replace('%', '%%')
+
+		self.fragments 	= {}	# value type -> format of ' "name" value'
+		self.updates 	= {}	# value type -> format of 'sensor-update "name" value'
+
+		for (t, f) in VALUE_FORMATS.items():
+			self.fragments[t] 	= escaped + f
+			self.updates[t] 	= UPDATE + escaped + f
+
+	def encode(self, value):
+		'''
+		@param	value	int, float or string value
+		@return			' "name" value', to be appended to a 'sensor-update' message
+		'''
+
+		try:
+			return self.fragments[type(value)] % value
+		except KeyError:
+			return self.prefix + encodeValue(value)
+
+	def update(self, value):
+		'''
+		@param	value	int, float or string value
+		@return			'sensor-update "name" value' message
+		'''
+
+		try:
+			return self.updates[type(value)] % value
+		except KeyError:
+			return UPDATE + self.prefix + encodeValue(value)
+
+def encodeValue(value):
+	'''
+	Encode a value of a type without format of its own (e.g. a subclass of int).
+
+	@param	value	int, float or string value
+	@return			value as string
+	'''
+
+	if isinstance(value, (int, long)):
+		return "%d" % value
+	elif isinstance(value, float):
+		return "%f" % value
+	else:
+		return '"' + value + '"'
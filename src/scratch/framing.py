@@ -0,0 +1,323 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Framing of remote sensor protocol messages: every message on the wire is
+preceded by its length as 4 byte unsigned int in network byte order.
+'''
+
+import errno
+import socket
+import struct
+import threading
+import logging
+
+HEADER 		= struct.Struct('!I')	# length header preceding every message
+HEADER_SIZE = HEADER.size
+ENCODING 	= 'utf-8'				# encoding of unicode messages (Scratch expects UTF-8)
+
+def encodeFrame(msg):
+	'''
+	@param	msg		message as string or unicode
+	@return			message as byte string (the length header counts its bytes)
+	'''
+
+	if isinstance(msg, unicode):
+		return msg.encode(ENCODING)
+
+	return msg
+
+def packFrames(buf, msgs):
+	'''
+	Encode messages (header and payload) into a reusable buffer. The buffer is grown
+	if needed, but never shrunk.
+
+	@param	buf		bytearray to encode into
+	@param	msgs	list of messages (strings without header)
+	@return			number of bytes used in buf
+	'''
+
+	size = 0
+
+	for msg in msgs:
+		size = size + HEADER_SIZE + len(msg)
+
+	if len(buf) < size:
+		buf.extend(bytearray(size - len(buf)))
+
+	pos = 0
+
+	for msg in msgs:
+		l = len(msg)
+		HEADER.pack_into(buf, pos, l)
+		pos = pos + HEADER_SIZE
+		buf[pos:pos + l] = msg
+		pos = pos + l
+
+	return pos
+
+class FrameWriter(threading.Thread):
+	'''
+	Writer thread owning the sending side of a socket. Messages are queued by @put
+	(from any thread, without blocking on the socket). The writer takes everything
+	queued so far, encodes it into one buffer and writes it with a single call.
+	Thus frames from different threads never interleave.
+
+	If writing fails, the writer stops and the error is raised by the next call
+	to @put.
+	'''
+
+	bufKeep = 65536		# max. size of the reusable buffer kept after a burst
+
+	def __init__(self, sock, stats = None):
+		'''
+		Create a new writer (call start to run it).
+
+		@param	sock	connected socket to write to
+		@param	stats	@scratch.metrics.SensorStats to count written frames in
+		'''
+
+		threading.Thread.__init__(self)
+		self.daemon = True
+
+		self.error 		= None	# exception which stopped the writer
+
+		self.__sock 	= sock
+		self.__stats 	= stats
+		self.__buf 		= bytearray(4096)
+		self.__queue 	= []
+		self.__stop 	= False
+		self.__cond 	= threading.Condition()
+
+	def put(self, msg):
+		'''
+		Queue a message for sending.
+
+		@param	msg		message (byte string without header, see @encodeFrame)
+		'''
+
+		self.__cond.acquire()
+
+		try:
+			if not self.error == None:
+				raise self.error
+
+			if self.__stop:
+				raise socket.error(errno.ENOTCONN, "Writer closed")
+
+			self.__queue.append(msg)
+			self.__cond.notify()
+		finally:
+			self.__cond.release()
+
+	def pending(self):
+		'''
+		@return		number of messages waiting to be written
+		'''
+
+		return len(self.__queue)
+
+	def pendingBytes(self):
+		'''
+		@return		number of bytes (including headers) waiting to be written
+		'''
+
+		return sum([len(msg) + HEADER_SIZE for msg in list(self.__queue)])
+
+	def close(self):
+		'''
+		Stop the writer after everything queued so far was written.
+		'''
+
+		self.__cond.acquire()
+
+		try:
+			self.__stop = True
+			self.__cond.notify()
+		finally:
+			self.__cond.release()
+
+	def run(self):
+		'''
+		Writer loop.
+		'''
+
+		while True:
+
+			self.__cond.acquire()
+
+			try:
+				while not self.__queue and not self.__stop:
+					self.__cond.wait()
+
+				msgs = self.__queue
+				self.__queue = []
+				stop = self.__stop
+			finally:
+				self.__cond.release()
+
+			if msgs:
+
+				try:
+					n = packFrames(self.__buf, msgs)
+					self.__sock.sendall(memoryview(self.__buf)[:n])
+				except socket.error as e:
+					logging.warn("Writing to Scratch server failed: %s" % e)
+					self.error = e
+					break
+				except Exception as e:
+					logging.exception("Writer stopped: %s" % e)
+					self.error = e
+					break
+
+				if not self.__stats == None:
+					self.__stats.framesOut = self.__stats.framesOut + len(msgs)
+					self.__stats.bytesOut = self.__stats.bytesOut + n - HEADER_SIZE * len(msgs)
+
+				if len(self.__buf) > self.bufKeep:
+					self.__buf = bytearray(self.bufKeep)
+
+			elif stop:
+				break
+
+class FrameReader:
+	'''
+	Buffered reader for the receiving side of a socket. Data is received with recv_into
+	directly into a growing buffer, and every complete frame contained in the buffer is
+	extracted per call to @frames. Frames split over several reads are handled, and
+	the payload is copied only once (when it is handed out as string).
+	'''
+
+	maxFrame = 16 * 1024 * 1024		# larger frames are considered a broken stream
+
+	def __init__(self, sock, bufSize = 8192):
+		'''
+		Create a new reader.
+
+		@param	sock		connected socket to read from
+		@param	bufSize		initial buffer size
+		'''
+
+		self.__sock 	= sock
+		self.__buf 		= bytearray(bufSize)
+		self.__start 	= 0		# start of data not yet handed out
+		self.__end 		= 0		# end of received data
+
+	def fill(self):
+		'''
+		Receive whatever is available (blocks on a blocking socket until data arrives).
+
+		@return		number of bytes received, 0 if the connection was closed
+		'''
+
+		if self.__end == len(self.__buf):
+			self.__makeRoom(len(self.__buf))
+
+		return self.__sock.recv_into(memoryview(self.__buf)[self.__end:])
+
+	def __makeRoom(self, need):
+		'''
+		Make sure there are at least need bytes free at the end of the buffer. Pending
+		data is moved to the front of the buffer first, if this is not enough, the buffer
+		is grown.
+
+		@param	need	number of free bytes needed after the pending data
+		'''
+
+		pending = self.__end - self.__start
+
+		if self.__start > 0:
+			self.__buf[0:pending] = self.__buf[self.__start:self.__end]
+			self.__start 	= 0
+			self.__end 		= pending
+
+		if len(self.__buf) - pending < need:
+			self.__buf.extend(bytearray(need - (len(self.__buf) - pending)))
+
+	def frames(self, n):
+		'''
+		Account for n freshly received bytes and extract all complete frames.
+
+		@param	n	number of bytes received by the last @fill
+		@return		list of messages (payload as string)
+		'''
+
+		self.__end = self.__end + n
+
+		buf 	= self.__buf
+		view 	= memoryview(buf)
+		pos 	= self.__start
+		end 	= self.__end
+		msgs 	= []
+
+		while end - pos >= HEADER_SIZE:
+
+			(l, ) = HEADER.unpack_from(buf, pos)
+
+			if l > self.maxFrame:
+				raise ValueError("Frame of %d bytes exceeds limit, stream broken?" % l)
+
+			if end - pos - HEADER_SIZE < l:
+				break
+
+			pos = pos + HEADER_SIZE
+			msgs.append(view[pos:pos + l].tobytes())
+			pos = pos + l
+
+		# the buffer can not be resized while a view is exported
+		del view
+
+		if pos == end:
+			# everything consumed, start over at the beginning
+			self.__start 	= 0
+			self.__end 		= 0
+		else:
+			self.__start = pos
+
+			# make sure a partial frame will fit into the buffer
+			if end - pos >= HEADER_SIZE:
+				(l, ) = HEADER.unpack_from(buf, pos)
+				if pos + HEADER_SIZE + l > len(buf):
+					self.__makeRoom(HEADER_SIZE + l - (end - pos))
+
+		return msgs
+
+	def read(self):
+		'''
+		Receive and extract frames. Blocks on a blocking socket until at least one 
+		complete frame is available.
+
+		@return		list of messages, None if the connection was closed
+		'''
+
+		while True:
+
+			n = self.fill()
+
+			if not n:
+				return None
+
+			msgs = self.frames(n)
+
+			if msgs:
+				return msgs
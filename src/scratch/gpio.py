@@ -0,0 +1,631 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+GPIO backends used by the Raspberry Pi wrapper (see @scratch.wrappers.rpi). A
+backend drives output pins, reads input pins and, if it supports edge events,
+reports input changes through a call-back as soon as the kernel notices them
+(instead of having the sensor poll the inputs):
+
+	gpio = createBackend('cdev')
+	gpio.setup(24, IN)
+	gpio.watch(24, lambda pin, value: logging.info("IO%d is %d" % (pin, value)))
+
+Many inputs are read at once with @GpioBackend.sample, which takes and returns a
+bitmask (bit n for BCM pin n). The 'rpi' backend reads the level register of the
+SoC for this, the 'cdev' backend holds all polled inputs in one line handle.
+
+Available backends:
+
+	rpi		RPi.GPIO library (edge events through add_event_detect)
+	cdev	GPIO character device of the kernel (/dev/gpiochip0, Linux 4.8+)
+	fake	in-memory pins for testing without a Pi (see @FakeGpioBackend)
+
+All pin numbers are BCM numbers (the line offsets of the first GPIO chip).
+'''
+
+import os
+import mmap
+import errno
+import fcntl
+import select
+import struct
+import logging
+import threading
+
+IN 		= 'in'
+OUT 	= 'out'
+
+LOW 	= 0
+HIGH 	= 1
+
+class GpioBackend:
+	'''
+	Interface of a GPIO backend. Call-backs registered with @watch are called with the 
+	pin and its new value, from a thread of the backend.
+	'''
+
+	events = False	# True if the backend supports @watch
+
+	def setup(self, pin, direction):
+		'''
+		Configure a pin as input (with pull-down) or output.
+
+		@param	pin			BCM pin number
+		@param	direction	IN or OUT
+		'''
+		raise NotImplementedError()
+
+	def output(self, pin, value):
+		'''
+		Set the value of an output pin.
+
+		@param	pin		BCM pin number
+		@param	value	LOW or HIGH
+		'''
+		raise NotImplementedError()
+
+	def input(self, pin):
+		'''
+		@param	pin		BCM pin number
+		@return			current value of the pin (LOW or HIGH)
+		'''
+		raise NotImplementedError()
+
+	def sample(self, mask):
+		'''
+		Read many pins at once. Backends able to read a whole bank with one operation 
+		overwrite this, the default reads pin by pin.
+
+		@param	mask	bitmask of the pins to read (bit n for BCM pin n)
+		@return			bitmask of the pins of mask which are HIGH
+		'''
+
+		bank 	= 0
+		pin 	= 0
+		pins 	= mask
+
+		while pins:
+
+			if pins & 1 and self.input(pin):
+				bank = bank | (1 << pin)
+
+			pins 	= pins >> 1
+			pin 	= pin + 1
+
+		return bank
+
+	def watch(self, pin, callback):
+		'''
+		Report every change of an input pin. 
+
+		@param	pin			BCM pin number (configured as input)
+		@param	callback	called with pin and new value on every edge
+		'''
+		raise NotImplementedError()
+
+	def unwatch(self, pin):
+		'''
+		Stop reporting changes of a pin (nothing happens if it was not watched).
+
+		@param	pin		BCM pin number
+		'''
+		pass
+
+	def close(self):
+		'''
+		Release all pins.
+		'''
+		pass
+
+# level register of GPIO bank 0 (pins 0 to 31) within /dev/gpiomem
+LEVEL_REGISTER_SOCS = ('BCM2835', 'BCM2836', 'BCM2837', 'BCM2711')
+LEVEL_REGISTER 		= struct.Struct('<I')
+GPLEV0 				= 0x34
+
+class RPiGpioBackend(GpioBackend):
+	'''
+	Backend using the RPi.GPIO library.
+	'''
+
+	events = True
+
+	def __init__(self):
+
+		import RPi.GPIO
+
+		self.__gpio = RPi.GPIO
+		self.__gpio.setmode(RPi.GPIO.BCM)
+		self.__watched = {}
+		self.__levels = None
+
+		# the level register of the BCM283x/BCM2711 holds all pins of bank 0
+		if getattr(RPi.GPIO, 'RPI_INFO', {}).get('PROCESSOR') in LEVEL_REGISTER_SOCS:
+			try:
+				f = open('/dev/gpiomem', 'r+b')
+				try:
+					self.__levels = mmap.mmap(f.fileno(), 4096)
+				finally:
+					f.close()
+			except (IOError, OSError, mmap.error) as e:
+				logging.debug("Mapping /dev/gpiomem failed, sampling pin by pin: %s" % e)
+
+	def setup(self, pin, direction):
+
+		self.unwatch(pin)
+
+		if direction == OUT:
+			self.__gpio.setup(pin, self.__gpio.OUT)
+		else:
+			self.__gpio.setup(pin, self.__gpio.IN, pull_up_down = self.__gpio.PUD_DOWN)
+
+	def output(self, pin, value):
+
+		if value:
+			self.__gpio.output(pin, self.__gpio.HIGH)
+		else:
+			self.__gpio.output(pin, self.__gpio.LOW)
+
+	def input(self, pin):
+
+		if self.__gpio.input(pin):
+			return HIGH
+
+		return LOW
+
+	def sample(self, mask):
+
+		if self.__levels == None or mask >> 32:
+			return GpioBackend.sample(self, mask)
+
+		return LEVEL_REGISTER.unpack_from(self.__levels, GPLEV0)[0] & mask
+
+	def watch(self, pin, callback):
+
+		self.unwatch(pin)
+
+		# RPi.GPIO only passes the pin, read the level right after the edge
+		self.__gpio.add_event_detect(pin, self.__gpio.BOTH, 
+			callback = lambda channel: callback(channel, self.input(channel)))
+
+		self.__watched[pin] = True
+
+	def unwatch(self, pin):
+
+		if self.__watched.pop(pin, None):
+			self.__gpio.remove_event_detect(pin)
+
+	def close(self):
+
+		for pin in self.__watched.keys():
+			self.unwatch(pin)
+
+		if not self.__levels == None:
+			self.__levels.close()
+			self.__levels = None
+
+		self.__gpio.cleanup()
+
+# GPIO character device ABI (v1, see linux/gpio.h)
+GPIOHANDLE_REQUEST_INPUT 			= 1 << 0
+GPIOHANDLE_REQUEST_OUTPUT 			= 1 << 1
+GPIOHANDLE_REQUEST_BIAS_PULL_DOWN 	= 1 << 6
+GPIOEVENT_REQUEST_BOTH_EDGES 		= 0x03
+GPIOEVENT_EVENT_RISING_EDGE 		= 0x01
+
+GPIO_GET_LINEHANDLE_IOCTL 			= 0xC16CB403
+GPIO_GET_LINEEVENT_IOCTL 			= 0xC030B404
+GPIOHANDLE_GET_LINE_VALUES_IOCTL 	= 0xC040B408
+GPIOHANDLE_SET_LINE_VALUES_IOCTL 	= 0xC040B409
+
+HANDLE_REQUEST 	= struct.Struct('=64II64B32sIi')	# struct gpiohandle_request
+EVENT_REQUEST 	= struct.Struct('=III32si')			# struct gpioevent_request
+LINE_VALUES 	= struct.Struct('=64B')				# struct gpiohandle_data
+EVENT_DATA 		= struct.Struct('=QI4x')			# struct gpioevent_data
+
+CONSUMER = 'scratch-srs'
+
+class CdevGpioBackend(GpioBackend):
+	'''
+	Backend using the GPIO character device of the kernel. Outputs are requested as
+	an own line handle each, watched pins as line event (whose edges are read by a
+	thread of the backend). All other inputs share one line handle (the input bank),
+	thus @sample reads them with a single ioctl.
+
+	The backend may be used from several threads: setting up a pin replaces the
+	line handle of the input bank, which must not be read meanwhile.
+	'''
+
+	events = True
+
+	def __init__(self, chip = '/dev/gpiochip0'):
+		'''
+		@param	chip	path of the GPIO chip device
+		'''
+
+		self.__chip 	= os.open(chip, os.O_RDWR)
+		self.__lines 	= {}	# pin -> fd of its line handle or line event
+		self.__watched 	= {}	# event fd -> (pin, callback)
+		self.__bank 	= None	# fd of the line handle of the input bank
+		self.__bankPins = []	# pins of the input bank, in order of the lines
+		self.__lock 	= threading.Lock()		# guards the watched lines and the thread
+		self.__linesLock = threading.RLock()	# guards the lines and the input bank
+		self.__thread 	= None
+		self.__started 	= False
+
+		# wakes up the event thread when the watched pins change
+		(self.__wakeupRead, self.__wakeupWrite) = os.pipe()
+
+	def __release(self, pin):
+		'''
+		Release the line of a pin (its own line, or its line within the input bank).
+		'''
+
+		if pin in self.__bankPins:
+			self.__requestBank([p for p in self.__bankPins if not p == pin])
+			return
+
+		fd = self.__lines.pop(pin, None)
+
+		if fd == None:
+			return
+
+		self.__lock.acquire()
+
+		try:
+			self.__watched.pop(fd, None)
+		finally:
+			self.__lock.release()
+
+		self.__wakeup()
+		os.close(fd)
+
+	def __wakeup(self):
+		'''
+		Make the event thread pick up the changed set of watched pins.
+		'''
+
+		if self.__started:
+			os.write(self.__wakeupWrite, 'x')
+
+	def __requestHandle(self, pins, flags):
+		'''
+		@return		fd of a new line handle for a list of pins
+		'''
+
+		offsets = pins + [0] * (64 - len(pins))
+		req = bytearray(HANDLE_REQUEST.pack(*(offsets + [flags] + [0] * 64 + [CONSUMER, len(pins), 0])))
+
+		fcntl.ioctl(self.__chip, GPIO_GET_LINEHANDLE_IOCTL, req, True)
+
+		return HANDLE_REQUEST.unpack_from(buffer(req))[-1]
+
+	def __requestBank(self, pins):
+		'''
+		Replace the line handle of the input bank by one for the given pins.
+		'''
+
+		if not self.__bank == None:
+			os.close(self.__bank)
+			self.__bank = None
+
+		self.__bankPins = pins
+
+		if not pins:
+			return
+
+		try:
+			self.__bank = self.__requestHandle(pins, GPIOHANDLE_REQUEST_INPUT | GPIOHANDLE_REQUEST_BIAS_PULL_DOWN)
+		except IOError as e:
+			if not e.errno == errno.EINVAL:
+				raise
+			# kernels before 5.5 do not know about bias
+			self.__bank = self.__requestHandle(pins, GPIOHANDLE_REQUEST_INPUT)
+
+	def __values(self, fd):
+		'''
+		@return		line values read from a line handle or line event
+		'''
+
+		data = bytearray(LINE_VALUES.size)
+
+		fcntl.ioctl(fd, GPIOHANDLE_GET_LINE_VALUES_IOCTL, data, True)
+
+		return data
+
+	def setup(self, pin, direction):
+
+		self.__linesLock.acquire()
+
+		try:
+			self.__release(pin)
+
+			if direction == OUT:
+				self.__lines[pin] = self.__requestHandle([pin], GPIOHANDLE_REQUEST_OUTPUT)
+			else:
+				self.__requestBank(self.__bankPins + [pin])
+		finally:
+			self.__linesLock.release()
+
+	def output(self, pin, value):
+
+		self.__linesLock.acquire()
+
+		try:
+			data = [0] * 64
+			data[0] = int(bool(value))
+
+			fcntl.ioctl(self.__lines[pin], GPIOHANDLE_SET_LINE_VALUES_IOCTL, bytearray(LINE_VALUES.pack(*data)), True)
+		finally:
+			self.__linesLock.release()
+
+	def input(self, pin):
+
+		self.__linesLock.acquire()
+
+		try:
+			if pin in self.__bankPins:
+				return int(bool(self.__values(self.__bank)[self.__bankPins.index(pin)]))
+
+			return int(bool(self.__values(self.__lines[pin])[0]))
+		finally:
+			self.__linesLock.release()
+
+	def sample(self, mask):
+
+		self.__linesLock.acquire()
+
+		try:
+			bank = 0
+
+			if mask & self.__bankMask():
+				data = self.__values(self.__bank)
+				for (i, pin) in enumerate(self.__bankPins):
+					if data[i]:
+						bank = bank | (1 << pin)
+
+			# watched pins are not part of the bank
+			for (pin, fd) in self.__lines.items():
+				if mask & (1 << pin) and self.__watched.has_key(fd) and self.__values(fd)[0]:
+					bank = bank | (1 << pin)
+
+			return bank & mask
+		finally:
+			self.__linesLock.release()
+
+	def __bankMask(self):
+		'''
+		@return		bitmask of the pins in the input bank
+		'''
+
+		mask = 0
+
+		for pin in self.__bankPins:
+			mask = mask | (1 << pin)
+
+		return mask
+
+	def watch(self, pin, callback):
+
+		self.__linesLock.acquire()
+
+		try:
+			self.__release(pin)
+
+			req = bytearray(EVENT_REQUEST.pack(pin, GPIOHANDLE_REQUEST_INPUT, GPIOEVENT_REQUEST_BOTH_EDGES, CONSUMER, 0))
+
+			fcntl.ioctl(self.__chip, GPIO_GET_LINEEVENT_IOCTL, req, True)
+
+			# a line event reads values like a line handle
+			fd = EVENT_REQUEST.unpack_from(buffer(req))[-1]
+			self.__lines[pin] = fd
+
+			self.__lock.acquire()
+
+			try:
+				self.__watched[fd] = (pin, callback)
+
+				if self.__thread == None:
+					self.__thread = threading.Thread(target = self.__events, name = 'gpio-events')
+					self.__thread.daemon = True
+					self.__thread.start()
+					self.__started = True
+			finally:
+				self.__lock.release()
+
+			self.__wakeup()
+		finally:
+			self.__linesLock.release()
+
+	def unwatch(self, pin):
+
+		self.__linesLock.acquire()
+
+		try:
+			fd = self.__lines.get(pin)
+
+			if not fd == None and self.__watched.has_key(fd):
+				self.setup(pin, IN)
+		finally:
+			self.__linesLock.release()
+
+	def __events(self):
+		'''
+		Thread reading the edges of the watched lines.
+		'''
+
+		while True:
+
+			self.__lock.acquire()
+
+			try:
+				if self.__thread == None:
+					return
+				fds = self.__watched.keys()
+			finally:
+				self.__lock.release()
+
+			try:
+				(r, w, x) = select.select(fds + [self.__wakeupRead], [], [])
+			except (select.error, OSError):
+				continue
+
+			if self.__wakeupRead in r:
+				os.read(self.__wakeupRead, 4096)
+
+			for fd in r:
+
+				watched = self.__watched.get(fd)
+
+				if watched == None:
+					continue
+
+				try:
+					data = os.read(fd, EVENT_DATA.size * 16)
+				except OSError:
+					continue
+
+				(pin, callback) = watched
+
+				for off in range(0, len(data) - EVENT_DATA.size + 1, EVENT_DATA.size):
+
+					(timestamp, edge) = EVENT_DATA.unpack_from(data, off)
+
+					try:
+						callback(pin, int(edge == GPIOEVENT_EVENT_RISING_EDGE))
+					except Exception as e:
+						logging.error("GPIO call-back for pin %d failed: %s" % (pin, e))
+
+	def close(self):
+
+		self.__linesLock.acquire()
+
+		try:
+			self.__lock.acquire()
+
+			try:
+				self.__thread = None
+			finally:
+				self.__lock.release()
+
+			for pin in self.__lines.keys():
+				self.__release(pin)
+
+			self.__requestBank([])
+			self.__wakeup()
+			os.close(self.__chip)
+		finally:
+			self.__linesLock.release()
+
+class FakeGpioBackend(GpioBackend):
+	'''
+	In-memory backend for testing without a Pi. Outputs keep the value set, inputs
+	are driven from the outside through @drive (which calls the call-back of a 
+	watched pin in the driving thread, like an edge interrupt).
+	'''
+
+	events = True
+
+	def __init__(self):
+
+		self.levels 	= {}	# pin -> current value
+		self.directions = {}	# pin -> IN or OUT
+		self.bank 		= 0		# bitmask of the pins which are HIGH
+		self.__watched 	= {}	# pin -> call-back
+
+	def setup(self, pin, direction):
+
+		self.unwatch(pin)
+
+		self.directions[pin] = direction
+		self.__level(pin, LOW)
+
+	def __level(self, pin, value):
+		'''
+		Set the level of a pin.
+		'''
+
+		self.levels[pin] = value
+
+		if value:
+			self.bank = self.bank | (1 << pin)
+		else:
+			self.bank = self.bank & ~(1 << pin)
+
+	def output(self, pin, value):
+		self.__level(pin, int(bool(value)))
+
+	def input(self, pin):
+		return self.levels.get(pin, LOW)
+
+	def sample(self, mask):
+		return self.bank & mask
+
+	def watch(self, pin, callback):
+		self.__watched[pin] = callback
+
+	def unwatch(self, pin):
+		self.__watched.pop(pin, None)
+
+	def drive(self, pin, value):
+		'''
+		Change the level of an input pin from the outside.
+
+		@param	pin		BCM pin number
+		@param	value	LOW or HIGH
+		'''
+
+		value = int(bool(value))
+
+		if self.levels.get(pin) == value:
+			return
+
+		self.__level(pin, value)
+
+		callback = self.__watched.get(pin)
+
+		if not callback == None:
+			callback(pin, value)
+
+	def close(self):
+		self.__watched.clear()
+
+BACKENDS = {
+	'rpi' 	: RPiGpioBackend,
+	'cdev' 	: CdevGpioBackend,
+	'fake' 	: FakeGpioBackend,
+}
+
+def createBackend(name):
+	'''
+	Create a GPIO backend by name.
+
+	@param	name	one of 'rpi', 'cdev' or 'fake'
+	@return			backend instance
+	'''
+
+	if not BACKENDS.has_key(name):
+		raise ValueError("Unknown GPIO backend [%s]" % name)
+
+	return BACKENDS[name]()
@@ -0,0 +1,159 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Host many remote sensors (e.g. wrappers) within one process. Each sensor has
+its own connection to the server, but all of them share one @SensorLoop for
+I/O and timing (the periodic tasks of the sensors, e.g. worker and liveness check).
+
+Minimal Usage example:
+----------------------
+
+from scratch.hub import SensorHub
+from scratch.wrappers.mon import MonitoringRemoteSensor
+
+hub = SensorHub()
+hub.addWrapper(MonitoringRemoteSensor, { 'host' : 'localhost' })
+hub.addWrapper(MyRemoteSensor, { 'host' : 'localhost' })
+hub.run()
+'''
+
+from scratch.remotesensor import RemoteSensor
+from scratch.asyncsensor import SensorLoop, AsyncRemoteSensor, asyncVariant
+from scratch.dispatch import SerialDispatcher
+
+WORKER_INTERVAL 	= 0.1	# default seconds between two worker calls
+HEARTBEAT_INTERVAL 	= None	# default seconds between two heartbeat broadcasts (None for none)
+
+def ownSetting(sensor, name, default):
+	'''
+	@return		value of an attribute set by the sensor itself (on the instance or its
+				class), default if it only inherits the one of @RemoteSensor (or of
+				@AsyncRemoteSensor, which variants from @asyncVariant put first)
+	'''
+
+	if sensor.__dict__.has_key(name):
+		return sensor.__dict__[name]
+
+	for cls in type(sensor).__mro__:
+
+		if cls in (AsyncRemoteSensor, RemoteSensor):
+			continue
+
+		if cls.__dict__.has_key(name):
+			return cls.__dict__[name]
+
+	return default
+
+class SensorHub:
+	'''
+	Runs any number of sensors on one shared @SensorLoop. Sensors created by
+	@addWrapper also share one handler dispatcher (unless their arguments ask
+	for an own one).
+	'''
+
+	def __init__(self, loop = None):
+		'''
+		Create a new hub.
+
+		@param	loop	@SensorLoop to use, if None a new one is created
+		'''
+
+		if loop == None:
+			loop = SensorLoop()
+
+		self.loop 		= loop
+		self.sensors 	= []
+		self.dispatcher = SerialDispatcher()
+
+	def addWrapper(self, cls, args = {}, workerInterval = WORKER_INTERVAL, heartbeat = HEARTBEAT_INTERVAL):
+		'''
+		Create a sensor from a wrapper class (a @RemoteSensor subclass whose constructor
+		takes the wrapper arguments) and add it to the hub.
+
+		@param	cls				wrapper class
+		@param	args			wrapper arguments
+		@param	workerInterval	seconds between two worker calls, None for no worker calls
+								(unless the wrapper sets its own)
+		@param	heartbeat		seconds between two heartbeats, None for no heartbeats
+								(unless the wrapper sets its own)
+		@return					the sensor created
+		'''
+
+		sensor = asyncVariant(cls)(args, self.loop)
+
+		if not args.has_key('dispatcher'):
+			sensor.dispatcher = self.dispatcher
+
+		self.add(sensor, workerInterval, heartbeat)
+
+		return sensor
+
+	def add(self, sensor, workerInterval = WORKER_INTERVAL, heartbeat = HEARTBEAT_INTERVAL):
+		'''
+		Add an @AsyncRemoteSensor using the hubs loop. The worker interval and the
+		heartbeat given apply if the sensor does not set its own (see @ownSetting).
+
+		@param	sensor			sensor to add
+		@param	workerInterval	seconds between two worker calls, None for no worker calls
+		@param	heartbeat		seconds between two heartbeats, None for no heartbeats
+		'''
+
+		if not sensor.loop is self.loop:
+			raise ValueError("Sensor %s does not use the loop of the hub" % sensor.name)
+
+		sensor.workerInterval 	= ownSetting(sensor, 'workerInterval', workerInterval)
+		sensor.heartbeat 		= ownSetting(sensor, 'heartbeat', heartbeat)
+
+		self.sensors.append(sensor)
+
+	def start(self):
+		'''
+		Connect all sensors (retrying in the background if the server is not reachable)
+		and start them (which schedules their periodic tasks on the loop).
+		'''
+
+		for sensor in self.sensors:
+
+			sensor.connect(True)
+			sensor.start()
+
+	def run(self):
+		'''
+		Start all sensors and serve them until @stop is called.
+		'''
+
+		self.start()
+
+		try:
+			self.loop.run()
+		finally:
+			for sensor in self.sensors:
+				sensor.shutdown()
+
+	def stop(self):
+		'''
+		Make @run return.
+		'''
+
+		self.loop.stop()
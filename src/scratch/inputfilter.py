@@ -0,0 +1,196 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Filters for sampled digital inputs, suppressing contact bounce and glitches. A
+filter is fed with every sample of an input (and the time it was taken), and
+only changes its output once the input changed in a stable way:
+
+	debounce	the input must keep its new value for a time window (in ms)
+	integrate	a counter goes up for every HIGH and down for every LOW sample
+				(within 0 and N), the output changes when it reaches 0 or N
+	majority	the output is the value of the majority of the last N samples
+
+Usage:
+
+	f = createFilter('debounce', 20)
+	f.reset(0, time.time())
+
+	if f.feed(sample, time.time()):
+		report(f.value)
+'''
+
+class InputFilter:
+	'''
+	Base of the input filters.
+	'''
+
+	value = 0	# filtered value of the input
+
+	def reset(self, value, now):
+		'''
+		Start over with a known input value.
+
+		@param	value	current value of the input (0 or 1)
+		@param	now		current time
+		'''
+		self.value = value
+
+	def feed(self, value, now):
+		'''
+		Feed a sample.
+
+		@param	value	sampled value of the input (0 or 1)
+		@param	now		time the sample was taken
+		@return			True if the filtered value changed
+		'''
+		raise NotImplementedError()
+
+class DebounceFilter(InputFilter):
+	'''
+	Accepts a new value once it was stable for the window.
+	'''
+
+	def __init__(self, window):
+		'''
+		@param	window	seconds the input needs to keep a new value
+		'''
+
+		self.window 		= window
+		self.__candidate 	= 0		# last value sampled
+		self.__since 		= 0.0	# time the candidate was first sampled
+
+	def reset(self, value, now):
+
+		self.value 			= value
+		self.__candidate 	= value
+		self.__since 		= now
+
+	def feed(self, value, now):
+
+		if not value == self.__candidate:
+			self.__candidate 	= value
+			self.__since 		= now
+
+		if value == self.value or now - self.__since < self.window:
+			return False
+
+		self.value = value
+
+		return True
+
+class IntegratorFilter(InputFilter):
+	'''
+	Integrates the samples, the output follows when the integral saturates.
+	'''
+
+	def __init__(self, length):
+		'''
+		@param	length	samples needed to change the output from 0 to 1 (or back)
+		'''
+
+		self.length 	= length
+		self.__count 	= 0
+
+	def reset(self, value, now):
+
+		self.value 		= value
+		self.__count 	= value * self.length
+
+	def feed(self, value, now):
+
+		if value:
+			self.__count = min(self.length, self.__count + 1)
+		else:
+			self.__count = max(0, self.__count - 1)
+
+		if self.__count == self.length and not self.value:
+			self.value = 1
+		elif self.__count == 0 and self.value:
+			self.value = 0
+		else:
+			return False
+
+		return True
+
+class MajorityFilter(InputFilter):
+	'''
+	Majority vote of the last samples.
+	'''
+
+	def __init__(self, length):
+		'''
+		@param	length	number of samples voting (should be odd)
+		'''
+
+		self.length 	= length
+		self.__samples 	= [0] * length
+		self.__next 	= 0		# index of the oldest sample
+		self.__ones 	= 0		# samples which are 1
+
+	def reset(self, value, now):
+
+		self.value 		= value
+		self.__samples 	= [value] * self.length
+		self.__ones 	= value * self.length
+
+	def feed(self, value, now):
+
+		i = self.__next
+
+		self.__ones 	= self.__ones - self.__samples[i] + value
+		self.__samples[i] = value
+		self.__next 	= (i + 1) % self.length
+
+		value = int(self.__ones * 2 > self.length)
+
+		if value == self.value:
+			return False
+
+		self.value = value
+
+		return True
+
+FILTERS = {
+	'debounce' 	: lambda ms: DebounceFilter(ms / 1000.0),
+	'integrate' : IntegratorFilter,
+	'majority' 	: MajorityFilter,
+}
+
+def createFilter(kind, param):
+	'''
+	Create an input filter by name.
+
+	@param	kind	one of 'debounce', 'integrate' or 'majority'
+	@param	param	window in ms for 'debounce', number of samples otherwise
+	@return			filter instance, None if param is 0 (no filtering)
+	'''
+
+	if not FILTERS.has_key(kind):
+		raise ValueError("Unknown input filter [%s]" % kind)
+
+	if param <= 0:
+		return None
+
+	return FILTERS[kind](param)
@@ -0,0 +1,214 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Liveness checking of the connection to the server. A half-open TCP connection
+(e.g. the server host lost power) is otherwise only noticed when the send buffer
+runs full, which may take minutes.
+
+Every frame received proves the connection is alive. Only if nothing was received
+for idle seconds, a probe is sent: an update of the private variable
+"srs-probe-<name>", which the server echoes to all of its clients. The time until
+the echo arrives is the round trip time (see @scratch.metrics.PROBE_RTT). If
+neither the echo nor any other frame arrives within timeout seconds, the
+connection is considered dead and the sensor reconnects.
+
+A missing echo only counts as failure if the server echoed a probe before on the
+same connection. Servers which do not echo updates are still covered by TCP
+keepalive (see @setKeepalive).
+
+The limits could be configured through the wrapper arguments (0 disables probing):
+
+	probeidle=5:probetimeout=5
+'''
+
+import time
+import errno
+import socket
+import logging
+
+from scratch import metrics
+
+PROBE_PREFIX 	= 'srs-probe-'	# prefix of the probe variable (followed by the sensor name)
+
+DEFAULT_IDLE 	= 5.0	# seconds without traffic before a probe is sent
+DEFAULT_TIMEOUT = 5.0	# seconds to wait for the echo of a probe
+
+KEEPALIVE_IDLE 		= 10	# seconds without traffic before the first keepalive
+KEEPALIVE_INTERVAL 	= 5		# seconds between two keepalives
+KEEPALIVE_COUNT 	= 3		# unanswered keepalives until the connection is dropped
+
+def setKeepalive(sock, idle = KEEPALIVE_IDLE, interval = KEEPALIVE_INTERVAL, count = KEEPALIVE_COUNT):
+	'''
+	Enable TCP keepalive on a socket. The timing is set where the platform supports
+	it (e.g. Linux), otherwise the system defaults (usually hours) apply.
+
+	@param	sock		connected socket
+	@param	idle		seconds without traffic before the first keepalive
+	@param	interval	seconds between two keepalives
+	@param	count		unanswered keepalives until the connection is dropped
+	'''
+
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+	for (opt, value) in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+
+		if not hasattr(socket, opt):
+			continue
+
+		try:
+			sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, opt), value)
+		except socket.error as e:
+			logging.debug("Setting %s failed: %s" % (opt, e))
+
+class LivenessProbe:
+	'''
+	Liveness check of the connection of one sensor. @check is run periodically (see 
+	@scratch.remotesensor.RemoteSensor.tasks), @received by the sensor whenever the
+	probe variable arrives. Probe variables are no sensor values: the sensor does not
+	store them, nor hand them to its handlers.
+	'''
+
+	pending = None	# number of the probe waiting for its echo, None if none
+
+	def __init__(self, sensor, idle = DEFAULT_IDLE, timeout = DEFAULT_TIMEOUT):
+		'''
+		@param	sensor		@scratch.remotesensor.RemoteSensor to check
+		@param	idle		seconds without traffic before a probe is sent
+		@param	timeout		seconds to wait for the echo of a probe
+		'''
+
+		self.sensor 	= sensor
+		self.idle 		= idle
+		self.timeout 	= timeout
+
+		self.rtt 		= None	# last round trip time measured (seconds)
+		self.echoes 	= False	# True if the server echoed a probe on this connection
+		self.probes 	= 0		# probes sent so far
+
+		self.__frames 	= 0		# frames received at the last check
+		self.__seen 	= 0.0	# time traffic was last seen
+		self.__sent 	= 0.0	# time the pending probe was sent
+
+		self.reset()
+
+	def reset(self):
+		'''
+		Start over for a new connection.
+		'''
+
+		self.pending 	= None
+		self.echoes 	= False
+		self.__frames 	= self.sensor.stats.framesIn
+		self.__seen 	= time.time()
+
+	def variable(self):
+		'''
+		@return		name of the probe variable of the sensor
+		'''
+
+		return PROBE_PREFIX + self.sensor.name
+
+	def check(self):
+		'''
+		Check the connection: send a probe if the connection was idle for too long,
+		raise socket.error if a probe timed out. Does nothing while not connected.
+		'''
+
+		sensor = self.sensor
+
+		if not sensor.isConnected():
+			return
+
+		now 	= time.time()
+		frames 	= sensor.stats.framesIn
+
+		if not frames == self.__frames:
+			self.__frames 	= frames
+			self.__seen 	= now
+
+		if not self.pending == None:
+
+			if self.__seen > self.__sent:
+				self.pending = None		# other traffic arrived, alive anyway
+			elif now - self.__sent < self.timeout:
+				return
+			elif self.echoes:
+				self.pending = None
+				metrics.PROBE_FAILURES.add((sensor.name,))
+				raise socket.error(errno.ETIMEDOUT, "No answer from Scratch server for %.1f sec." % 
+					(now - self.__seen))
+			else:
+				self.pending = None		# server does not echo, rely on keepalive
+
+		if now - self.__seen >= self.idle:
+			self.probes 	= self.probes + 1
+			self.__sent 	= now
+			self.pending 	= self.probes
+			sensor.sendUpdate({ self.variable() : self.probes })
+
+	def received(self, echo):
+		'''
+		Called by the sensor for updates of the probe variable: completes the pending
+		probe if its echo arrived.
+
+		@param	echo	value of the probe variable received
+		'''
+
+		pending = self.pending
+
+		if pending == None or not str(echo) == str(pending):
+			return
+
+		self.rtt 		= time.time() - self.__sent
+		self.pending 	= None
+		self.echoes 	= True
+
+		metrics.PROBE_RTT.labels(self.sensor.name).observe(self.rtt)
+
+def probeFromArgs(sensor, args):
+	'''
+	Build a @LivenessProbe from wrapper arguments (see module documentation).
+
+	@param	sensor	sensor to check
+	@param	args	dictionary of wrapper arguments
+	@return			@LivenessProbe instance, None if probing is disabled
+	'''
+
+	limits = { 'probeidle' : DEFAULT_IDLE, 'probetimeout' : DEFAULT_TIMEOUT }
+
+	for k in limits.keys():
+
+		if not args.has_key(k):
+			continue
+
+		try:
+			limits[k] = float(args[k])
+		except ValueError:
+			logging.warn("Invalid value [%s] for %s ignored" % (args[k], k))
+
+	if limits['probeidle'] <= 0 or limits['probetimeout'] <= 0:
+		return None
+
+	return LivenessProbe(sensor, limits['probeidle'], limits['probetimeout'])
@@ -0,0 +1,787 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Process wide metrics (counters, gauges, histograms) with an optional scrape
+endpoint serving them in the Prometheus text format.
+
+Counters and histograms keep their counts per thread, every thread only ever
+writes its own counts. Thus updating a metric takes no lock, the counts are
+summed up when the metrics are collected.
+
+The per frame counters of the remote sensors are even cheaper: each sensor owns
+a @SensorStats instance whose counters are plain attributes, written by one
+thread only (the receiving thread for incoming, the writing thread for outgoing
+frames). The metrics are computed from them on collection.
+
+Minimal Usage example:
+----------------------
+
+from scratch.metrics import REGISTRY, MetricsServer
+
+hits = REGISTRY.counter('my_hits_total', 'Hits so far')
+hits.inc()
+
+MetricsServer(9142).start()		# http://127.0.0.1:9142/metrics
+'''
+
+import os
+import time
+import bisect
+import weakref
+import logging
+import threading
+
+# default histogram buckets (seconds)
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+def formatLabels(names, values):
+	'''
+	@return		label set in text format, e.g. '{direction="in"}' (empty string
+				if there are no labels)
+	'''
+
+	if not names:
+		return ''
+
+	return '{' + ','.join(['%s="%s"' % (n, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+		for (n, v) in zip(names, values)]) + '}'
+
+def formatValue(value):
+	'''
+	@return		value in text format
+	'''
+
+	if isinstance(value, float):
+		if value == float('inf'):
+			return '+Inf'
+		return repr(value)
+
+	return str(value)
+
+class CellOwner:
+	'''
+	Kept by a thread (in a threading.local) for every @ThreadCells it wrote to. It
+	goes away with the thread, which tells the @ThreadCells to retire the cell.
+	'''
+
+	pass
+
+class ThreadCells:
+	'''
+	One cell per thread, written by its thread without locking. When a thread ends,
+	its cell is folded into a total, thus the number of cells is bounded by the
+	threads alive (threads of the 'thread' dispatcher come and go).
+	'''
+
+	def __init__(self, new, fold):
+		'''
+		@param	new		function returning an empty cell
+		@param	fold	function returning a new cell holding the sum of two cells
+		'''
+
+		self.__new 		= new
+		self.__fold 	= fold
+		self.__local 	= threading.local()
+		self.__cells 	= {}	# weak reference to a @CellOwner -> cell of its thread
+		self.__total 	= new()	# sum of the cells of the threads gone
+		self.__lock 	= threading.Lock()
+
+	def get(self):
+		'''
+		@return		cell of the calling thread
+		'''
+
+		try:
+			return self.__local.cell
+		except AttributeError:
+			pass
+
+		cell 	= self.__new()
+		owner 	= CellOwner()
+
+		self.__lock.acquire()
+
+		try:
+			self.__cells[weakref.ref(owner, self.__retire)] = cell
+		finally:
+			self.__lock.release()
+
+		self.__local.owner 	= owner
+		self.__local.cell 	= cell
+
+		return cell
+
+	def __retire(self, ref):
+		'''
+		Called when the thread owning a cell is gone: add the cell to the total.
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			cell = self.__cells.pop(ref, None)
+
+			# readers may still hold the old total, thus replace it
+			if not cell == None:
+				self.__total = self.__fold(self.__total, cell)
+		finally:
+			self.__lock.release()
+
+	def cells(self):
+		'''
+		@return		list of the cells of the threads alive and the total
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			return self.__cells.values() + [self.__total]
+		finally:
+			self.__lock.release()
+
+def foldTables(a, b):
+	'''
+	@return		new dictionary with the sums of two dictionaries of counts
+	'''
+
+	total = dict(a)
+
+	for (k, n) in b.items():
+		total[k] = total.get(k, 0) + n
+
+	return total
+
+def foldLists(a, b):
+	'''
+	@return		new list with the element-wise sums of two lists
+	'''
+
+	return [x + y for (x, y) in zip(a, b)]
+
+class CounterCell:
+	'''
+	A single counter (one label set of a @Counter).
+	'''
+
+	def __init__(self, counter, values):
+		self.counter 	= counter
+		self.values 	= values
+
+	def inc(self, n = 1):
+		'''
+		Increment the counter.
+
+		@param	n	amount to add
+		'''
+
+		self.counter.add(self.values, n)
+
+	def value(self):
+		'''
+		@return		current value
+		'''
+
+		return self.counter.value(self.values)
+
+class GaugeCell:
+	'''
+	A single gauge (one label set of a @Gauge).
+	'''
+
+	def __init__(self, values):
+		self.__value = 0
+
+	def set(self, value):
+		'''
+		Set the gauge.
+
+		@param	value	new value
+		'''
+
+		self.__value = value
+
+	def value(self):
+		'''
+		@return		current value
+		'''
+
+		return self.__value
+
+class HistogramCell:
+	'''
+	A single histogram (one label set of a @Histogram).
+	'''
+
+	def __init__(self, values, buckets):
+		self.buckets 	= buckets
+		# per thread: [count per bucket ..., +Inf count, sum]
+		self.__cells 	= ThreadCells(lambda: [0] * (len(buckets) + 1) + [0.0], foldLists)
+
+	def observe(self, value):
+		'''
+		Add an observation.
+
+		@param	value	value observed (e.g. a duration in seconds)
+		'''
+
+		cell 	= self.__cells.get()
+		i 		= bisect.bisect_left(self.buckets, value)
+
+		cell[i] = cell[i] + 1
+		cell[-1] = cell[-1] + value
+
+	def time(self):
+		'''
+		Observe the duration of a with-block:
+
+			with histogram.time():
+				work()
+		'''
+
+		return HistogramTimer(self)
+
+	def value(self):
+		'''
+		@return		tuple (cumulative counts per bucket including +Inf, sum)
+		'''
+
+		counts 	= [0] * (len(self.buckets) + 1)
+		total 	= 0.0
+
+		for cell in self.__cells.cells():
+			for i in range(len(counts)):
+				counts[i] = counts[i] + cell[i]
+			total = total + cell[-1]
+
+		for i in range(1, len(counts)):
+			counts[i] = counts[i] + counts[i - 1]
+
+		return (counts, total)
+
+class HistogramTimer:
+	'''
+	Context manager returned by @HistogramCell.time.
+	'''
+
+	def __init__(self, cell):
+		self.cell = cell
+
+	def __enter__(self):
+		self.start = time.time()
+		return self
+
+	def __exit__(self, excType, excValue, tb):
+		self.cell.observe(time.time() - self.start)
+		return False
+
+class Metric:
+	'''
+	Base class for metrics. A metric with label names holds one cell per label set
+	(see @labels), a metric without labels could be used directly like its cell.
+	'''
+
+	kind = None
+
+	def __init__(self, name, help, labelNames = (), function = None):
+		'''
+		@param	name		metric name
+		@param	help		one line description
+		@param	labelNames	tuple of label names
+		@param	function	if given, called on collection, returns a dictionary
+							mapping tuples of label values to values (added to
+							the values of the cells)
+		'''
+
+		self.name 		= name
+		self.help 		= help
+		self.labelNames = tuple(labelNames)
+		self.function 	= function
+
+		self.__cells 	= {}
+
+		if not self.labelNames:
+			self.cell = self.labels()
+
+	def _newCell(self, values):
+		raise NotImplementedError()
+
+	def labels(self, *values):
+		'''
+		Get the cell for a label set (created on first use).
+
+		@param	values	one value per label name
+		@return			the cell
+		'''
+
+		cell = self.__cells.get(values)
+
+		if cell == None:
+
+			if not len(values) == len(self.labelNames):
+				raise ValueError("Metric %s takes labels %s" % (self.name, self.labelNames))
+
+			cell = self.__cells.setdefault(values, self._newCell(values))
+
+		return cell
+
+	def cells(self):
+		'''
+		@return		list of (label values, cell) tuples
+		'''
+
+		return self.__cells.items()
+
+	def collected(self):
+		'''
+		@return		dictionary label values -> value computed by the function (empty
+					if there is no function)
+		'''
+
+		if self.function == None:
+			return {}
+
+		try:
+			return self.function()
+		except Exception as e:
+			logging.warn("Collecting metric %s failed: %s" % (self.name, e))
+			return {}
+
+	def _values(self):
+		'''
+		@return		dictionary label values -> value of the cells
+		'''
+
+		return dict([(values, cell.value()) for (values, cell) in self.cells()])
+
+	def samples(self):
+		'''
+		@return		list of (sample name, label names, label values, value) tuples
+		'''
+
+		totals = self._values()
+
+		for (values, v) in self.collected().items():
+			totals[values] = totals.get(values, 0) + v
+
+		return [(self.name, self.labelNames, values, v) for (values, v) in totals.items()]
+
+	def render(self):
+		'''
+		@return		metric in Prometheus text format
+		'''
+
+		lines = [
+			'# HELP %s %s' % (self.name, self.help),
+			'# TYPE %s %s' % (self.name, self.kind),
+		]
+
+		for (name, labelNames, values, value) in self.samples():
+			lines.append('%s%s %s' % (name, formatLabels(labelNames, values), formatValue(value)))
+
+		return '\n'.join(lines) + '\n'
+
+class Counter(Metric):
+	'''
+	Monotonically increasing counter.
+	'''
+
+	kind = 'counter'
+
+	def __init__(self, name, help, labelNames = (), function = None):
+
+		self.__tables = ThreadCells(dict, foldTables)	# per thread: label values -> count
+
+		Metric.__init__(self, name, help, labelNames, function)
+
+	def _newCell(self, values):
+		return CounterCell(self, values)
+
+	def add(self, values, n = 1):
+		'''
+		Add to the counter of a label set.
+
+		@param	values	tuple of label values (not checked against the label names)
+		@param	n		amount to add
+		'''
+
+		table = self.__tables.get()
+		table[values] = table.get(values, 0) + n
+
+	def inc(self, n = 1):
+		self.add((), n)
+
+	def value(self, values = ()):
+		'''
+		@param	values	tuple of label values
+		@return			current value of the counter of a label set
+		'''
+
+		return sum([t.get(values, 0) for t in self.__tables.cells()]) + self.collected().get(values, 0)
+
+	def _values(self):
+
+		totals = {}
+
+		for table in self.__tables.cells():
+			for (values, n) in table.items():
+				totals[values] = totals.get(values, 0) + n
+
+		return totals
+
+class Gauge(Metric):
+	'''
+	Value that goes up and down. Either set explicitly, or computed on collection by
+	a function.
+	'''
+
+	kind = 'gauge'
+
+	def _newCell(self, values):
+		return GaugeCell(values)
+
+	def set(self, value):
+		self.cell.set(value)
+
+class Histogram(Metric):
+	'''
+	Histogram of observed values (e.g. durations in seconds).
+	'''
+
+	kind = 'histogram'
+
+	def __init__(self, name, help, labelNames = (), buckets = DEFAULT_BUCKETS):
+		'''
+		@param	buckets		sorted upper bounds of the buckets (+Inf is added)
+		'''
+
+		self.buckets = tuple(buckets)
+
+		Metric.__init__(self, name, help, labelNames)
+
+	def _newCell(self, values):
+		return HistogramCell(values, self.buckets)
+
+	def observe(self, value):
+		self.cell.observe(value)
+
+	def time(self):
+		return self.cell.time()
+
+	def samples(self):
+
+		samples 	= []
+		bounds 		= [formatValue(b) for b in self.buckets] + ['+Inf']
+		names 		= self.labelNames + ('le',)
+
+		for (values, cell) in self.cells():
+
+			(counts, total) = cell.value()
+
+			for (b, c) in zip(bounds, counts):
+				samples.append((self.name + '_bucket', names, values + (b,), c))
+
+			samples.append((self.name + '_sum', self.labelNames, values, total))
+			samples.append((self.name + '_count', self.labelNames, values, counts[-1]))
+
+		return samples
+
+class Registry:
+	'''
+	Collection of metrics.
+	'''
+
+	def __init__(self):
+
+		self.__lock 	= threading.Lock()
+		self.__metrics 	= []
+
+	def register(self, metric):
+		'''
+		Add a metric.
+
+		@param	metric	@Metric to add
+		@return			metric
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			for m in self.__metrics:
+				if m.name == metric.name:
+					raise ValueError("Metric %s already registered" % metric.name)
+
+			self.__metrics.append(metric)
+		finally:
+			self.__lock.release()
+
+		return metric
+
+	def counter(self, name, help, labelNames = (), function = None):
+		return self.register(Counter(name, help, labelNames, function))
+
+	def gauge(self, name, help, labelNames = (), function = None):
+		return self.register(Gauge(name, help, labelNames, function))
+
+	def histogram(self, name, help, labelNames = (), buckets = DEFAULT_BUCKETS):
+		return self.register(Histogram(name, help, labelNames, buckets))
+
+	def get(self, name):
+		'''
+		@return		metric with the given name, None if there is none
+		'''
+
+		for m in list(self.__metrics):
+			if m.name == name:
+				return m
+
+		return None
+
+	def render(self):
+		'''
+		@return		all metrics in Prometheus text format
+		'''
+
+		return ''.join([m.render() for m in list(self.__metrics)])
+
+# the process wide registry
+REGISTRY = Registry()
+
+class SensorStats:
+	'''
+	Counters of one remote sensor. Every counter is written by one thread only, thus
+	they are plain attributes updated without locking.
+	'''
+
+	def __init__(self, name):
+
+		self.name 		= name	# name of the sensor (refreshed on collection)
+		self.framesIn 	= 0		# frames received
+		self.bytesIn 	= 0		# payload bytes received
+		self.framesOut 	= 0		# frames written to the socket
+		self.bytesOut 	= 0		# payload bytes written to the socket
+		self.connects 	= 0		# successful connects
+		self.updatesIn 	= {}	# variable name -> updates received
+
+	def merge(self, other):
+		'''
+		Add the counters of an other instance to this one.
+		'''
+
+		self.framesIn 	= self.framesIn + other.framesIn
+		self.bytesIn 	= self.bytesIn + other.bytesIn
+		self.framesOut 	= self.framesOut + other.framesOut
+		self.bytesOut 	= self.bytesOut + other.bytesOut
+		self.connects 	= self.connects + other.connects
+
+		for (k, n) in other.updatesIn.items():
+			self.updatesIn[k] = self.updatesIn.get(k, 0) + n
+
+# stats of the sensors alive (weak reference -> @SensorStats), see @track
+__sensors = {}
+
+# stats of the sensors gone, merged per sensor name
+__retired = {}
+
+def track(sensor):
+	'''
+	Take the stats of a remote sensor into account. Done by the constructor of
+	@RemoteSensor.
+	'''
+
+	__sensors[weakref.ref(sensor, __retire)] = sensor.stats
+
+def __retire(ref):
+	'''
+	Called when a tracked sensor is gone: keep its counts.
+	'''
+
+	stats = __sensors.pop(ref, None)
+
+	if stats == None:
+		return
+
+	retired = __retired.get(stats.name)
+
+	if retired == None:
+		retired = __retired.setdefault(stats.name, SensorStats(stats.name))
+
+	retired.merge(stats)
+
+def sensorStats():
+	'''
+	@return		list of @SensorStats of all sensors (alive or gone)
+	'''
+
+	stats = []
+
+	for (ref, s) in __sensors.items():
+
+		sensor = ref()
+
+		if not sensor == None:
+			s.name = sensor.name
+
+		stats.append(s)
+
+	return stats + __retired.values()
+
+def __frames():
+	frames = {IN : 0, OUT : 0}
+	for s in sensorStats():
+		frames[IN] 	= frames[IN] + s.framesIn
+		frames[OUT] = frames[OUT] + s.framesOut
+	return frames
+
+def __bytes():
+	n = {IN : 0, OUT : 0}
+	for s in sensorStats():
+		n[IN] 	= n[IN] + s.bytesIn
+		n[OUT] 	= n[OUT] + s.bytesOut
+	return n
+
+def __updates():
+	updates = {}
+	for s in sensorStats():
+		for (k, n) in s.updatesIn.items():
+			updates[(k, 'in')] = updates.get((k, 'in'), 0) + n
+	return updates
+
+def __connects():
+	connects = {}
+	for s in sensorStats():
+		connects[(s.name,)] = connects.get((s.name,), 0) + s.connects
+	return connects
+
+def __reconnects():
+	reconnects = {}
+	for s in sensorStats():
+		reconnects[(s.name,)] = reconnects.get((s.name,), 0) + max(0, s.connects - 1)
+	return reconnects
+
+def __sendQueues():
+	queues = {}
+	for ref in __sensors.keys():
+		sensor = ref()
+		if not sensor == None:
+			queues[(sensor.name,)] = queues.get((sensor.name,), 0) + sensor.sendQueueBytes()
+	return queues
+
+# label values for FRAMES and BYTES
+IN 	= ('in',)
+OUT = ('out',)
+
+# metrics of the remote sensor stack
+FRAMES 		= REGISTRY.counter('srs_frames_total', 'Protocol frames sent (out) or received (in)', 
+				('direction',), __frames)
+BYTES 		= REGISTRY.counter('srs_bytes_total', 'Payload bytes sent (out) or received (in)', 
+				('direction',), __bytes)
+UPDATES 	= REGISTRY.counter('srs_variable_updates_total', 'Updates per sensor variable', 
+				('variable', 'direction'), __updates)
+CONNECTS 	= REGISTRY.counter('srs_connects_total', 'Successful connects to the server', 
+				('sensor',), __connects)
+RECONNECTS 	= REGISTRY.counter('srs_reconnects_total', 'Successful connects after the first one', 
+				('sensor',), __reconnects)
+SEND_QUEUE 	= REGISTRY.gauge('srs_send_queue_bytes', 'Bytes waiting to be sent', 
+				('sensor',), __sendQueues)
+HANDLERS 	= REGISTRY.histogram('srs_handler_seconds', 'Run time of call-back handlers (sampled)')
+WORKERS 	= REGISTRY.histogram('srs_worker_seconds', 'Run time of the sensor worker', ('sensor',))
+TASKS 		= REGISTRY.histogram('srs_task_seconds', 'Run time of periodic tasks', ('task',))
+TASK_MISSED = REGISTRY.counter('srs_task_missed_total', 'Runs of periodic tasks skipped for being late', ('task',))
+TASK_OVERRUNS = REGISTRY.counter('srs_task_overruns_total', 'Runs of periodic tasks exceeding their deadline', ('task',))
+PROBE_RTT 	= REGISTRY.histogram('srs_probe_rtt_seconds', 'Round trip time of liveness probes', ('sensor',),
+				(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+PROBE_FAILURES = REGISTRY.counter('srs_probe_failures_total', 'Connections dropped for unanswered liveness probes', ('sensor',))
+
+def publish(sensor):
+	'''
+	Publish the main counters of a sensor (its own @SensorStats, not the totals of
+	the process, which would mix up the sensors of a hub) to the server as 'srs-*'
+	sensor variables (in one update).
+
+	@param	sensor	@RemoteSensor to publish with
+	'''
+
+	stats = sensor.stats
+
+	values = [
+		('srs-frames-in', 	stats.framesIn),
+		('srs-frames-out', 	stats.framesOut),
+		('srs-bytes-in', 	stats.bytesIn),
+		('srs-bytes-out', 	stats.bytesOut),
+		('srs-reconnects', 	max(0, stats.connects - 1)),
+		('srs-send-queue', 	sensor.sendQueueBytes()),
+	]
+
+	with sensor.values.batch():
+		for (name, value) in values:
+			sensor.values.set(name, value)
+
+class MetricsServer:
+	'''
+	Scrape endpoint serving a registry over HTTP, in a background thread.
+	'''
+
+	def __init__(self, address, registry = REGISTRY):
+		'''
+		@param	address		port (bound to 127.0.0.1), "host:port" or path of a Unix socket
+		@param	registry	@Registry to serve
+		'''
+
+		# the HTTP server modules take a while to import, only load them when serving
+		from scratch.metricshttp import MetricsHandler, TCPMetricsServer, UnixMetricsServer
+
+		address = str(address)
+
+		if address.isdigit():
+			self.server = TCPMetricsServer(('127.0.0.1', int(address)), MetricsHandler)
+		elif ':' in address:
+			(host, port) = address.rsplit(':', 1)
+			self.server = TCPMetricsServer((host, int(port)), MetricsHandler)
+		else:
+			# drop the socket left by a previous run
+			if os.path.exists(address):
+				os.unlink(address)
+			self.server = UnixMetricsServer(address, MetricsHandler)
+
+		self.server.registry = registry
+		self.address = self.server.server_address
+
+	def start(self):
+		'''
+		Start serving in a daemon thread.
+		'''
+
+		t = threading.Thread(target = self.server.serve_forever)
+		t.daemon = True
+		t.start()
+
+		logging.info("Serving metrics at %s" % (self.address,))
+
+	def stop(self):
+		'''
+		Stop serving.
+		'''
+
+		self.server.shutdown()
+		self.server.server_close()
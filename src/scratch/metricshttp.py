@@ -0,0 +1,60 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+HTTP request handler and servers of the metrics scrape endpoint (see
+@scratch.metrics.MetricsServer). Kept apart from @scratch.metrics, thus the HTTP
+server modules are only imported if metrics are served.
+'''
+
+import logging
+import SocketServer
+import BaseHTTPServer
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	'''
+	Serves the registry of the server on GET (any path).
+	'''
+
+	def do_GET(self):
+
+		body = self.server.registry.render()
+
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def address_string(self):
+		return str(self.client_address)
+
+	def log_message(self, format, *args):
+		logging.debug("Metrics: " + format % args)
+
+class TCPMetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads 		= True
+	allow_reuse_address = True
+
+class UnixMetricsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
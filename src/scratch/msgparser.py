@@ -0,0 +1,140 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Tokenizer/parser for remote sensor protocol messages like:
+
+	sensor-update "name" "hello world" "x" -12 "y" 0.5
+	broadcast "turn left"
+
+Strings are enclosed in double quotes, a double quote within a string is
+escaped by doubling it (""). Numbers are detected by the compiled token
+pattern, thus no exceptions are used for type detection.
+'''
+
+import re
+
+SENSOR_UPDATE 	= 'sensor-update'
+BROADCAST 		= 'broadcast'
+
+# Every match yields a tuple (quote, string, int, float, word), exactly one of
+# the groups is set. The quote group tells a string apart from a non-match
+# for empty strings ("").
+TOKEN = re.compile(r'''
+	(")((?:[^"]|"")*)"
+	|(-?\d+)(?=\s|$)
+	|(-?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?|-?\d+[eE][-+]?\d+)(?=\s|$)
+	|(\S+)
+	''', re.VERBOSE)
+
+class ParsedMsg(object):
+	'''
+	A parsed message.
+
+	For 'sensor-update' messages, pairs holds a list of (name, value) tuples, for
+	'broadcast' messages, message holds the message broadcasted.
+	'''
+
+	__slots__ = ('type', 'message', 'pairs')
+
+	def __init__(self, type, message = None, pairs = None):
+		'''
+		@param	type		message type (lower case)
+		@param	message		broadcasted message
+		@param	pairs		list of (name, value) tuples
+		'''
+
+		self.type 		= type
+		self.message 	= message
+		self.pairs 		= pairs
+
+	def __repr__(self):
+		return "ParsedMsg(%r, %r, %r)" % (self.type, self.message, self.pairs)
+
+def tokenize(msg):
+	'''
+	Split a message into its tokens in a single pass. Quoted strings are unquoted
+	(and unescaped), numbers converted to int or float.
+
+	@param	msg		raw message
+	@return			list of tokens
+	'''
+
+	tokens = []
+	append = tokens.append
+
+	for (q, s, i, f, w) in TOKEN.findall(msg):
+		if q:
+			if '""' in s:
+				s = s.replace('""', '"')
+			append(s)
+		elif i:
+			append(int(i))
+		elif f:
+			append(float(f))
+		else:
+			append(w)
+
+	return tokens
+
+def parseMsg(msg):
+	'''
+	Parse a raw message as received from the server.
+
+	@param	msg		raw message
+	@return			@ParsedMsg instance, None for an empty message
+	'''
+
+	tokens = tokenize(msg)
+
+	if not tokens:
+		return None
+
+	mtype = tokens[0]
+
+	if not isinstance(mtype, basestring):
+		mtype = str(mtype)
+
+	mtype = mtype.lower()
+
+	if mtype == SENSOR_UPDATE:
+
+		# names are always strings, even if they look like numbers
+		pairs = []
+
+		for j in xrange(1, len(tokens) - 1, 2):
+			name = tokens[j]
+			if not isinstance(name, basestring):
+				name = str(name)
+			pairs.append((name, tokens[j + 1]))
+
+		return ParsedMsg(mtype, pairs = pairs)
+
+	message = None
+
+	if len(tokens) > 1:
+		message = tokens[1]
+		if not isinstance(message, basestring):
+			message = str(message)
+
+	return ParsedMsg(mtype, message = message)
@@ -0,0 +1,133 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Publish policies decide whether a changed sensor value is sent to the server
+right away, or held back (see @SensorValues.setPolicy).
+
+Policies could also be configured through the wrapper arguments, using keys
+of the form "<setting>.<variable>" (use "*" as variable for all variables
+without an own policy):
+
+	deadband.temp=0.5:reldeadband.light=0.05:mininterval.*=0.2:maxstale.*=5
+'''
+
+import logging
+
+# wrapper argument prefix -> constructor argument of @PublishPolicy
+ARG_SETTINGS = {
+	'deadband'		: 'deadband',
+	'reldeadband'	: 'relDeadband',
+	'mininterval'	: 'minInterval',
+	'maxstale'		: 'maxStale',
+}
+
+class PublishPolicy:
+	'''
+	Publish policy for a sensor variable:
+
+	deadband		numeric changes of at most this (absolute) amount are not sent
+	relDeadband		numeric changes of at most this fraction of the last sent value
+					are not sent
+	minInterval		min. seconds between two updates of the variable
+	maxStale		if a held back value differs from the last sent one, it is sent
+					after at most this many seconds
+	'''
+
+	def __init__(self, deadband = None, relDeadband = None, minInterval = None, maxStale = None):
+
+		self.deadband 		= deadband
+		self.relDeadband 	= relDeadband
+		self.minInterval 	= minInterval
+		self.maxStale 		= maxStale
+
+	def publish(self, value, sentValue, sentTime, now):
+		'''
+		Decide if a value should be sent now.
+
+		@param	value		current value
+		@param	sentValue	value last sent to the server
+		@param	sentTime	time the last value was sent
+		@param	now			current time
+		@return				True to send value now, False to hold it back
+		'''
+
+		if value == sentValue:
+			return False
+
+		age = now - sentTime
+
+		if not self.maxStale == None and age >= self.maxStale:
+			return True
+
+		if not self.minInterval == None and age < self.minInterval:
+			return False
+
+		if isinstance(value, (int, long, float)) and isinstance(sentValue, (int, long, float)):
+
+			delta = abs(value - sentValue)
+
+			if not self.deadband == None and delta <= self.deadband:
+				return False
+
+			if not self.relDeadband == None and delta <= self.relDeadband * abs(sentValue):
+				return False
+
+		return True
+
+	def __repr__(self):
+		return "PublishPolicy(deadband=%r, relDeadband=%r, minInterval=%r, maxStale=%r)" % (
+			self.deadband, self.relDeadband, self.minInterval, self.maxStale)
+
+def policiesFromArgs(args):
+	'''
+	Build publish policies from wrapper arguments (see module documentation).
+
+	@param	args	dictionary of wrapper arguments
+	@return			dictionary variable name -> @PublishPolicy
+	'''
+
+	policies = {}
+
+	for (k, v) in args.items():
+
+		if not '.' in k:
+			continue
+
+		(setting, name) = k.split('.', 1)
+
+		if not ARG_SETTINGS.has_key(setting):
+			continue
+
+		try:
+			v = float(v)
+		except ValueError:
+			logging.warn("Invalid value [%s] for %s ignored" % (v, k))
+			continue
+
+		if not policies.has_key(name):
+			policies[name] = PublishPolicy()
+
+		setattr(policies[name], ARG_SETTINGS[setting], v)
+
+	return policies
@@ -0,0 +1,146 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Protocol tracing for the hot paths (sending, receiving, parsing). Frames are
+logged at DEBUG level to the logger "scratch.protocol", hex dumps of the frames
+as they go over the wire (if enabled) to "scratch.protocol.wire". Independent of
+the log levels, all frames could be recorded to a capture file (see @capture).
+
+Level checks are precomputed by @ProtocolTrace.refresh, thus the hot paths only
+test a boolean attribute and do no formatting work unless tracing is enabled:
+
+	if TRACE.active:
+		TRACE.frame('>', msg)
+'''
+
+import binascii
+import logging
+
+log 	= logging.getLogger('scratch.protocol')
+wire 	= logging.getLogger('scratch.protocol.wire')
+
+class HexDump:
+	'''
+	Formats a frame (length header and payload) as hex only when converted to string.
+	The frame must be encoded already (see @scratch.framing.encodeFrame).
+	'''
+
+	def __init__(self, msg):
+		self.msg = msg
+
+	def __str__(self):
+		return "%08x %s" % (len(self.msg), binascii.hexlify(self.msg))
+
+class ProtocolTrace:
+	'''
+	Protocol trace facility with precomputed level checks and sampling.
+	'''
+
+	def __init__(self):
+
+		self.sample 	= 1		# trace only one of sample frames
+		self.wireDump 	= False	# dump frames to the wire logger
+		self.capture 	= None	# @CaptureWriter recording all frames
+
+		self.enabled 	= False	# frames are logged to the protocol logger
+		self.wireActive = False	# frames are dumped to the wire logger
+		self.active 	= False	# any of the above (or capture)
+
+		self.__count 	= 0
+
+		self.refresh()
+
+	def configure(self, sample = None, wireDump = None, capture = None):
+		'''
+		Configure tracing.
+
+		@param	sample		trace only one out of sample frames (1 traces all frames)
+		@param	wireDump	True to dump frames as hex to the wire logger
+		@param	capture		@CaptureWriter to record all frames to (not sampled)
+		'''
+
+		if not sample == None:
+			self.sample = max(1, int(sample))
+
+		if not wireDump == None:
+			self.wireDump = wireDump
+
+		if not capture == None:
+			self.capture = capture
+
+		self.refresh()
+
+	def stopCapture(self):
+		'''
+		Stop recording frames and close the capture file (if any).
+		'''
+
+		capture 		= self.capture
+		self.capture 	= None
+
+		self.refresh()
+
+		if not capture == None:
+			capture.close()
+
+	def refresh(self):
+		'''
+		Recompute the level checks. Must be called after the log levels changed, this is
+		done on every connect of a remote sensor.
+		'''
+
+		self.enabled 	= log.isEnabledFor(logging.DEBUG)
+		self.wireActive = self.wireDump and wire.isEnabledFor(logging.DEBUG)
+		self.active 	= self.enabled or self.wireActive or not self.capture == None
+
+	def frame(self, direction, msg):
+		'''
+		Trace a frame. Only call this if @active is set.
+
+		@param	direction	'>' for outgoing, '<' for incoming frames
+		@param	msg			message as byte string (without length header), outgoing
+							frames are encoded by @scratch.remotesensor.RemoteSensor.sendRawMsg
+							before they are traced
+		'''
+
+		capture = self.capture
+
+		if not capture == None:
+			capture.record(direction, msg)
+
+		if self.sample > 1:
+
+			self.__count = self.__count + 1
+
+			if self.__count % self.sample:
+				return
+
+		if self.enabled:
+			log.debug("%s %s", direction, msg)
+
+		if self.wireActive:
+			wire.debug("%s %s", direction, HexDump(msg))
+
+# the process wide trace instance
+TRACE = ProtocolTrace()
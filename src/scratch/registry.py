@@ -0,0 +1,216 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Registry of wrappers, resolving them by name. Wrappers are given either by the
+name of a registered wrapper (e.g. "pi"), or by "module#Class". The wrappers
+shipped with the library are registered in @WRAPPERS, others could register
+themselves through the setuptools entry point group "scratch.wrappers":
+
+	entry_points = {
+		'scratch.wrappers' : [ 'mysensor = mysensor:WrappedRemoteSensor' ],
+	}
+
+Only the module of the wrapper asked for is imported (the wrappers themselves
+import hardware libraries only when they are used). To see where the time at
+startup goes, an @ImportTimer measures all imports made while it is installed:
+
+	timer = ImportTimer()
+	timer.install()
+	cls = loadWrapper('pi')
+	timer.uninstall()
+
+	for line in timer.report():
+		logging.info(line)
+'''
+
+import sys
+import time
+import __builtin__
+
+ENTRY_POINTS = 'scratch.wrappers'
+
+# wrappers shipped with the library (name -> "module#Class")
+WRAPPERS = {
+	'mon' 		: 'scratch.wrappers.mon#MonitoringRemoteSensor',
+	'pi' 		: 'scratch.wrappers.rpi#PiRemoteSensor',
+	'carambot' 	: 'scratch.wrappers.carambot#CarambotRemoteSensor',
+}
+
+def resolve(name):
+	'''
+	Find the wrapper registered by a name.
+
+	@param	name	name of a registered wrapper, or "module#Class"
+	@return			wrapper as "module#Class"
+	'''
+
+	name = name.strip()
+
+	if '#' in name:
+		return name
+
+	if WRAPPERS.has_key(name):
+		return WRAPPERS[name]
+
+	# setuptools is slow to import, thus only asked for names not known here
+	try:
+		import pkg_resources
+	except ImportError:
+		pkg_resources = None
+
+	if not pkg_resources == None:
+		for ep in pkg_resources.iter_entry_points(ENTRY_POINTS, name):
+			return "%s#%s" % (ep.module_name, '.'.join(ep.attrs))
+
+	raise ValueError("Unknown wrapper [%s]" % name)
+
+def loadWrapper(name):
+	'''
+	Import a wrapper class.
+
+	@param	name	name of a registered wrapper, or "module#Class"
+	@return			the wrapper class
+	'''
+
+	(module, cls) = resolve(name).split('#')
+
+	return getattr(__import__(module, fromlist = [cls]), cls)
+
+def names():
+	'''
+	@return		sorted list of the names of all registered wrappers
+	'''
+
+	found = WRAPPERS.keys()
+
+	try:
+		import pkg_resources
+
+		for ep in pkg_resources.iter_entry_points(ENTRY_POINTS):
+			if not ep.name in found:
+				found.append(ep.name)
+
+	except ImportError:
+		pass
+
+	return sorted(found)
+
+class ImportTimer:
+	'''
+	Measures the time spent importing modules, by hooking the import statement.
+	Meant for startup only: imports of other threads made while it is installed
+	are measured wrong.
+	'''
+
+	def __init__(self):
+
+		self.records 	= []	# (self time, cumulative time, module name)
+		self.total 		= 0.0
+
+		self.__stack 	= []
+		self.__import 	= None
+
+	def install(self):
+		'''
+		Start measuring imports.
+		'''
+
+		if self.__import == None:
+			self.__import 			= __builtin__.__import__
+			__builtin__.__import__ 	= self.__timed
+
+	def uninstall(self):
+		'''
+		Stop measuring imports.
+		'''
+
+		if not self.__import == None:
+			__builtin__.__import__ 	= self.__import
+			self.__import 			= None
+
+	def __timed(self, name, globals = None, locals = None, fromlist = None, level = -1):
+		'''
+		Replacement of __import__, records the imports loading new modules.
+		'''
+
+		loaded 	= set(sys.modules)
+		start 	= time.time()
+
+		self.__stack.append(0.0)
+
+		try:
+			return self.__import(name, globals, locals, fromlist, level)
+		finally:
+
+			elapsed = time.time() - start
+			nested 	= self.__stack.pop()
+			new 	= [ m for m in sys.modules if not m in loaded and not sys.modules[m] == None ]
+
+			if self.__stack:
+				self.__stack[-1] = self.__stack[-1] + elapsed
+
+			# modules already imported take no time worth reporting
+			if new:
+
+				if not self.__stack:
+					self.total = self.total + elapsed
+
+				self.records.append((elapsed - nested, elapsed, moduleName(name, fromlist, new)))
+
+	def report(self, limit = 15):
+		'''
+		@param	limit	max. number of modules to report
+		@return			list of lines, the modules which took most time to import first
+		'''
+
+		lines = [ "Imports took %.1f ms" % (self.total * 1000) ]
+
+		for (own, cumulative, name) in sorted(self.records, reverse = True)[:limit]:
+			lines.append("  %7.1f ms self %7.1f ms cumulative  %s" % (own * 1000, cumulative * 1000, name))
+
+		return lines
+
+def moduleName(name, fromlist, loaded):
+	'''
+	Find the module an import statement loaded (implicit relative imports name it
+	relative to the importing package, "from package import module" by the package).
+
+	@param	name		module name given to the import statement
+	@param	fromlist	names imported from the module (None or empty for none)
+	@param	loaded		names of the modules loaded by it
+	@return				full name of the module
+	'''
+
+	names = [ name ]
+
+	if fromlist:
+		names = names + [ "%s.%s" % (name, f) for f in fromlist ]
+
+	found = [ m for m in loaded for n in names if m == n or m.endswith('.' + n) ]
+
+	if not found:
+		return name
+
+	return min(found, key = len)
@@ -55,13 +55,26 @@ except Exception as e:
 
 '''
 
-import struct
 import socket
 import sys
 import threading
-import thread
 import logging
 import time
+import errno
+
+from scratch.framing import FrameWriter, FrameReader, encodeFrame
+from scratch import msgparser
+from scratch import dispatch
+from scratch import metrics
+from scratch.policy import policiesFromArgs
+from scratch.backoff import backoffFromArgs
+from scratch.liveness import probeFromArgs, setKeepalive, PROBE_PREFIX
+from scratch.prototrace import TRACE, log as tracelog
+from scratch.tasks import PeriodicTask
+from scratch.encoding import VariableEncoder, encodeValue, UPDATE
+from scratch.valuestore import ValueStore
+from scratch.subscriptions import Subscriptions
+from scratch.router import BroadcastRouter
 
 DEFAULT_HOST = 'localhost'
 DEFAULT_PORT = 42001
@@ -71,11 +84,18 @@ class SensorValues:
 	Value holder class for remote sensor values. Every time a new value is assigned to a
 	variable, a remote sensor update is sent to the server (via network).
 
+	The values are kept in a @scratch.valuestore.ValueStore, thus the changes since 
+	some version (see @diff) or a consistent view of all values (see @snapshot) could
+	be taken while the receiver thread keeps updating them.
+
 	This class is used inernally within the @RemoteSensor class.
 	'''
 	
 	sensorClient = None
 
+	offlineLimit = 1000		# max. variables remembered as unsent while offline
+	encoderLimit = 4096		# max. variables to keep an encoder for (see @encoder)
+
 	def __init__(self, sensorClient):
 		'''
 		Construct a new sensor value holder.
@@ -84,16 +104,51 @@ class SensorValues:
 		'''
 		self.__setInternal("sensorClient", sensorClient)
 
+		# values of the variables (set or received)
+		self.__setInternal("_SensorValues__store", ValueStore())
+
+		# per thread state of running batches (see @batch)
+		self.__setInternal("_SensorValues__batch", threading.local())
+
+		# publish policies (see @setPolicy) and their state
+		self.__setInternal("_SensorValues__policies", {})
+		self.__setInternal("_SensorValues__sent", {})	# name -> (value, time) last sent
+		self.__setInternal("_SensorValues__held", {})	# names of values held back
+
+		# variables set by this sensor, and those whose update was lost (see @resync)
+		self.__setInternal("_SensorValues__own", {})
+		self.__setInternal("_SensorValues__unsent", {})
+		self.__setInternal("_SensorValues__overflow", False)
+
+		# name -> @scratch.encoding.VariableEncoder of the variables sent so far
+		self.__setInternal("_SensorValues__encoders", {})
+
 	def __setInternal(self, name, value):
 		'''
-		Set value of named variable only in internal dictionary (don't send
-		update message to sensor server).
+		Set value of an internal attribute (not a variable, thus no update message is
+		sent to the sensor server).
 
-		@param	name	name of variable to assign a value
+		@param	name	name of attribute
 		@param	value	value to be assigned
 		'''
 		self.__dict__[name] = value
 
+	def __getattr__(self, name):
+		'''
+		Read variables as attributes, e.g. 'valueHolder.var' (only called for names 
+		which are no attribute of the holder itself).
+
+		@param	name	name of variable
+		@return			currently assigned variable value
+		'''
+
+		store = self.__dict__.get("_SensorValues__store")
+
+		try:
+			return store.get(name)
+		except (KeyError, AttributeError):
+			raise AttributeError(name)
+
 	def __setattr__(self, name, value):
 		'''
 		Overwrite variable assignment in a way, that not only the value of
@@ -117,19 +172,302 @@ class SensorValues:
 		'''
 
 		# see if we really need to change the value
-		try:
-			if self.__dict__[name] == value:
-				return False
-		except:
-			pass
+		if not self.__store.set(name, value):
+			return False
+
+		if updateRemote:
+			self.__own[name] = True
+
+		policy = self.getPolicy(name)
+
+		if not policy == None:
 
-		self.__setInternal(name, value)
+			now = time.time()
+
+			if updateRemote:
+				sent = self.__sent.get(name)
+
+				# back at the value last sent: the server is up to date
+				if not sent == None and value == sent[0]:
+					self.__held.pop(name, None)
+					return True
+
+				if not sent == None and not policy.publish(value, sent[0], sent[1], now):
+					self.__held[name] = True
+					return True
+
+			# value sent, or received from the server: the server knows it
+			self.__sent[name] = (value, now)
+			self.__held.pop(name, None)
 
 		if updateRemote:
-			self.sensorClient.sendMsg('sensor-update', varName=name, varValue=value)
+			self.__publish(name, value)
 
 		return True
+
+	def __publish(self, name, value):
+		'''
+		Send an update for a variable, or add it to the running batch.
+
+		@param	name	name of variable 
+		@param	value	value to send
+		'''
+
+		pending = getattr(self.__batch, 'pending', None)
+
+		if pending == None:
+			try:
+				self.sensorClient.sendMsg('sensor-update', varName=name, varValue=value)
+			except socket.error:
+				self.__remember((name,))
+				raise
+		else:
+			pending[name] = value
+
+	def __send(self, updates):
+		'''
+		Send updates as one 'sensor-update' message. If sending fails, the variables
+		are remembered for @resync.
+
+		@param	updates		dictionary variable name -> value
+		'''
+
+		try:
+			self.sensorClient.sendUpdate(updates)
+		except socket.error:
+			self.__remember(updates.keys())
+			raise
+
+	def __remember(self, names):
+		'''
+		Remember variables whose update could not be sent. At most offlineLimit
+		variables are remembered, if more are lost @resync sends all variables.
+
+		@param	names	list of variable names
+		'''
+
+		unsent = self.__unsent
+
+		for name in names:
+			if len(unsent) < self.offlineLimit or unsent.has_key(name):
+				unsent[name] = True
+			else:
+				self.__setInternal("_SensorValues__overflow", True)
+
+	def resync(self, changedOnly = False):
+		'''
+		Send the current values of the variables set by this sensor as one single
+		'sensor-update' message (e.g. after a reconnect). Values held back by publish
+		policies are included.
+
+		@param	changedOnly		if True, only send the variables whose last update got
+								lost (e.g. while the connection was down)
+		@return					number of variables sent
+		'''
+
+		if changedOnly and not self.__overflow:
+			names = self.__unsent.keys()
+		else:
+			names = self.__own.keys()
+
+		self.__unsent.clear()
+		self.__setInternal("_SensorValues__overflow", False)
+
+		now 	= time.time()
+		updates = {}
+
+		for name in names:
+
+			updates[name] = self.__store.get(name)
+
+			if self.__sent.has_key(name):
+				self.__sent[name] = (updates[name], now)
+				self.__held.pop(name, None)
+
+		if updates:
+			self.__send(updates)
+
+		return len(updates)
+
+	def setPolicy(self, name, policy):
+		'''
+		Set the publish policy for a variable. Updates of variables with a policy are
+		only sent if the policy agrees, otherwise they are held back until @flushHeld
+		finds the policy agrees. 
+
+		@param	name	name of variable, '*' for all variables without an own policy
+		@param	policy	@scratch.policy.PublishPolicy, None to remove the policy
+		'''
+
+		if policy == None:
+			self.__policies.pop(name, None)
+		else:
+			self.__policies[name] = policy
+
+	def getPolicy(self, name):
+		'''
+		Get the publish policy in effect for a variable.
+
+		@param	name	name of variable
+		@return			@scratch.policy.PublishPolicy, None if updates are always sent
+		'''
+
+		policies = self.__policies
+
+		if not policies:
+			return None
+
+		policy = policies.get(name)
+
+		if policy == None:
+			policy = policies.get('*')
+
+		return policy
+
+	def flushHeld(self):
+		'''
+		Send the values held back by publish policies for which the policy now agrees
+		(e.g. because the min. interval passed or the value got stale). Call this 
+		periodically, the daemon does so on every tick.
+
+		@return		number of variables sent
+		'''
+
+		if not self.__held:
+			return 0
+
+		now 	= time.time()
+		updates = {}
+
+		for name in self.__held.keys():
+
+			value 	= self.__store.get(name)
+			sent 	= self.__sent.get(name)
+			policy 	= self.getPolicy(name)
+
+			# dropped back to the value last sent, nothing to send anymore
+			if not sent == None and value == sent[0]:
+				self.__held.pop(name, None)
+				continue
+
+			if sent == None or policy == None or policy.publish(value, sent[0], sent[1], now):
+				updates[name] = value
+				self.__sent[name] = (value, now)
+				self.__held.pop(name, None)
+
+		if len(updates) == 1:
+			self.__publish(*updates.items()[0])
+		elif updates:
+			self.__send(updates)
+
+		return len(updates)
+
+	def batch(self):
+		'''
+		Collect all updates made by the current thread and send them as one single 
+		'sensor-update' message when leaving the with-block:
+
+			with rs.values.batch():
+				rs.values.x = 1
+				rs.values.y = 2
+
+		Batches may be nested, the message is sent when the outermost one ends.
+
+		@return			context manager for use with the with-statement
+		'''
+
+		return SensorValuesBatch(self)
+
+	def begin(self):
+		'''
+		Start collecting updates of the current thread (see @batch).
+		'''
+
+		self.__batch.depth = getattr(self.__batch, 'depth', 0) + 1
+
+		if self.__batch.depth == 1:
+			self.__batch.pending = {}
+
+	def commit(self):
+		'''
+		End collecting updates started with @begin. If this ends the outermost batch,
+		the collected updates are sent.
+		'''
+
+		self.__batch.depth = self.__batch.depth - 1
+
+		if self.__batch.depth == 0:
+			try:
+				self.flush()
+			finally:
+				self.__batch.pending = None
+
+	def flush(self):
+		'''
+		Send all updates collected so far by the current thread as one single 
+		'sensor-update' message.
+		'''
+
+		pending = getattr(self.__batch, 'pending', None)
+
+		if pending:
+			self.__batch.pending = {}
+			self.__send(pending)
 		
+	def encoder(self, name):
+		'''
+		Get the encoder for the updates of a variable, created on first use. If more
+		than encoderLimit variables were sent, the encoders are built anew.
+
+		@param	name	name of variable
+		@return			@scratch.encoding.VariableEncoder
+		'''
+
+		encoders = self.__encoders
+
+		try:
+			return encoders[name]
+		except KeyError:
+			pass
+
+		if len(encoders) >= self.encoderLimit:
+			encoders.clear()
+
+		encoder = VariableEncoder(name)
+		encoders[name] = encoder
+
+		return encoder
+
+	def encodeVariable(self, name, value):
+		'''
+		Encode a 'sensor-update' message for one variable (see @encoder).
+
+		@param	name	name of variable
+		@param	value	int, float or string value
+		@return			message as string
+		'''
+
+		try:
+			return self.__encoders[name].updates[type(value)] % value
+		except KeyError:
+			return self.encoder(name).update(value)
+
+	def encodeUpdate(self, values):
+		'''
+		Encode a 'sensor-update' message for many variables (see @encoder).
+
+		@param	values	list of name/value tuples
+		@return			message as string
+		'''
+
+		encoders = self.__encoders
+
+		try:
+			return UPDATE + ''.join([encoders[k].fragments[type(v)] % v for (k, v) in values])
+		except KeyError:
+			encoder = self.encoder
+			return UPDATE + ''.join([encoder(k).encode(v) for (k, v) in values])
+
 	def get(self, name):
 		'''
 		Get value assigned to a named variable.
@@ -139,26 +477,101 @@ class SensorValues:
 		@param	nam		name of variable to get the value
 		@return			currently assigned variable value		
 		'''
-		return self.__dict__[name] 
+		return self.__store.get(name)
+
+	def version(self):
+		'''
+		@return		version of the last change of any variable (see @diff)
+		'''
+
+		return self.__store.version
+
+	def diff(self, since):
+		'''
+		Get the variables changed (set or received) after a version, e.g. to persist
+		only what changed since the last time:
+
+			since 	= values.version()
+			...
+			changed = values.diff(since)
+
+		@param	since	version, as returned by @version (or of a @snapshot)
+		@return			dictionary name -> value of the variables changed since then
+		'''
+
+		return self.__store.diff(since)
+
+	def snapshot(self):
+		'''
+		Get a consistent view of all variables, not changed by later updates. Taking a
+		snapshot does not copy the values.
+
+		@return		@scratch.valuestore.Snapshot
+		'''
+
+		return self.__store.snapshot()
+
+	def store(self):
+		'''
+		@return		@scratch.valuestore.ValueStore holding the values (e.g. for its 
+					dirty set, see @ValueStore.takeDirty)
+		'''
+
+		return self.__store
+
+class SensorValuesBatch:
+	'''
+	Context manager returned by @SensorValues.batch.
+	'''
+
+	def __init__(self, values):
+		'''
+		@param	values	@SensorValues instance to batch updates for
+		'''
+		self.values = values
+
+	def __enter__(self):
+		self.values.begin()
+		return self.values
+
+	def __exit__(self, excType, excValue, traceback):
+		self.values.commit()
+		return False
 
 class RemoteSensor(threading.Thread):
 	'''
 	Implementation of the Scratch Remote Sensor protocol.
 	'''
 
-	__sock 			= None	# TCP socket to communicate to server
+	__sock 			= None	# TCP socket to communicate to server (per instance)
 	__stopRcvThread = None	# Controll flag for receiver thread 
 	__host			= None	# Sensor server host
 	__port			= None	# Sensor server port
 	__args 			= None 	# additional wrapper arguments
+	__writer		= None	# @FrameWriter owning the sending side of the socket
+	__reader		= None	# @FrameReader for the receiving side of the socket
+	__received		= None	# messages received but not yet returned by @recvMsg
 
 	values 			= None	# holds an instance of @SensorValues
 
 	name 			= "sensor"
 
+	workerInterval 	= 0.1	# seconds between two worker calls (None for no worker task)
+	heartbeat 		= None	# seconds between two heartbeat broadcasts (None for no heartbeat task)
+
 	updateHandler  = None	# Call back handler for sensor updates
 	messageHandler = None	# Call back handler for message updates
 
+	subscriptions 	= None	# @scratch.subscriptions.Subscriptions of update handlers
+	router 			= None	# @scratch.router.BroadcastRouter of broadcast handlers
+
+	dispatcher		= None	# @Dispatcher running the call back handlers
+
+	stats 			= None	# @scratch.metrics.SensorStats of this sensor
+	backoff 		= None	# @scratch.backoff.Backoff for reconnect attempts
+	resyncMode 		= 'all'	# what @resync sends after a connect: 'all', 'changed' or 'none'
+	probe 			= None	# @scratch.liveness.LivenessProbe checking the connection
+
 	def __init__(self, host = DEFAULT_HOST, port = DEFAULT_PORT, args = {}):
 		'''
 		Construct new remote sensor connected to given server on given port.
@@ -166,6 +579,11 @@ class RemoteSensor(threading.Thread):
 
 		@param	host	IP/hostname of Scratch sensor server
 		@param	port	port of Scratch sensor server
+		@param	args	additional arguments: host, port, dispatcher (one of 'inline', 
+						'thread', 'pool' or 'serial', see @scratch.dispatch), 
+						workers (number of handler threads), reconnectmin and
+						reconnectmax (see @scratch.backoff), resync (see @resync), 
+						probeidle and probetimeout (see @scratch.liveness)
 		'''
 
 		self.__host = host
@@ -185,10 +603,45 @@ class RemoteSensor(threading.Thread):
 			except:
 				logging.warn("Invalid port [%s] ignored" % self.__args['port'])
 
+		dispatcher 	= dispatch.DEFAULT_DISPATCHER
+		workers 	= dispatch.DEFAULT_WORKERS
+
+		if self.__args.has_key('dispatcher'):
+			dispatcher = self.__args['dispatcher']
+
+		if self.__args.has_key('workers'):
+			try:
+				workers = int(self.__args['workers'])
+			except:
+				logging.warn("Invalid number of workers [%s] ignored" % self.__args['workers'])
+
+		self.dispatcher = dispatch.createDispatcher(dispatcher, workers)
+
 		threading.Thread.__init__(self)
 		self.daemon = True
 
 		self.values = SensorValues(self)
+		self.subscriptions = Subscriptions()
+
+		# handlers declared with @scratch.router.broadcast
+		self.router = BroadcastRouter()
+		self.router.addDeclared(self)
+
+		for (name, p) in policiesFromArgs(self.__args).items():
+			self.values.setPolicy(name, p)
+
+		self.stats = metrics.SensorStats(self.name)
+		metrics.track(self)
+
+		self.backoff = backoffFromArgs(self.__args)
+
+		if self.__args.has_key('resync'):
+			if self.__args['resync'] in ('all', 'changed', 'none'):
+				self.resyncMode = self.__args['resync']
+			else:
+				logging.warn("Invalid resync mode [%s] ignored" % self.__args['resync'])
+
+		self.probe = probeFromArgs(self, self.__args)
 
 	def __del__(self):
 		'''
@@ -196,16 +649,71 @@ class RemoteSensor(threading.Thread):
 		'''
 
 		try:
-			RemoteSensor.__sock.close()
+			self.__sock.close()
 		except:
 			pass
 
+	def getAddress(self):
+		'''
+		Get the address of the sensor server this sensor connects to.
+
+		@return	tuple (host, port)
+		'''
+		return (self.__host, self.__port)
+
 	def setupVariables(self):
 		'''
 		Overwrite this method to initialize remote sensor variables on every connect.
 		'''
 		pass
 
+	def subscribe(self, pattern, handler, ignoreCase = False):
+		'''
+		Call a handler for the updates of some variables only (other than updateHandler,
+		which is called for all of them):
+
+			rs.subscribe('temp', self.tempChanged)
+			rs.subscribe('DIO*', self.directionChanged)
+			rs.subscribe(re.compile(r'IO\d+'), self.outputChanged)
+
+		Finding the handlers of a variable takes a single dictionary lookup (see 
+		@scratch.subscriptions), thus variables nobody subscribed to cost nothing.
+
+		@param	pattern		variable name, prefix ending with '*' ('*' for all variables),
+							or compiled regular expression matching whole names
+		@param	handler		function called as handler(name, value), run by the dispatcher
+		@param	ignoreCase	if True, names and prefixes match regardless of case
+		'''
+
+		self.subscriptions.subscribe(pattern, handler, ignoreCase)
+
+	def unsubscribe(self, pattern, handler, ignoreCase = False):
+		'''
+		Remove a subscription made by @subscribe (with the same arguments).
+
+		@return		True if the subscription was found
+		'''
+
+		return self.subscriptions.unsubscribe(pattern, handler, ignoreCase)
+
+	def onBroadcast(self, pattern, blocking = True):
+		'''
+		Decorator routing broadcast messages to a function (methods of sensor classes
+		are declared with @scratch.router.broadcast instead):
+
+			@rs.onBroadcast('go')
+			def go(t, msg):
+				...
+
+		@param	pattern		message name, prefix ending with '*' ('*' for all messages),
+							or compiled regular expression
+		@param	blocking	False if the handler never blocks, it then runs right away
+							within the receiving thread (instead of by the dispatcher)
+		@return				decorator
+		'''
+
+		return self.router.on(pattern, blocking)
+
 	def worker(self):
 		'''
 		This method is called in an endless loop when the sensor is running and connected. 
@@ -213,39 +721,150 @@ class RemoteSensor(threading.Thread):
 		'''
 		pass
 
+	def tasks(self):
+		'''
+		Periodic tasks to run for this sensor (by the daemon, a @SensorHub or the loop of 
+		an @AsyncRemoteSensor). By default, these are the worker (every workerInterval
+		seconds), the liveness check (see @probe) and, if enabled, the heartbeat (every 
+		heartbeat seconds). Overwrite this to add own tasks with their own periods, e.g. 
+		to poll an input every 5 ms.
+
+		@return		list of @scratch.tasks.PeriodicTask
+		'''
+
+		tasks = []
+
+		if not self.workerInterval == None:
+			tasks.append(PeriodicTask('%s.worker' % self.name, self.workerInterval, self.runWorker, 
+				jitter = self.workerInterval / 10.0, deadline = self.workerInterval))
+
+		if not self.probe == None:
+			period = min(self.probe.idle, self.probe.timeout) / 4.0
+			tasks.append(PeriodicTask('%s.liveness' % self.name, period, self.probe.check, 
+				jitter = period / 10.0))
+
+		if not self.heartbeat == None:
+			tasks.append(PeriodicTask('%s.heartbeat' % self.name, self.heartbeat, self.sendHeartbeat, 
+				jitter = self.heartbeat / 10.0))
+
+		return tasks
+
+	def resync(self):
+		'''
+		Bring the server up to date after a connect: depending on resyncMode, the 
+		current values of all variables set by this sensor ('all'), only those whose 
+		update got lost while disconnected ('changed'), or nothing ('none') are sent
+		as one single 'sensor-update'. Called by @connect.
+		'''
+
+		if self.resyncMode == 'none':
+			return
+
+		try:
+			n = self.values.resync(self.resyncMode == 'changed')
+		except socket.error as e:
+			logging.warn("Resync with Scratch server failed: %s" % e)
+			return
+
+		if n:
+			logging.info("Resynced %d variables" % n)
+
+	def runWorker(self):
+		'''
+		Run the worker once, then send the values held back by publish policies. Does
+		nothing while not connected.
+		'''
+
+		if not self.isConnected():
+			return
+
+		with metrics.WORKERS.labels(self.name).time():
+			self.worker()
+
+		self.values.flushHeld()
+
+	def sendHeartbeat(self):
+		'''
+		Broadcast "heartbeat-<name>" to show the sensor is alive (e.g. for Scratch projects
+		waiting for it). Does nothing while not connected.
+		'''
+
+		if self.isConnected():
+			self.bcastMsg("heartbeat-%s" % self.name)
+
+	def isConnected(self):
+		'''
+		@return		True if connected (a lost connection is noticed on the next send)
+		'''
+
+		return not self.__writer == None
+
 	def connect(self, tryHard = False):
 		'''
 		Try to connect to a sensor server. If tryHard is set, it will retry forever to connect
-		to the server.
+		to the server (waiting longer after each failed attempt, see @backoff).
 
 		@param	tryHard		on True, try connect over and over again 
 		'''
 
 		logging.info("Connecting to Scratch at %s:%d" % (self.__host, self.__port))
 
+		# drop socket of a previous connection (wakes up the receiver thread)
+		self.__reader = None
+
+		if not self.__sock == None:
+			try:
+				self.__sock.shutdown(socket.SHUT_RDWR)
+				self.__sock.close()
+			except:
+				pass
+
 		if tryHard:
 
 			while True:
 				try:
-					RemoteSensor.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-					RemoteSensor.__sock.connect((self.__host, self.__port))
+					self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+					self.__sock.connect((self.__host, self.__port))
 					break
 				except socket.error:
-					logging.info("Connect failed. Retrying in 2 sec.!")
+					delay = self.backoff.next()
+					logging.info("Connect failed. Retrying in %.1f sec.!" % delay)
 					try:
-						time.sleep(2)
+						time.sleep(delay)
 					except KeyboardInterrupt:
 						exit(0)
 				except KeyboardInterrupt:
 					exit(0)
 
 		else:
-			RemoteSensor.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			RemoteSensor.__sock.connect((self.__host, self.__port))
+			self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			self.__sock.connect((self.__host, self.__port))
+
+		self.__sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		setKeepalive(self.__sock)
+
+		# replace writer of a previous connection
+		if not self.__writer == None:
+			self.__writer.close()
+
+		self.__writer = FrameWriter(self.__sock, self.stats)
+		self.__writer.start()
+
+		self.__reader = FrameReader(self.__sock)
 
 		logging.info("Successfully connected!")
 
-		# initially setup variables
+		self.stats.connects = self.stats.connects + 1
+		self.backoff.reset()
+
+		if not self.probe == None:
+			self.probe.reset()
+
+		# log levels are likely to be configured by now
+		TRACE.refresh()
+
+		# send what the server missed, then initially setup variables
+		self.resync()
 		self.setupVariables()
 
 	def shutdown(self):
@@ -260,12 +879,73 @@ class RemoteSensor(threading.Thread):
 
 		self.__stopRcvThread = True 
 
+		if not self.__writer == None:
+			self.__writer.close()
+
 		try:
-			self.__sock.shutdown()
+			self.__sock.shutdown(socket.SHUT_RDWR)
 			self.__sock.close()
 		except:
 			pass
 
+	def encodeValue(self, value):
+		'''
+		Build the textual representation of a single variable value. Messages are
+		encoded by the encoders of the variables (see @SensorValues.encoder), which
+		encode values the same way.
+
+		@param	value	int, float or string value
+		@return			value as string
+		'''
+
+		return encodeValue(value)
+
+	def encodeMsg(self, msgType, message = None, varName=None, varValue=None, **msgParam):
+		'''
+		Build the textual representation of a message (without the length header).
+		See @sendMsg for the meaning of the parameters.
+
+		@return			message as string
+		'''
+
+		msg = msgType
+
+		if message == None and (varName == None or varValue == None):
+
+			if msgType == UPDATE:
+				return self.values.encodeUpdate(msgParam.items())
+
+			encoder = self.values.encoder
+			msg 	= msg + ''.join([encoder(k).encode(v) for (k, v) in msgParam.items()])
+
+		elif not varName == None and not varValue == None:
+
+			if msgType == UPDATE:
+				return self.values.encodeVariable(varName, varValue)
+
+			msg = msg + self.values.encoder(varName).encode(varValue)
+
+		else:
+
+			msg = msg + ' "' + message + '"'
+
+		return msg
+
+	def encodeUpdate(self, values):
+		'''
+		Build a 'sensor-update' message carrying many variables at once. Other than
+		passing the variables as **msgParam to @encodeMsg, this also works for variable 
+		names clashing with the parameter names of @encodeMsg.
+
+		@param	values	dictionary (or list of name/value tuples) of variables
+		@return			message as string
+		'''
+
+		if isinstance(values, dict):
+			values = values.items()
+
+		return self.values.encodeUpdate(values)
+
 	def sendMsg(self, msgType, message = None, varName=None, varValue=None, **msgParam):
 		'''
 		Send generic message to sensor server. 
@@ -281,132 +961,187 @@ class RemoteSensor(threading.Thread):
 							(e.g. x=1, y=2, ...) 
 		'''
 
-		msg = msgType
-
-		if message == None and (varName == None or varValue == None):
+		self.sendRawMsg(self.encodeMsg(msgType, message, varName, varValue, **msgParam))
 
+		if msgType == 'sensor-update':
+			if not varName == None:
+				metrics.UPDATES.add((varName, 'out'))
 			for k in msgParam.keys():
+				metrics.UPDATES.add((k, 'out'))
 
-				msg = msg + ' "' + k + '" '
+	def sendUpdate(self, values):
+		'''
+		Send one 'sensor-update' message for many variables.
 
-				if isinstance(msgParam[k], (int, long)):
-					msg = msg + "%d" % msgParam[k] 
-				elif isinstance(msgParam[k], (float)):
-					msg = msg + "%f" % msgParam[k] 
-				else:
-					msg = msg + '"' +  msgParam[k] + '"'
+		@param	values	dictionary (or list of name/value tuples) of variables
+		'''
 
-		elif not varName == None and not varValue == None:
+		if isinstance(values, dict):
+			values = values.items()
 
-			msg = msg + ' "' + varName + '" '
+		self.sendRawMsg(self.encodeUpdate(values))
 
-			if isinstance(varValue, (int, long)):
-				msg = msg + "%d" % varValue 
-			elif isinstance(varValue, (float)):
-				msg = msg + "%f" % varValue 
-			else:
-				msg = msg + '"' +  varValue + '"'
+		for (k, v) in values:
+			metrics.UPDATES.add((k, 'out'))
 
-		else:
+	def sendRawMsg(self, msg):
+		'''
+		Send an already encoded message (without the length header) to the sensor server.
+		All sending ends up here: unicode is encoded to UTF-8 once, thus the trace, the
+		capture and the socket see the same bytes. The frame is then handed to
+		@_writeFrame. If the connection was lost, socket.error is raised.
 
-			msg = msg + ' "' + message + '"'
+		@param	msg		message as string or unicode
+		'''
 
-		logging.info("Sending message: %s" % msg)
+		msg = encodeFrame(msg)
 
-		RemoteSensor.__sock.sendall(struct.pack('!I', len(msg)))
-		RemoteSensor.__sock.sendall(msg)
+		if TRACE.active:
+			TRACE.frame('>', msg)
 
-	def recvMsg(self):
+		self._writeFrame(msg)
+
+	def _writeFrame(self, msg):
 		'''
-		Wait (blocking) for an incoming message. This method is used within the receiver thread.
+		Write an encoded message: it is queued for the writer thread, thus this never
+		blocks on the socket. Overwritten by @scratch.asyncsensor.AsyncRemoteSensor.
 
-		@return	received message (raw)
+		@param	msg		message as byte string (without the length header)
 		'''
 
-		msg = RemoteSensor.__sock.recv(4)
+		if self.__writer == None:
+			raise socket.error(errno.ENOTCONN, "Not connected to Scratch server")
 
-		if not msg:
-			return None
+		self.__writer.put(msg)
+
+	def sendQueueBytes(self):
+		'''
+		@return		number of bytes waiting to be sent
+		'''
 
-		(l, ) = struct.unpack('!I', msg)
-				
-		msg = RemoteSensor.__sock.recv(l)
+		writer = self.__writer
 
-		if not msg:
+		if writer == None:
+			return 0
+
+		return writer.pendingBytes()
+
+	def recvMsgs(self):
+		'''
+		Wait (blocking) for incoming messages. This method is used within the receiver thread.
+		All messages completely received so far are returned at once.
+
+		@return	list of received messages (raw), None if the connection was closed
+		'''
+
+		reader = self.__reader
+
+		if reader == None:
 			return None
 
-		return msg 
+		return reader.read()
+
+	def recvMsg(self):
+		'''
+		Wait (blocking) for an incoming message. 
+
+		@return	received message (raw)
+		'''
+
+		if not self.__received:
+
+			self.__received = self.recvMsgs()
+
+			if not self.__received:
+				return None
+
+		return self.__received.pop(0)
 
 	def parseMsg(self, msg):
-			'''
-			Parse a message received from the server. For messages of type 'sensor-update' the
-			value of the corresponding variable int the value holder instance is set. If a 
-			callback handler (updateHandler) is assigned, this handler is called. 
+		'''
+		Parse a message received from the server. For messages of type 'sensor-update' the
+		value of the corresponding variable int the value holder instance is set. The
+		handlers subscribed to the variable (see @subscribe) are called, and, if a 
+		callback handler (updateHandler) is assigned, this handler is called for every
+		variable. 
 
-			For messages of type 'broadcast', the callback handler (messageHandler) is called
-			if assigned.
+		Liveness probe variables (of this or other sensors, see @scratch.liveness) are
+		taken by the probe and neither stored nor handed to the handlers.
 
-			@param	msg		raw message as received from server
-			'''
-	
-			logging.debug("Incoming message: %s" % msg)
-
-			melemRaw = msg.split()
-			melem = {} 
-			mtype = None
-			mkey  = None
-			mval  = None
-
-			for e in melemRaw:
-
-				se = e.strip()
-
-				if mtype == None:
-					mtype = se.lower()	
-				elif mkey == None:
-					mkey = se[1:-1]
-				else:
-					try:	
-						if se[0:1] == '"':
-							mval = se[1:-1]
-						elif '.' in se:
-							mval = float(se)
-						else:
-							mval = int(se)
-					except:
-						mval = se
-
-					melem[mkey] = mval
-					mkey = None
-					mval = None
- 
-				logging.debug("Element: %s" % se)
-
-			logging.debug("Message-Type: %s" % mtype)
-
-			if mtype == 'sensor-update':
-
-				for k in melem.keys():
-					logging.debug("Setting var %s to %s" % (k, melem[k]))
-					self.values.set(k, melem[k], False)
-
-					if not self.updateHandler == None:
-						try:
-							thread.start_new_thread(self.updateHandler, (k, melem[k]))
-						except:
-							pass
-
-			elif mtype == 'broadcast':
-				logging.debug("Message: %s" % mkey)
-
-				if not self.messageHandler == None:
-					try:
-						thread.start_new_thread(self.messageHandler, (mtype, mkey))
-					except:
-						pass
+		For messages of type 'broadcast', the handlers routed to the message are run (see
+		@router), and the callback handler (messageHandler) is called if assigned.
 
-			else:
-				logging.warn("Unsupported message type: %s" % mtype)
+		@param	msg		raw message as received from server
+		'''
+
+		if TRACE.active:
+			TRACE.frame('<', msg)
+
+		stats = self.stats
+		stats.framesIn = stats.framesIn + 1
+		stats.bytesIn = stats.bytesIn + len(msg)
+
+		pmsg = msgparser.parseMsg(msg)
+
+		if pmsg == None:
+			return
+
+		if pmsg.type == msgparser.SENSOR_UPDATE:
+
+			updates = stats.updatesIn
+			subs 	= self.subscriptions
+			probe 	= self.probe
+
+			for (k, v) in pmsg.pairs:
+
+				if k.startswith(PROBE_PREFIX):
+					if not probe == None and k == probe.variable():
+						probe.received(v)
+					continue
+
+				if TRACE.enabled:
+					tracelog.debug("Setting var %s to %s", k, v)
+				self.values.set(k, v, False)
+				updates[k] = updates.get(k, 0) + 1
+
+				if subs.count:
+					for handler in subs.handlers(k):
+						self.dispatcher.dispatch(k, handler, (k, v))
+
+				if not self.updateHandler == None:
+					self.dispatcher.dispatch(k, self.updateHandler, (k, v))
+
+		elif pmsg.type == msgparser.BROADCAST:
+			if TRACE.enabled:
+				tracelog.debug("Message: %s", pmsg.message)
+
+			self.router.route(pmsg.type, pmsg.message, self.dispatcher)
+
+			if not self.messageHandler == None:
+				self.dispatcher.dispatch((pmsg.type, pmsg.message), self.messageHandler, 
+					(pmsg.type, pmsg.message))
+
+		else:
+			logging.warn("Unsupported message type: %s" % pmsg.type)
+
+	def __closed(self, reader):
+		'''
+		Called by the receiver thread when the server closed the connection: let the
+		next send fail (instead of writing into the void), thus the connection loss
+		is noticed and the updates are remembered for @resync.
+
+		@param	reader	@FrameReader of the closed connection
+		'''
+
+		if not self.__reader is reader:
+			return	# already reconnected
+
+		self.__reader 	= None
+		writer 			= self.__writer
+
+		if not writer == None and writer.error == None:
+			logging.warn("Connection closed by Scratch server")
+			writer.error = socket.error(errno.ECONNRESET, "Connection closed by Scratch server")
 
 	def bcastMsg(self, msg):
 		'''
@@ -427,16 +1162,37 @@ class RemoteSensor(threading.Thread):
 
 		while not self.__stopRcvThread:
 
+			reader = self.__reader
+
 			try:
-				msg = self.recvMsg()
-		
-				if not msg:
-					time.sleep(0.1)	
-				else:
-					self.parseMsg(msg)
+				msgs = self.recvMsgs()
 
-			except:
-				pass
+			except ValueError as e:
+				# stream is out of sync, drop the connection to force a reconnect 
+				logging.error("Receiving from Scratch server failed: %s" % e)
+				self.__reader = None
+				try:
+					self.__sock.shutdown(socket.SHUT_RDWR)
+				except:
+					pass
+				continue
+
+			except Exception as e:
+				if not self.__stopRcvThread:
+					logging.debug("Receiving from Scratch server failed: %s" % e)
+				msgs = None
+
+			if not msgs:
+				if msgs == None and not reader == None and not self.__stopRcvThread:
+					self.__closed(reader)
+				time.sleep(0.1)	
+				continue
+
+			for msg in msgs:
+				try:
+					self.parseMsg(msg)
+				except Exception as e:
+					logging.error("Failed to handle message [%s]: %s" % (msg, e))
 
 		self.__stopRcvThread = None 
 
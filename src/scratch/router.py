@@ -0,0 +1,209 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Routing of incoming broadcast messages to handlers registered per message (see
+@RemoteSensor.router). Wrappers declare their handlers with a decorator:
+
+	class Robot(RemoteSensor):
+
+		@broadcast('forward')
+		def forward(self, t, msg):
+			self.vehicle.fw(100)
+
+		@broadcast('*', blocking = False)
+		def log(self, t, msg):
+			logging.info("Received message: %s" % msg)
+
+Messages are given like variables of subscriptions (see @scratch.subscriptions):
+by name, by a prefix ending with '*' ('*' for all messages), or by a compiled
+regular expression. The handlers of a message are found by a dictionary lookup.
+
+Handlers which may block (e.g. moving a robot) are run by the dispatcher of the
+sensor, thus they do not hold up receiving. Handlers declared as non-blocking
+run right away within the receiving thread, sparing the hand over to a worker
+thread (or, with the 'thread' dispatcher, a new thread per message).
+'''
+
+from scratch.subscriptions import Subscriptions
+from scratch.dispatch import InlineDispatcher
+
+# class -> list of (pattern, blocking, method name) declared by @broadcast
+ROUTES_BY_CLASS = {}
+
+def broadcast(pattern, blocking = True):
+	'''
+	Decorator declaring a method of a sensor class as handler of broadcast messages.
+	The method is called as method(t, msg), like the messageHandler of a sensor.
+
+	@param	pattern		message name, prefix ending with '*', or compiled regular
+						expression
+	@param	blocking	False if the handler never blocks (it is then run within the
+						receiving thread)
+	@return				decorator
+	'''
+
+	def declare(func):
+
+		if not hasattr(func, 'broadcasts'):
+			func.broadcasts = []
+
+		func.broadcasts.append((pattern, blocking))
+
+		return func
+
+	return declare
+
+def declaredRoutes(cls):
+	'''
+	Find the methods of a class (and its bases) declared by @broadcast.
+
+	@param	cls		class to search
+	@return			list of (pattern, blocking, method name)
+	'''
+
+	try:
+		return ROUTES_BY_CLASS[cls]
+	except KeyError:
+		pass
+
+	routes = []
+
+	for name in dir(cls):
+		for (pattern, blocking) in getattr(getattr(cls, name, None), 'broadcasts', []):
+			routes.append((pattern, blocking, name))
+
+	ROUTES_BY_CLASS[cls] = routes
+
+	return routes
+
+class Route:
+	'''
+	A handler registered with a @BroadcastRouter.
+	'''
+
+	def __init__(self, handler, blocking = True):
+		'''
+		@param	handler		function called as handler(t, msg)
+		@param	blocking	False if the handler never blocks
+		'''
+
+		self.handler 	= handler
+		self.blocking 	= blocking
+
+	def __eq__(self, other):
+		return isinstance(other, Route) and self.handler == other.handler
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+class BroadcastRouter:
+	'''
+	Handlers of broadcast messages, by message.
+	'''
+
+	def __init__(self):
+
+		self.__routes 	= Subscriptions()
+		self.__inline 	= InlineDispatcher()
+
+	def add(self, pattern, handler, blocking = True):
+		'''
+		Register a handler.
+
+		@param	pattern		message name, prefix ending with '*', or compiled regular
+							expression
+		@param	handler		function called as handler(t, msg)
+		@param	blocking	False if the handler never blocks
+		'''
+
+		self.__routes.subscribe(pattern, Route(handler, blocking))
+
+	def remove(self, pattern, handler):
+		'''
+		Remove a handler registered by @add.
+
+		@return		True if the handler was found
+		'''
+
+		return self.__routes.unsubscribe(pattern, Route(handler))
+
+	def addDeclared(self, obj):
+		'''
+		Register the methods of an object declared by @broadcast.
+
+		@param	obj		object (e.g. a sensor)
+		'''
+
+		for (pattern, blocking, name) in declaredRoutes(obj.__class__):
+			self.add(pattern, getattr(obj, name), blocking)
+
+	def on(self, pattern, blocking = True):
+		'''
+		Decorator registering a function:
+
+			@rs.router.on('go')
+			def go(t, msg):
+				...
+
+		@return		decorator
+		'''
+
+		def register(func):
+			self.add(pattern, func, blocking)
+			return func
+
+		return register
+
+	def routes(self, msg):
+		'''
+		@param	msg		broadcast message
+		@return			tuple of the @Route of the message, in the order they were added
+		'''
+
+		if not self.__routes.count:
+			return ()
+
+		return self.__routes.handlers(msg)
+
+	def route(self, t, msg, dispatcher = None):
+		'''
+		Run the handlers of a message.
+
+		@param	t			message type
+		@param	msg			broadcast message
+		@param	dispatcher	@scratch.dispatch.Dispatcher running the blocking handlers
+							(None to run them inline too)
+		@return				number of handlers run (or dispatched)
+		'''
+
+		routes = self.routes(msg)
+
+		for r in routes:
+			if r.blocking and not dispatcher == None:
+				dispatcher.dispatch((t, msg), r.handler, (t, msg))
+			else:
+				self.__inline.dispatch((t, msg), r.handler, (t, msg))
+
+		return len(routes)
@@ -20,48 +20,303 @@
 ##
 
 '''
-This file provides the main API class for using uSherpa. 
+Scratch remote sensor server mock. Accepts any number of sensor clients and, like
+Scratch, forwards every 'sensor-update' and 'broadcast' received to all connected
+clients while keeping a table of the global variables.
+
+Run interactively (every line typed is sent to all clients):
+
+	python rsdummysrv.py
+
+Or non-interactive, driven by a script file (e.g. for load tests):
+
+	python rsdummysrv.py --script load.srs --quiet
+
+Script files contain one command per line. Besides messages to send, the commands
+"/sleep <sec>" (pause) and "/wait <n>" (wait for n clients to connect) are
+understood, lines starting with "#" are ignored.
 '''
 
 import os
-import readline
+import sys
+import time
+import errno
+import socket
 import atexit
+import argparse
 import threading
-import struct
-import SocketServer
+
+from scratch.asyncsensor import SensorLoop
+from scratch.framing import HEADER, FrameReader
+from scratch import msgparser
 
 HOST = ''		# hostname/IP on which to listen for client connections
 PORT = 42001		# port on which to listen for client connections 
 
-class RemoteSonsorServerRequestHandler(SocketServer.BaseRequestHandler):
+class ClientConnection:
 	'''
-	TCP request handler. Note: only accepts one client connection at a time.
+	Connection to a single sensor client (served by the @SensorLoop of the server).
 	'''
 
-	sock = None
+	maxBuffered = 4 * 1024 * 1024	# bytes of output buffered before a slow client is dropped
 
-	def handle(self):
+	def __init__(self, server, sock, address):
 		'''
-		Handle client connection.
+		@param	server		@RemoteSensorServer the client is connected to
+		@param	sock		client socket
+		@param	address		client address
 		'''
 
-		RemoteSonsorServerRequestHandler.sock = self.request
+		sock.setblocking(False)
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-		while True:
-			data = self.request.recv(4)
+		self.server 	= server
+		self.sock 		= sock
+		self.address 	= address
+		self.reader 	= FrameReader(sock)
+		self.wbuf 		= bytearray()
 
-			if not data:
-				print("\nClient closed connection")
-				RemoteSonsorServerRequestHandler.sock = None
-				break
+	def fileno(self):
+		return self.sock.fileno()
 
-			(l, ) = struct.unpack('!I', data)
-			
-			data = self.request.recv(l)
+	def wantsWrite(self):
+		return len(self.wbuf) > 0
+
+	def handleRead(self):
+		'''
+		Receive messages and hand them to the server.
+		'''
+
+		try:
+			n = self.reader.fill()
+		except socket.error as e:
+			if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				return
+			n = 0
+
+		if not n:
+			self.server.disconnected(self)
+			return
+
+		try:
+			msgs = self.reader.frames(n)
+		except ValueError:
+			self.server.disconnected(self)
+			return
+
+		for msg in msgs:
+			self.server.received(self, msg)
+
+	def handleWrite(self):
+		'''
+		Write as much buffered output as the socket accepts. The client is dropped if
+		writing fails.
+		'''
+
+		error = None
+
+		self.server.lock.acquire()
+
+		try:
+			n = self.sock.send(self.wbuf)
+			del self.wbuf[:n]
+		except socket.error as e:
+			if not e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				self.wbuf = bytearray()
+				error = e
+		finally:
+			self.server.lock.release()
+
+		if not error == None:
+			self.server.drop(self, "writing failed: %s" % error)
+
+class RemoteSensorServer:
+	'''
+	Select based remote sensor server serving any number of clients from one thread.
+	'''
+
+	def __init__(self, host = HOST, port = PORT, quiet = False):
+		'''
+		@param	host	hostname/IP on which to listen for client connections
+		@param	port	port on which to listen for client connections
+		@param	quiet	if True, do not print received messages
+		'''
+
+		self.quiet 		= quiet
+		self.variables 	= {}	# global variable table
+		self.clients 	= []
+		self.loop 		= SensorLoop()
+		self.lock 		= threading.RLock()	# guards clients and their output buffers
+
+		self.__sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.__sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.__sock.bind((host, port))
+		self.__sock.listen(128)
+		self.__sock.setblocking(False)
+
+		self.address = self.__sock.getsockname()
+
+		self.loop.register(self)
+
+	def fileno(self):
+		return self.__sock.fileno()
+
+	def wantsWrite(self):
+		return False
+
+	def handleRead(self):
+		'''
+		Accept a new client.
+		'''
+
+		try:
+			(sock, address) = self.__sock.accept()
+		except socket.error:
+			return
+
+		client = ClientConnection(self, sock, address)
+
+		self.lock.acquire()
+
+		try:
+			self.clients.append(client)
+		finally:
+			self.lock.release()
+
+		self.loop.register(client)
+
+		if not self.quiet:
+			print("\nClient connected: %s:%d" % address)
+
+	def drop(self, client, reason):
+		'''
+		Drop a client. May be called from any thread: the client gets no more messages
+		right away, but it is disconnected by the loop thread (which owns the sockets
+		it watches).
+
+		@param	client	@ClientConnection to drop
+		@param	reason	why the client is dropped
+		'''
+
+		self.lock.acquire()
+
+		try:
+			if not client in self.clients:
+				return
+			self.clients.remove(client)
+		finally:
+			self.lock.release()
+
+		self.loop.callSoon(self.disconnected, client, reason)
+
+	def disconnected(self, client, reason = None):
+		'''
+		Called within the loop thread when the client closed the connection, or when
+		the client is dropped (see @drop).
+
+		@param	client	@ClientConnection gone
+		@param	reason	why the client is dropped, None if it closed the connection
+		'''
+
+		self.loop.unregister(client)
+
+		self.lock.acquire()
+
+		try:
+			if client in self.clients:
+				self.clients.remove(client)
+		finally:
+			self.lock.release()
+
+		try:
+			client.sock.close()
+		except socket.error:
+			pass
+
+		if self.quiet:
+			return
+
+		if reason == None:
+			print("\nClient closed connection")
+		else:
+			print("\nClient %s:%d dropped (%s)" % (client.address[0], client.address[1], reason))
+
+	def received(self, client, msg):
+		'''
+		Called by a client connection for every message received: update the variable
+		table and forward the message to all clients.
+		'''
+
+		if not self.quiet and str.find(msg, "heartbeat-") == -1 and str.find(msg, "srs-probe-") == -1:
+			print("Received message of lenght %d from %s: %s" % (len(msg), client.address[0], msg))
+
+		pmsg = msgparser.parseMsg(msg)
+
+		if pmsg == None or not pmsg.type in (msgparser.SENSOR_UPDATE, msgparser.BROADCAST):
+			return
+
+		self.publish(msg, pmsg)
+
+	def publish(self, msg, pmsg = None):
+		'''
+		Publish a message as the server: update the variable table (for 'sensor-update') 
+		and send the message to all clients. Other than @received, any message (even
+		bogus ones) is sent.
+
+		@param	msg		message to publish
+		@param	pmsg	@ParsedMsg for msg if already parsed
+		'''
+
+		if pmsg == None:
+			pmsg = msgparser.parseMsg(msg)
+
+		if not pmsg == None and pmsg.type == msgparser.SENSOR_UPDATE:
+			for (k, v) in pmsg.pairs:
+				self.variables[k] = v
+
+		self.sendAll(msg)
+
+	def sendAll(self, msg):
+		'''
+		Send a message to all connected clients. May be called from any thread. Clients
+		which do not keep up with reading (see @ClientConnection.maxBuffered) are dropped.
+
+		@param	msg		message to send
+		'''
+
+		frame = HEADER.pack(len(msg)) + msg
+
+		self.lock.acquire()
+
+		try:
+			# clients may be dropped meanwhile
+			for client in list(self.clients):
+
+				if len(client.wbuf) + len(frame) > client.maxBuffered:
+					self.drop(client, "more than %d bytes pending" % client.maxBuffered)
+					continue
+
+				client.wbuf += frame
+				client.handleWrite()
+		finally:
+			self.lock.release()
+
+		self.loop.wakeup()
+
+	def serve_forever(self):
+		'''
+		Serve clients until @shutdown is called.
+		'''
+
+		self.loop.run()
+
+	def shutdown(self):
+		'''
+		Stop serving clients.
+		'''
+
+		self.loop.stop()
 
-			if str.find(data, "heartbeat-") == -1:
-				print("Received message of lenght %d from %s: %s" % (l, self.client_address[0], data))
-	
 class SimpleShell:
 	'''
 	Simple shell for sending test messages to sensor clients.
@@ -69,7 +324,11 @@ class SimpleShell:
 
 	histfile = None
 
-	def __init__(self):
+	def __init__(self, server):
+
+		self.server = server
+
+		import readline
 
 		# try and get readline history file
 		self.histfile = os.path.join(os.path.expanduser("~"), ".rsdummysrv.hist")
@@ -90,7 +349,9 @@ class SimpleShell:
 		print("\n\nControll commands:")
 		print("  /q  - quit server")
 		print("  /h  - show this help")
-		print("\nEverything elese will be send as is to client. Examples:")
+		print("  /c  - list connected clients")
+		print("  /v  - list global variables")
+		print("\nEverything elese will be send as is to all clients. Examples:")
 		print("  sensor-update \"var\" 42")
 		print("  broadcast \"msg\"\n")
 
@@ -100,7 +361,7 @@ class SimpleShell:
 		'''
 
 		print("\n*** Scratch remote sensor server mock. Use /h for help, /q to quit ***\n")
-		print("Listening for client connections: %s at port %d\n" % (HOST, PORT))
+		print("Listening for client connections: %s at port %d\n" % self.server.address)
 
 		while True:
 
@@ -112,32 +373,85 @@ class SimpleShell:
 					break
 				elif cmd.lower() == '/h':
 					self.showHelp()
+				elif cmd.lower() == '/c':
+					for c in list(self.server.clients):
+						print("  %s:%d" % c.address)
+				elif cmd.lower() == '/v':
+					for k in sorted(self.server.variables.keys()):
+						print("  %s = %s" % (k, self.server.variables[k]))
 				elif cmd[0:1] == '/':
 					print("Unknown command: %s" % cmd)
 				elif len(cmd) > 0:
-					if RemoteSonsorServerRequestHandler.sock:
+					if self.server.clients:
 						print("Sending: %s" % cmd)
-						RemoteSonsorServerRequestHandler.sock.sendall(struct.pack('!I', len(cmd)))
-						RemoteSonsorServerRequestHandler.sock.sendall(cmd)	
+						self.server.publish(cmd)
 					else:
 						print("No client connected, not sending: %s" % cmd)
 
 			except KeyboardInterrupt:
 				print('\n')
 				break
-try:
 
-	server = SocketServer.TCPServer((HOST, PORT), RemoteSonsorServerRequestHandler)
+def runScript(server, script):
+	'''
+	Run a script file (see module documentation) against the server.
+
+	@param	server	@RemoteSensorServer to send the messages from
+	@param	script	name of script file
+	'''
+
+	for line in open(script):
+
+		cmd = line.strip()
+
+		if not cmd or cmd[0:1] == '#':
+			continue
+
+		if cmd.lower() == '/q':
+			break
+		elif cmd.lower().startswith('/sleep '):
+			time.sleep(float(cmd[7:]))
+		elif cmd.lower().startswith('/wait '):
+			while len(server.clients) < int(cmd[6:]):
+				time.sleep(0.01)
+		elif cmd[0:1] == '/':
+			sys.stderr.write("Unknown command in script: %s\n" % cmd)
+		else:
+			server.publish(cmd)
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description='Scratch remote sensor server mock')
+
+	parser.add_argument('--host', dest='host', metavar='HOST', default=HOST, 
+		type=str, help='Hostname/IP to listen on')
+
+	parser.add_argument('--port', dest='port', metavar='PORT', default=PORT, 
+		type=int, help='Port to listen on')
+
+	parser.add_argument('--script', dest='script', metavar='FILE', default=None, 
+		type=str, help='Run non-interactive, driven by script file')
+
+	parser.add_argument('--quiet', dest='quiet', action='store_true', default=False, 
+		help='Do not print received messages')
+
+	args = parser.parse_args()
+
+	try:
+
+		server = RemoteSensorServer(args.host, args.port, args.quiet)
 
-	shell = SimpleShell()
+		server_thread = threading.Thread(target=server.serve_forever)
 
-	server_thread = threading.Thread(target=server.serve_forever)
+		server_thread.daemon = True
+		server_thread.start()
 
-	server_thread.daemon = True
-	server_thread.start()
+		if args.script:
+			runScript(server, args.script)
+		else:
+			SimpleShell(server).start()
 
-	shell.start()
-	server.shutdown()
+		server.shutdown()
 
-except Exception as e:
-	print(e)
+	except Exception as e:
+		print(e)
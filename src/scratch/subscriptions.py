@@ -0,0 +1,330 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Subscriptions of handlers to incoming variable updates (see
+@RemoteSensor.subscribe). A handler subscribes to:
+
+	'temp'						one variable (by its exact name)
+	'DIO*'						all variables starting with a prefix ('*' for all)
+	re.compile(r'IO\d+')		all variables a regular expression matches (as a whole)
+
+Exact names are kept in a dictionary, prefixes in a trie. Regular expressions
+are kept in the trie too, at the node of their literal prefix (e.g. 'IO' for
+r'IO\d+'), thus only names starting with that prefix are matched against them.
+The handlers found for a name are cached, so dispatching an update usually takes
+a single dictionary lookup, no matter how many subscriptions there are.
+'''
+
+import re
+import threading
+
+# characters which end the literal prefix of a regular expression
+REGEX_SPECIAL = '.^$*+?{}[]\\|()'
+
+def literalPrefix(pattern):
+	'''
+	Find the literal text every name matched by a regular expression starts with.
+
+	@param	pattern		regular expression (string)
+	@return				literal prefix, '' if there is none
+	'''
+
+	if '|' in pattern:
+		return ''
+
+	prefix = ''
+
+	for (i, c) in enumerate(pattern):
+
+		if c in REGEX_SPECIAL:
+
+			# a quantifier makes the character before it optional
+			if c in '*?{' and prefix:
+				prefix = prefix[:-1]
+
+			break
+
+		prefix = prefix + c
+
+	return prefix
+
+class PrefixTrie:
+	'''
+	Trie mapping prefixes to entries. Every node is a dictionary of its children
+	(by character), the entries of a node are kept under the key None.
+	'''
+
+	def __init__(self):
+
+		self.root = {}
+
+	def add(self, prefix, entry):
+		'''
+		@param	prefix	prefix to add the entry at
+		@param	entry	any object
+		'''
+
+		node = self.root
+
+		for c in prefix:
+			node = node.setdefault(c, {})
+
+		node.setdefault(None, []).append(entry)
+
+	def remove(self, prefix, entry):
+		'''
+		@param	prefix	prefix the entry was added at
+		@param	entry	entry to remove (compared by equality)
+		@return			True if the entry was found
+		'''
+
+		path = [ self.root ]
+
+		for c in prefix:
+			if not path[-1].has_key(c):
+				return False
+			path.append(path[-1][c])
+
+		entries = path[-1].get(None, [])
+
+		if not entry in entries:
+			return False
+
+		entries.remove(entry)
+
+		if not entries:
+			del path[-1][None]
+
+		# drop nodes left without entries and children
+		for i in range(len(prefix), 0, -1):
+			if path[i]:
+				break
+			del path[i - 1][prefix[i - 1]]
+
+		return True
+
+	def matches(self, name):
+		'''
+		@param	name	name to look up
+		@return			list of the entries of all prefixes of name (shortest first)
+		'''
+
+		found 	= []
+		node 	= self.root
+
+		for c in name:
+
+			found.extend(node.get(None, []))
+			node = node.get(c)
+
+			if node == None:
+				return found
+
+		found.extend(node.get(None, []))
+
+		return found
+
+class Subscriptions:
+	'''
+	Handlers subscribed to variables, found by variable name. Subscribing and
+	looking up may happen in different threads.
+	'''
+
+	cacheLimit = 4096	# max. names to cache the handlers of
+
+	def __init__(self):
+
+		self.count 		= 0			# number of subscriptions
+
+		self.__names 	= {}		# (exact) name -> list of (seq, handler)
+		self.__prefixes = PrefixTrie()	# entries (seq, regex or None, handler)
+		self.__folded 	= ({}, PrefixTrie())	# the same, with upper case keys
+		self.__cache 	= {}		# name -> tuple of handlers
+		self.__seq 		= 0			# order of the subscriptions
+		self.__lock 	= threading.Lock()
+
+	def subscribe(self, pattern, handler, ignoreCase = False):
+		'''
+		Subscribe a handler to updates of variables.
+
+		@param	pattern		variable name, prefix ending with '*', or compiled regular 
+							expression (see module documentation)
+		@param	handler		function called as handler(name, value)
+		@param	ignoreCase	if True, names and prefixes match regardless of case (ignored
+							for regular expressions, use re.IGNORECASE for them)
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			self.__seq = self.__seq + 1
+
+			(kind, key, regex) = self.__parse(pattern, ignoreCase)
+			(names, prefixes) = self.__tables(ignoreCase and regex == None)
+
+			if kind == 'name':
+				names.setdefault(key, []).append((self.__seq, handler))
+			else:
+				prefixes.add(key, (self.__seq, regex, handler))
+
+			self.count = self.count + 1
+			self.__cache.clear()
+
+		finally:
+			self.__lock.release()
+
+	def unsubscribe(self, pattern, handler, ignoreCase = False):
+		'''
+		Remove a subscription made by @subscribe (with the same arguments).
+
+		@return		True if the subscription was found
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			(kind, key, regex) = self.__parse(pattern, ignoreCase)
+			(names, prefixes) = self.__tables(ignoreCase and regex == None)
+
+			found = False
+
+			if kind == 'name':
+
+				entries = names.get(key, [])
+
+				for e in entries:
+					if e[1] == handler:
+						entries.remove(e)
+						found = True
+						break
+
+				if not entries:
+					names.pop(key, None)
+
+			else:
+
+				for e in prefixes.matches(key):
+					if e[1] == regex and e[2] == handler and prefixes.remove(key, e):
+						found = True
+						break
+
+			if found:
+				self.count = self.count - 1
+				self.__cache.clear()
+
+			return found
+
+		finally:
+			self.__lock.release()
+
+	def handlers(self, name):
+		'''
+		Find the handlers subscribed to a variable. A handler subscribed to the variable
+		through more than one subscription is returned once.
+
+		@param	name	variable name
+		@return			tuple of handlers, in the order they subscribed
+		'''
+
+		try:
+			return self.__cache[name]
+		except KeyError:
+			pass
+
+		self.__lock.acquire()
+
+		try:
+			matched = self.__match(self.__names, self.__prefixes, name)
+
+			if self.__folded[0] or self.__folded[1].root:
+				matched.extend(self.__match(self.__folded[0], self.__folded[1], name.upper()))
+
+			handlers = []
+
+			for (seq, handler) in sorted(matched):
+				if not handler in handlers:
+					handlers.append(handler)
+
+			if len(self.__cache) >= self.cacheLimit:
+				self.__cache.clear()
+
+			handlers = tuple(handlers)
+			self.__cache[name] = handlers
+
+			return handlers
+
+		finally:
+			self.__lock.release()
+
+	def __match(self, names, prefixes, name):
+		'''
+		@return		list of (seq, handler) of the subscriptions matching name
+		'''
+
+		matched = list(names.get(name, []))
+
+		for (seq, regex, handler) in prefixes.matches(name):
+
+			if not regex == None:
+
+				m = regex.match(name)
+
+				if m == None or not m.end() == len(name):
+					continue
+
+			matched.append((seq, handler))
+
+		return matched
+
+	def __tables(self, ignoreCase):
+		'''
+		@return		(names, prefixes) to keep subscriptions in
+		'''
+
+		if ignoreCase:
+			return self.__folded
+
+		return (self.__names, self.__prefixes)
+
+	def __parse(self, pattern, ignoreCase):
+		'''
+		@return		tuple (kind, key, regex): kind 'name' or 'prefix', key the name or
+					prefix, regex the compiled expression (None for names and prefixes)
+		'''
+
+		if hasattr(pattern, 'match'):
+
+			if pattern.flags & re.IGNORECASE:
+				return ('prefix', '', pattern)
+
+			return ('prefix', literalPrefix(pattern.pattern), pattern)
+
+		if ignoreCase:
+			pattern = pattern.upper()
+
+		if pattern.endswith('*'):
+			return ('prefix', pattern[:-1], None)
+
+		return ('name', pattern, None)
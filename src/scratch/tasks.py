@@ -0,0 +1,131 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Periodic tasks run by a @SensorLoop (see @SensorLoop.schedule). Wrappers declare
+their tasks by overwriting @RemoteSensor.tasks:
+
+	def tasks(self):
+		return RemoteSensor.tasks(self) + [
+			PeriodicTask('pi.gpio', 0.005, self.pollGpio, jitter = 0.001),
+		]
+
+Tasks run at a fixed rate: the next run is due one period after the previous
+one was due (not after it finished), thus the timing does not drift with the
+run time of the task. If a run is late by more than a period, the missed runs
+are skipped.
+
+The jitter is the time a run may be delayed. The loop uses it to serve tasks
+together which are due at about the same time, instead of waking up for each of
+them.
+'''
+
+import time
+import logging
+
+from scratch import metrics
+
+class PeriodicTask:
+	'''
+	A function called periodically.
+	'''
+
+	def __init__(self, name, period, func, args = (), jitter = 0, deadline = None, onError = None):
+		'''
+		@param	name		task name (used for logging and metrics)
+		@param	period		seconds between two runs
+		@param	func		function to run
+		@param	args		tuple of arguments for func
+		@param	jitter		seconds a run may be delayed
+		@param	deadline	max. seconds a run should take, longer runs are counted
+							(and logged) as overrun
+		@param	onError		called with the task and the exception if func raises,
+							if None the exception is logged
+		'''
+
+		self.name 		= name
+		self.period 	= period
+		self.func 		= func
+		self.args 		= args
+		self.jitter 	= jitter
+		self.deadline 	= deadline
+		self.onError 	= onError
+
+		self.due 		= None	# time the next run is due
+		self.runs 		= 0		# runs so far
+		self.missed 	= 0		# runs skipped because the task was late
+		self.overruns 	= 0		# runs which took longer than the deadline
+		self.active 	= False	# True while scheduled
+		self.timer 		= None	# handle of the timer of the next run
+
+	def start(self, now):
+		'''
+		Make the first run due one period from now.
+
+		@param	now		current time
+		'''
+
+		self.active = True
+		self.due 	= now + self.period
+
+	def run(self):
+		'''
+		Run the task once and advance @due to the next run.
+
+		@return		time the next run is due
+		'''
+
+		start = time.time()
+
+		try:
+			self.func(*self.args)
+		except Exception as e:
+			if self.onError == None:
+				logging.error("Task %s failed: %s" % (self.name, e))
+			else:
+				self.onError(self, e)
+
+		now 	= time.time()
+		elapsed = now - start
+
+		self.runs = self.runs + 1
+		metrics.TASKS.labels(self.name).observe(elapsed)
+
+		if not self.deadline == None and elapsed > self.deadline:
+			self.overruns = self.overruns + 1
+			metrics.TASK_OVERRUNS.add((self.name,))
+			logging.debug("Task %s took %.3f sec. (deadline %.3f sec.)" % (self.name, elapsed, self.deadline))
+
+		self.due = self.due + self.period
+
+		if self.due <= now:
+			missed 		= int((now - self.due) / self.period) + 1
+			self.due 	= self.due + missed * self.period
+			self.missed = self.missed + missed
+			metrics.TASK_MISSED.add((self.name,), missed)
+
+		return self.due
+
+	def __repr__(self):
+		return "PeriodicTask(%r, period=%r, jitter=%r, deadline=%r)" % (
+			self.name, self.period, self.jitter, self.deadline)
@@ -0,0 +1,252 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Versioned store for the values of sensor variables (used by @SensorValues).
+Every change of a value gets the next version number of the store, thus the
+changes since any point in time could be found without scanning all values:
+
+	since = store.version
+
+	store.set('x', 1)
+	store.set('y', 2)
+
+	store.diff(since)		# {'x' : 1, 'y' : 2}
+
+Snapshots are consistent views of all values, taken in O(1): they share the
+values with the store, which copies them before the next change (copy on write).
+'''
+
+import bisect
+import threading
+
+class Snapshot:
+	'''
+	Read-only view of the values of a @ValueStore at one version.
+	'''
+
+	def __init__(self, values, versions, version):
+		'''
+		@param	values		dictionary name -> value (not changed anymore)
+		@param	versions	dictionary name -> version of the last change
+		@param	version		version of the store
+		'''
+
+		self.version 	= version
+
+		self.__values 	= values
+		self.__versions = versions
+
+	def get(self, name):
+		'''
+		@param	name	name of variable
+		@return			value of the variable, raises KeyError if it has none
+		'''
+
+		return self.__values[name]
+
+	def versionOf(self, name):
+		'''
+		@param	name	name of variable
+		@return			version of the last change of the variable (0 if it has none)
+		'''
+
+		return self.__versions.get(name, 0)
+
+	def names(self):
+		'''
+		@return		list of the names of all variables
+		'''
+
+		return self.__values.keys()
+
+	def items(self):
+		'''
+		@return		list of name/value tuples of all variables
+		'''
+
+		return self.__values.items()
+
+	def __contains__(self, name):
+		return name in self.__values
+
+	def __len__(self):
+		return len(self.__values)
+
+class ValueStore:
+	'''
+	Values of variables, with a version per variable, a dirty set, snapshots and
+	diffs. May be used from many threads.
+	'''
+
+	def __init__(self):
+
+		self.version 	= 0			# version of the last change
+
+		self.__values 	= {}		# name -> value
+		self.__versions = {}		# name -> version of the last change
+		self.__log 		= []		# (version, name) of the changes, ordered by version
+		self.__dirty 	= set()		# names changed since the last @takeDirty
+		self.__shared 	= False		# True while values are shared with a snapshot
+		self.__lock 	= threading.Lock()
+
+	def get(self, name):
+		'''
+		@param	name	name of variable
+		@return			value of the variable, raises KeyError if it has none
+		'''
+
+		return self.__values[name]
+
+	def versionOf(self, name):
+		'''
+		@param	name	name of variable
+		@return			version of the last change of the variable (0 if it has none)
+		'''
+
+		return self.__versions.get(name, 0)
+
+	def names(self):
+		'''
+		@return		list of the names of all variables
+		'''
+
+		return self.__values.keys()
+
+	def __contains__(self, name):
+		return name in self.__values
+
+	def __len__(self):
+		return len(self.__values)
+
+	def set(self, name, value):
+		'''
+		Change the value of a variable. Setting the value it already has changes
+		nothing (and does not count as change).
+
+		@param	name	name of variable
+		@param	value	new value
+		@return			True if the value changed
+		'''
+
+		# most updates set the value a variable already has, they need no lock
+		try:
+			if self.__values[name] == value:
+				return False
+		except:
+			pass
+
+		self.__lock.acquire()
+
+		try:
+			values = self.__values
+
+			try:
+				if values[name] == value:
+					return False
+			except:
+				pass
+
+			if self.__shared:
+				values 				= dict(values)
+				self.__values 		= values
+				self.__versions 	= dict(self.__versions)
+				self.__shared 		= False
+
+			self.version 				= self.version + 1
+			values[name] 				= value
+			self.__versions[name] 		= self.version
+
+			self.__log.append((self.version, name))
+			self.__dirty.add(name)
+
+			# drop the entries of changes overwritten by later ones
+			if len(self.__log) > 2 * len(values) + 64:
+				self.__log = sorted([ (v, n) for (n, v) in self.__versions.items() ])
+
+			return True
+
+		finally:
+			self.__lock.release()
+
+	def snapshot(self):
+		'''
+		@return		@Snapshot of the current values
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			self.__shared = True
+			return Snapshot(self.__values, self.__versions, self.version)
+		finally:
+			self.__lock.release()
+
+	def diff(self, since):
+		'''
+		Find the variables changed after a version. Takes time in the number of
+		changes since then, not in the number of variables.
+
+		@param	since	version (e.g. @version of the store or of a @Snapshot)
+		@return			dictionary name -> current value of the variables changed
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			log 		= self.__log
+			versions 	= self.__versions
+			values 		= self.__values
+			changed 	= {}
+
+			for i in xrange(bisect.bisect_left(log, (since + 1,)), len(log)):
+
+				(version, name) = log[i]
+
+				# later changes of the variable are found later on
+				if versions[name] == version:
+					changed[name] = values[name]
+
+			return changed
+
+		finally:
+			self.__lock.release()
+
+	def takeDirty(self):
+		'''
+		Get the variables changed since the last call, and start over.
+
+		@return		set of names of the variables changed
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			dirty 			= self.__dirty
+			self.__dirty 	= set()
+
+			return dirty
+
+		finally:
+			self.__lock.release()
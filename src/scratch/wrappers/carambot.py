@@ -25,10 +25,8 @@ This file is part of the Scratch Remote Sensor Library project
 
 import logging
 
-from ubot.rob.carambot 		import Robot
-from ubot.rob.simplepilot 	import RobotPilot
-
 from scratch.remotesensor import RemoteSensor, DEFAULT_HOST, DEFAULT_PORT 
+from scratch.router import broadcast
 
 class DummyVehicle:
 	'''
@@ -147,16 +145,18 @@ class CarambotRemoteSensor(RemoteSensor):
 		if dummyBot:
 			self.robot = DummyBot(sherpaPort, True)
 		else:
+			# the robot library is only needed (and imported) to drive a real robot
+			from ubot.rob.carambot import Robot
+
 			self.robot = Robot(sherpaPort, True)
  
 		RemoteSensor.__init__(self, args = myArgs)
 
-		self.updateHandler  = self.__updateHandler
-		self.messageHandler = self.__messageHandler
+		self.subscribe('autopilot', self.__autopilotChanged)
 
-	def __updateHandler(self, var, val):
+	def __autopilotChanged(self, var, val):
 		'''
-		Handler called for incoming sensor-updates ...
+		Handler called for incoming updates of the autopilot variable.
 
 		@param	var		name of variable which was updated
 		@param	val		new value assigned to var
@@ -164,28 +164,30 @@ class CarambotRemoteSensor(RemoteSensor):
 
 		logging.info("Received update: %s = %s" % (var, val))
 
-		if var == "autopilot":
-			if val == 1:
+		if val == 1:
 
-				logging.debug("Starting autupilot thread")
-				self.pilot = RobotPilot(self.robot)
-				self.pilot.daemon = True
-				self.pilot.start()
-				self.bcastMsg('autopilot-started')
+			from ubot.rob.simplepilot import RobotPilot
 
-			else:
+			logging.debug("Starting autupilot thread")
+			self.pilot = RobotPilot(self.robot)
+			self.pilot.daemon = True
+			self.pilot.start()
+			self.bcastMsg('autopilot-started')
+
+		else:
 
-				if not self.pilot == None:
+			if not self.pilot == None:
 
-					logging.debug("Autopilot is running, trying to stop it ...")
-					self.pilot.abort = True
-					self.pilot.join()
-					del self.pilot
-					self.bcastMsg('autopilot-stoped')
+				logging.debug("Autopilot is running, trying to stop it ...")
+				self.pilot.abort = True
+				self.pilot.join()
+				del self.pilot
+				self.bcastMsg('autopilot-stoped')
 
-	def __messageHandler(self, t, msg):
+	@broadcast('*', blocking = False)
+	def __received(self, t, msg):
 		'''
-		Handler called for incoming broadcast messages ... 
+		Handler called for all incoming broadcast messages ... 
 
 		@param	t		message type (currently always broadcast)
 		@param	msg		message received
@@ -193,82 +195,114 @@ class CarambotRemoteSensor(RemoteSensor):
 
 		logging.info("Received message: %s" % msg)
 
-		if not self.pilot == None:
-			logging.warn("Not processing commands: autopilot is active")
-			self.bcastMsg('autopilot-active')
-			return
+		# no command routed to the message besides this handler
+		if len(self.router.routes(msg)) < 2:
+			logging.warn("Unknown message: %s" % msg)	
 
-		if msg == "forward": 
+	def __piloted(self):
+		'''
+		Refuse commands while the autopilot is active.
 
-			ticks = 100
-		
-			if self.values.forwardticks > 0:
-				ticks = self.values.forwardticks
+		@return		True if the autopilot is active
+		'''
 
-			full = self.robot.vehicle.fw(ticks)
+		if self.pilot == None:
+			return False
 
-			if not full:
-				self.bcastMsg('obstacle-detected')
-			else:
-				self.bcastMsg('stoped')
+		logging.warn("Not processing commands: autopilot is active")
+		self.bcastMsg('autopilot-active')
 
-		elif msg == "stop": 
+		return True
 
-			self.robot.vehicle.br()
-			self.bcastMsg('stoped')
+	@broadcast('forward')
+	def __forward(self, t, msg):
 
-		elif msg == "turn": 
+		if self.__piloted():
+			return
 
-			self.robot.vehicle.tr(self.values.turndeg)
+		ticks = 100
+	
+		if self.values.forwardticks > 0:
+			ticks = self.values.forwardticks
+
+		full = self.robot.vehicle.fw(ticks)
+
+		if not full:
+			self.bcastMsg('obstacle-detected')
+		else:
 			self.bcastMsg('stoped')
 
-		elif msg == "range": 
+	@broadcast('stop')
+	def __stop(self, t, msg):
 
-			self.values.range = self.robot.panrf.rangeAt(self.values.rangedeg)
-			self.bcastMsg('range-updated')
+		if self.__piloted():
+			return
+
+		self.robot.vehicle.br()
+		self.bcastMsg('stoped')
+
+	@broadcast('turn')
+	def __turn(self, t, msg):
+
+		if self.__piloted():
+			return
+
+		self.robot.vehicle.tr(self.values.turndeg)
+		self.bcastMsg('stoped')
+
+	@broadcast('range')
+	def __range(self, t, msg):
 
-		elif msg == "rangeminmax": 
+		if self.__piloted():
+			return
 
-			area = self.robot.panrf.scanArea()
-		
-			min 	= 9999 
-			max 	= 0 
-			mindeg 	= 0  
-			maxdeg 	= 0 
+		self.values.range = self.robot.panrf.rangeAt(self.values.rangedeg)
+		self.bcastMsg('range-updated')
 
-			for v in area:
-				for p in v:
-					
-					if v[p] > max:
-						max = v[p] 
-						maxdeg = p
+	@broadcast('rangeminmax')
+	def __rangeMinMax(self, t, msg):
 
-					if v[p] < min:
-						min = v[p] 
-						mindeg = p
+		if self.__piloted():
+			return
 
+		area = self.robot.panrf.scanArea()
+	
+		min 	= 9999 
+		max 	= 0 
+		mindeg 	= 0  
+		maxdeg 	= 0 
+
+		for v in area:
+			for p in v:
+				
+				if v[p] > max:
+					max = v[p] 
+					maxdeg = p
+
+				if v[p] < min:
+					min = v[p] 
+					mindeg = p
+
+		with self.values.batch():
 			self.values.rangemin 	= min
 			self.values.rangemindeg = mindeg
 			self.values.rangemax 	= max
 			self.values.rangemaxdeg = maxdeg
-	
-			self.bcastMsg('rangeminmax-updated')
 
-		else:
-
-			logging.warn("Unknown message: %s" % msg)	
+		self.bcastMsg('rangeminmax-updated')
 
 	def setupVariables(self):
 
-		self.values.forwardticks 	=  0
-		self.values.turndeg 		=  0
-		self.values.rangedeg 		=  0
-		self.values.range	 		= -1
-		self.values.rangemin 		= -1 
-		self.values.rangemax 		= -1 
-		self.values.rangemindeg		= -1 
-		self.values.rangemaxdeg 	= -1 
-		self.values.autopilot		=  0
+		with self.values.batch():
+			self.values.forwardticks 	=  0
+			self.values.turndeg 		=  0
+			self.values.rangedeg 		=  0
+			self.values.range	 		= -1
+			self.values.rangemin 		= -1 
+			self.values.rangemax 		= -1 
+			self.values.rangemindeg		= -1 
+			self.values.rangemaxdeg 	= -1 
+			self.values.autopilot		=  0
 
 	def worker(self):
 		'''
@@ -21,17 +21,31 @@
 
 '''
 This file is part of the Scratch Remote Sensor Library project
+
+Daemon running wrappers. Either one wrapper (or many on a @SensorHub, see --wrap)
+within the daemon process, or, with --supervise, a list of wrappers read from a
+file, run by worker processes of a @Supervisor.
 '''
 
 import sys
 import os
 import time
+
+STARTED = time.time()	# time the daemon started loading (for the startup times logged)
+
+import errno
+import signal
 import atexit
 import argparse
 import logging
 import socket
 
-from signal import SIGTERM 
+from signal import SIGTERM, SIGKILL
+
+from scratch import metrics
+from scratch.tasks import PeriodicTask
+from scratch.backoff import Backoff
+from scratch import registry
 
 class Daemon:
 	'''
@@ -43,12 +57,29 @@ class Daemon:
 	stderr			= None
 	pidfile			= None
 	wrapargs		= None
-
-	def __init__(self, wrapargs = {}, pidfile = '/var/run/srsd.pid', stdin = '/dev/null', stdout = '/dev/null', stderr = '/dev/null'):
+	wrappers		= None
+	capture			= None
+	metrics			= None
+	metricsVars		= None
+	wrapperArgs		= None
+	importTimer		= None
+	startTime		= None
+
+	def __init__(self, wrapargs = {}, pidfile = '/var/run/srsd.pid', stdin = '/dev/null', stdout = '/dev/null', stderr = '/dev/null', wrappers = None, capture = None, metrics = None, metricsVars = None, wrapperArgs = None, importTimer = None):
 		'''
 		Construct a new daemon instance.
 
 		@param	wrapargs	argument dictionary passed to wrappers constructor
+		@param	wrappers	list of wrapper classes to run (more than one are run on a @SensorHub)
+		@param	wrapperArgs	list of argument dictionaries, one per wrapper (None to pass
+							wrapargs to all of them)
+		@param	capture		file to capture all protocol frames to (None for no capture)
+		@param	metrics		address to serve metrics at: port, "host:port" or path of a
+							Unix socket (None for no metrics endpoint)
+		@param	metricsVars	publish 'srs-*' sensor variables every metricsVars seconds
+							(None for no publishing)
+		@param	importTimer	installed @registry.ImportTimer, reported (and uninstalled)
+							once the wrappers are up (None for no report)
 		@param	pidfile		pidfile to use for the daemon
 		@param	stdin		where to redirect stdin to 
 		@param	stdout		where to redirect stdout to
@@ -60,6 +91,27 @@ class Daemon:
 		self.stdout 		= stdout
 		self.stderr 		= stderr
 		self.pidfile 		= pidfile
+		self.wrappers 		= wrappers
+		self.capture 		= capture
+		self.metrics 		= metrics
+		self.metricsVars 	= metricsVars
+		self.wrapperArgs 	= wrapperArgs
+		self.importTimer 	= importTimer
+		self.startTime 		= STARTED
+
+		if self.wrappers == None:
+			self.wrappers = []
+
+	def argsOf(self, i):
+		'''
+		@param	i	index of a wrapper
+		@return		argument dictionary for the i-th wrapper
+		'''
+
+		if self.wrapperArgs == None:
+			return self.wrapargs
+
+		return self.wrapperArgs[i]
 
 	def daemonize(self):
 		'''
@@ -190,50 +242,478 @@ class Daemon:
 		'''
 		This method is run within the daemon instance. It creates a new instance of 
 		the given wrapper, passes the wrapargs dictionary to it and start the wrappers
-		server loop.
+		server loop. The loop sleeps until the next periodic task of the wrapper (see
+		@RemoteSensor.tasks) is due.
 		'''
+
+		# the capture is opened here, thus within the daemonized process
+		if not self.capture == None:
+
+			from scratch.capture import CaptureWriter
+			from scratch.prototrace import TRACE
+
+			TRACE.configure(capture=CaptureWriter(self.capture))
+			atexit.register(TRACE.stopCapture)
+
+			logging.info("Capturing protocol frames to %s" % self.capture)
+
+		if not self.metrics == None:
+
+			try:
+				metrics.MetricsServer(self.metrics).start()
+			except Exception as e:
+				logging.error("Unable to serve metrics at %s: %s" % (self.metrics, e))
+
+		if len(self.wrappers) > 1:
+			self.runHub()
+			return
 		
+		from scratch.asyncsensor import SensorLoop
+
 		wrap = None
+		loop = SensorLoop()
 
 		try:
 
-			wrap = WrappedRemoteSensor(self.wrapargs)
+			wrap = self.wrappers[0](self.argsOf(0))
 
 			logging.info("WreppedRemoteSensor entering server loop")
 
-			hbCounterMax = 50
-			hbCounter 	 = 0
-
 			wrap.connect(True)
 			wrap.start()
 
-			while True:
+			self.started()
 
-				try:
-					time.sleep(0.1)
+			tasks = wrap.tasks()
 
-					hbCounter = hbCounter + 1
+			if not self.metricsVars == None:
+				tasks.append(PeriodicTask('metrics', self.metricsVars, metrics.publish, (wrap,), 
+					jitter = self.metricsVars / 10.0))
 
-					# read meminfo from proc filesystem
-					wrap.worker()
+			self.__wrap = wrap
 
-					if hbCounter == hbCounterMax:
-						hbCounter = 0
-						wrap.bcastMsg("heartbeat-%s" % wrap.name)
+			for task in tasks:
+				task.onError = self.__taskFailed
+				loop.schedule(task)
 
-				except socket.error as e:
-					logging.warn("Lost connection to Scratch server!")
-					wrap.connect(True)
+			loop.run()
 
-				except KeyboardInterrupt:
-					break
+		except KeyboardInterrupt:
+			pass
 			
 		except Exception as e:
 			logging.error(e)
 
 		finally:
+			self.__wrap = None
 			del wrap
 
+	def started(self):
+		'''
+		Log the time it took the wrappers to come up (and where the imports spent it).
+		'''
+
+		if not self.importTimer == None:
+
+			self.importTimer.uninstall()
+
+			for line in self.importTimer.report():
+				logging.info(line)
+
+			self.importTimer = None
+
+		logging.info("Wrappers up %.3f sec. after start" % (time.time() - self.startTime))
+
+	def __taskFailed(self, task, e):
+		'''
+		Error handler of the periodic tasks run by @run: reconnect if the connection
+		to the server was lost.
+		'''
+
+		if isinstance(e, socket.error):
+			logging.warn("Lost connection to Scratch server!")
+			self.__wrap.connect(True)
+		else:
+			logging.error("Task %s failed: %s" % (task.name, e))
+
+	def runHub(self):
+		'''
+		Run all wrappers within this process on a shared @SensorHub. Every wrapper gets
+		its own connection to the server.
+		'''
+
+		from scratch.hub import SensorHub
+
+		try:
+
+			hub = SensorHub()
+
+			for (i, w) in enumerate(self.wrappers):
+				hub.addWrapper(w, self.argsOf(i))
+
+			if not self.metricsVars == None:
+				hub.loop.schedule(PeriodicTask('metrics', self.metricsVars, self.__publishMetrics, (hub,), 
+					jitter = self.metricsVars / 10.0))
+
+			logging.info("SensorHub with %d wrappers entering server loop" % len(self.wrappers))
+
+			# runs once the hub started (thus connected) all sensors
+			hub.loop.callSoon(self.started)
+
+			hub.run()
+
+		except KeyboardInterrupt:
+			pass
+
+		except Exception as e:
+			logging.error(e)
+
+	def __publishMetrics(self, hub):
+		'''
+		Periodic task publishing the 'srs-*' variables for all sensors of a hub.
+		'''
+
+		try:
+			for sensor in hub.sensors:
+				if sensor.isConnected():
+					metrics.publish(sensor)
+		except socket.error as e:
+			logging.warn("Publishing metrics failed: %s" % e)
+
+class WorkerProcess:
+	'''
+	A worker process of a @Supervisor, running one or more wrappers.
+	'''
+
+	def __init__(self, name, wrappers, args, cpu = None):
+		'''
+		@param	name		name of the worker (used for logging)
+		@param	wrappers	list of wrapper classes (more than one are run on a @SensorHub)
+		@param	args		list of argument dictionaries, one per wrapper
+		@param	cpu			CPU to pin the process to (None to run on any)
+		'''
+
+		self.name 		= name
+		self.wrappers 	= wrappers
+		self.args 		= args
+		self.cpu 		= cpu
+
+		self.pid 		= None		# pid while running
+		self.started 	= 0.0		# time the process was last started
+		self.restarts 	= 0			# restarts after the process died
+		self.restartAt 	= None		# time the next restart is due
+		self.backoff 	= Backoff(1.0, 60.0)
+
+class Supervisor(Daemon):
+	'''
+	Daemon running wrappers in worker processes (see @readWorkers). Workers which
+	die are restarted (waiting longer after every crash in a row). Only the
+	supervisor writes a pidfile, stopping it stops all workers.
+	'''
+
+	stableTime = 60.0	# seconds a worker must run to reset its restart delay
+
+	def __init__(self, workers, **kwargs):
+		'''
+		@param	workers		list of @WorkerProcess
+		@param	kwargs		see @Daemon (capture and metrics are used by the first worker)
+		'''
+
+		Daemon.__init__(self, **kwargs)
+
+		self.workers 	= workers
+		self.__stopping = False
+
+	def run(self):
+		'''
+		Start the workers and restart them whenever one of them dies, until a SIGTERM
+		is received.
+		'''
+
+		signal.signal(SIGTERM, self.__terminate)
+
+		logging.info("Supervisor starting %d worker processes" % len(self.workers))
+
+		for w in self.workers:
+			self.__spawn(w)
+
+		try:
+
+			while not self.__stopping:
+
+				self.__reap()
+
+				now = time.time()
+
+				for w in self.workers:
+					if w.pid == None and not w.restartAt == None and w.restartAt <= now:
+						w.restarts = w.restarts + 1
+						self.__spawn(w)
+
+				time.sleep(0.2)
+
+		except KeyboardInterrupt:
+			pass
+
+		finally:
+			self.__stopWorkers()
+
+	def __terminate(self, signum, frame):
+		'''
+		Handler for SIGTERM.
+		'''
+
+		self.__stopping = True
+
+	def __spawn(self, w):
+		'''
+		Fork a worker process.
+		'''
+
+		w.restartAt = None
+
+		try:
+			pid = os.fork()
+		except OSError as e:
+			logging.error("Starting worker %s failed: %s" % (w.name, e))
+			w.restartAt = time.time() + w.backoff.next()
+			return
+
+		if pid > 0:
+			w.pid 		= pid
+			w.started 	= time.time()
+			logging.info("Started worker %s (pid %d)" % (w.name, pid))
+			return
+
+		# within the worker process: never return into the supervisor loop
+		try:
+			signal.signal(SIGTERM, signal.SIG_DFL)
+			dieWithParent()
+
+			if not w.cpu == None:
+				setAffinity(w.cpu)
+
+			first = w is self.workers[0]
+
+			d = Daemon(wrappers = w.wrappers, wrapperArgs = w.args, metricsVars = self.metricsVars,
+				capture = first and self.capture or None, metrics = first and self.metrics or None)
+
+			d.startTime = time.time()
+
+			d.run()
+
+		except Exception as e:
+			logging.error("Worker %s failed: %s" % (w.name, e))
+
+		finally:
+			logging.shutdown()
+			os._exit(1)
+
+	def __reap(self):
+		'''
+		Collect workers which died and schedule their restart.
+		'''
+
+		while True:
+
+			try:
+				(pid, status) = os.waitpid(-1, os.WNOHANG)
+			except OSError as e:
+				if e.errno == errno.EINTR:
+					continue
+				return
+
+			if pid == 0:
+				return
+
+			for w in self.workers:
+
+				if not w.pid == pid:
+					continue
+
+				w.pid = None
+
+				if self.__stopping:
+					break
+
+				if time.time() - w.started >= self.stableTime:
+					w.backoff.reset()
+
+				delay = w.backoff.next()
+				w.restartAt = time.time() + delay
+
+				if os.WIFSIGNALED(status):
+					reason = "was killed by signal %d" % os.WTERMSIG(status)
+				else:
+					reason = "exited with status %d" % os.WEXITSTATUS(status)
+
+				logging.warn("Worker %s (pid %d) %s, restarting in %.1f sec." % (w.name, pid, reason, delay))
+
+	def __stopWorkers(self, timeout = 5.0):
+		'''
+		Send SIGTERM to all workers, and SIGKILL to those still running after timeout 
+		seconds.
+		'''
+
+		self.__stopping = True
+
+		for w in self.workers:
+			if not w.pid == None:
+				try:
+					os.kill(w.pid, SIGTERM)
+				except OSError:
+					pass
+
+		deadline = time.time() + timeout
+
+		while time.time() < deadline and [w for w in self.workers if not w.pid == None]:
+			self.__reap()
+			time.sleep(0.1)
+
+		for w in self.workers:
+			if not w.pid == None:
+				logging.warn("Killing worker %s (pid %d)" % (w.name, w.pid))
+				try:
+					os.kill(w.pid, SIGKILL)
+					os.waitpid(w.pid, 0)
+				except OSError:
+					pass
+				w.pid = None
+
+def dieWithParent():
+	'''
+	Have the kernel send SIGTERM to the calling process when its parent dies (Linux 
+	only, does nothing elsewhere).
+	'''
+
+	try:
+		import ctypes
+		import ctypes.util
+
+		PR_SET_PDEATHSIG = 1
+
+		ctypes.CDLL(ctypes.util.find_library('c')).prctl(PR_SET_PDEATHSIG, SIGTERM)
+
+	except (OSError, AttributeError):
+		pass
+
+def setAffinity(cpu):
+	'''
+	Pin the calling process to a CPU (Linux only, does nothing elsewhere).
+
+	@param	cpu		number of the CPU
+	'''
+
+	try:
+		import ctypes
+		import ctypes.util
+
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+		mask = ctypes.c_ulong(1 << cpu)
+
+		if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) == 0:
+			return
+
+		e = ctypes.get_errno()
+		logging.warn("Pinning to CPU %d failed: %s" % (cpu, os.strerror(e)))
+
+	except (OSError, AttributeError) as e:
+		logging.warn("Pinning to CPU %d failed: %s" % (cpu, e))
+
+def parseWrapargs(spec):
+	'''
+	Parse wrapper arguments given as "key=value:key=value".
+
+	@param	spec	argument string
+	@return			argument dictionary
+	'''
+
+	wa = {}
+
+	for a in spec.split(':'):
+		kv = a.split('=')
+		wa[kv[0].strip()] = kv[1].strip()
+
+	return wa
+
+def readWorkers(path, wrapargs = {}):
+	'''
+	Read the wrappers to run by a @Supervisor from a file. Every line names a wrapper,
+	optionally followed by its arguments (merged over wrapargs) and the flag "heavy":
+
+		scratch.wrappers.mon#MonitoringRemoteSensor
+		scratch.wrappers.rpi#PiRemoteSensor		gpio=cdev:debounce=20
+		mysensor#CameraSensor					fps=30		heavy
+
+	Wrappers flagged heavy (doing CPU heavy work) get a worker process of their own,
+	pinned to a CPU of its own where possible. All other wrappers share one worker
+	process (running them on a @SensorHub). Empty lines and lines starting with "#"
+	are ignored.
+
+	@param	path		file to read
+	@param	wrapargs	arguments for all wrappers
+	@return				list of @WorkerProcess
+	'''
+
+	light 	= ([], [])
+	heavy 	= []
+
+	for line in open(path):
+
+		line = line.strip()
+
+		if not line or line.startswith('#'):
+			continue
+
+		fields 	= line.split()
+		args 	= dict(wrapargs)
+
+		for f in fields[1:]:
+			if not f == 'heavy':
+				args.update(parseWrapargs(f))
+
+		cls = importWrapper(fields[0])
+
+		if 'heavy' in fields[1:]:
+			heavy.append((fields[0], cls, args))
+		else:
+			light[0].append(cls)
+			light[1].append(args)
+
+	workers = []
+
+	if light[0]:
+		workers.append(WorkerProcess('light', light[0], light[1]))
+
+	cpus = 1
+
+	try:
+		cpus = os.sysconf('SC_NPROCESSORS_ONLN')
+	except (ValueError, OSError):
+		pass
+
+	for (i, (spec, cls, args)) in enumerate(heavy):
+
+		cpu = None
+
+		# CPU 0 is left to the light wrappers (and the rest of the system)
+		if cpus > 1:
+			cpu = 1 + i % (cpus - 1)
+
+		workers.append(WorkerProcess(spec, [cls], [args], cpu))
+
+	return workers
+
+def importWrapper(spec):
+	'''
+	Import a wrapper class.
+
+	@param	spec	wrapper given as "module#Class", or by its name (see @registry)
+	@return			the wrapper class
+	'''
+
+	return registry.loadWrapper(spec)
+
 if __name__=="__main__":
 
 	parser = argparse.ArgumentParser(description='Scratch Remote Sensor Client daemon')
@@ -253,9 +733,30 @@ if __name__=="__main__":
 	parser.add_argument('--loglevel', dest='loglevel', metavar='NUMBER', default='INFO', 
 		type=str, help='Loglevel to use')
 
+	parser.add_argument('--tracesample', dest='tracesample', metavar='NUMBER', default=1, 
+		type=int, help='Trace only one out of NUMBER frames (with loglevel DEBUG)')
+
+	parser.add_argument('--wiredump', dest='wiredump', action='store_true', default=False, 
+		help='Dump frames as hex (with loglevel DEBUG)')
+
+	parser.add_argument('--capture', dest='capture', metavar='FILE', default=None, 
+		type=str, help='Capture all protocol frames to FILE (see scratch.capture for replay)')
+
+	parser.add_argument('--metrics', dest='metrics', metavar='ADDRESS', default=None, 
+		type=str, help='Serve metrics (Prometheus text format) at PORT, HOST:PORT or Unix socket PATH')
+
+	parser.add_argument('--metricsvars', dest='metricsvars', metavar='SECONDS', default=None, 
+		type=float, help='Publish srs-* sensor variables every SECONDS')
+
 	parser.add_argument('--wrap', dest='wrapper', metavar='WRAPPER', 
 		default='scratch.wrappers.mon#MonitoringRemoteSensor', 
-		type=str, help='Wrapper to instanciate with the daemon')
+		type=str, help='Wrapper to instanciate with the daemon (module#Class or a registered name like pi), separate many by comma to run them within one process')
+
+	parser.add_argument('--importtimes', dest='importtimes', action='store_true', default=False, 
+		help='Log the time spent importing modules until the wrappers are up')
+
+	parser.add_argument('--supervise', dest='supervise', metavar='FILE', default=None, 
+		type=str, help='Run the wrappers listed in FILE in supervised worker processes (instead of --wrap)')
 
 	parser.add_argument('--wrapargs', metavar='ARGS', dest='wrapargs', type=str,  
 		help='Arguments to pass to wrapper instance for configuration')
@@ -286,33 +787,68 @@ if __name__=="__main__":
 		sys.stderr.write(e.__str__() + "\n")
  		sys.exit(1)
 
+	timer = None
+
+	if args.importtimes:
+		timer = registry.ImportTimer()
+		timer.install()
+
+	# configure protocol tracing
+	from scratch.prototrace import TRACE
+
+	TRACE.configure(sample=args.tracesample, wireDump=args.wiredump)
+
 	# see if we have wrapper arguments ...
 	wa = {}
 
 	try:
 
 		if args.wrapargs:
-			al = args.wrapargs.split(':')
-			
-			for a in al:
-				kv = a.split('=')
-				wa[kv[0].strip()] = kv[1].strip()
+			wa = parseWrapargs(args.wrapargs)
 
 	except Exception as e:
 		sys.stderr.write("Invalid wrapper arguments: " + e.__str__() + "\n")
  		sys.exit(1)
 	
 	# see what command the daemon should performe ...
-	d = Daemon(pidfile=args.pidfile, wrapargs=wa)
+	capture = None
+
+	# daemonizing changes the working directory
+	if args.capture:
+		capture = os.path.abspath(args.capture)
+
+	if args.metrics and not args.metrics.isdigit() and not ':' in args.metrics:
+		args.metrics = os.path.abspath(args.metrics)
+
+	d = Daemon(pidfile=args.pidfile, wrapargs=wa, capture=capture, metrics=args.metrics, 
+		metricsVars=args.metricsvars, importTimer=timer)
 
 	# do we need to import the wrapper (only on start/restart)?
-	if args.command == "start" or args.command == "restart":
+	if args.supervise and (args.command == "start" or args.command == "restart"):
+
+		try:
+			workers = readWorkers(args.supervise, wa)
+		except Exception as e:
+			logging.error("Error while reading wrappers from %s: %s\n" % (args.supervise, e))
+			sys.stderr.write("Error while reading wrappers from %s: %s\n" % (args.supervise, e))
+			sys.exit(1)
+
+		# the workers are forked off the supervisor, thus all imports are done by now
+		if not timer == None:
+			timer.uninstall()
+
+			for line in timer.report():
+				logging.info(line)
+
+		d = Supervisor(workers, pidfile=args.pidfile, wrapargs=wa, capture=capture, 
+			metrics=args.metrics, metricsVars=args.metricsvars)
 
-		w = ("%s" % args.wrapper.replace('#', ' import '))
+	elif args.command == "start" or args.command == "restart":
 
 		try:
 
-			exec("from %s as WrappedRemoteSensor" % w)
+			for w in args.wrapper.split(','):
+				d.wrappers.append(importWrapper(w))
 
 		except Exception as e:
 
@@ -26,18 +26,18 @@ This file is part of the Scratch Remote Sensor Library project
 import logging
 
 from scratch.remotesensor import RemoteSensor, DEFAULT_HOST, DEFAULT_PORT 
+from scratch.router import broadcast
 
 class MonitoringRemoteSensor(RemoteSensor):
 	'''
 	This remote sonsor just listens for sensor updates and messages to 
 	print them to the log. 
 
-	This remote sensor broadcasts a "heartbeat-mon" message every 5sec. to show it is
-	still alive. This is mainly used internally to get aware of connection loss and to initiate 
-	a reconnect. 
+	The connection is checked by liveness probes (see @scratch.liveness), which also
+	initiate a reconnect if the server stops answering.
 	'''
 
-	# sensor name e.g. to use in heart-beat
+	# sensor name e.g. to use in the liveness probe variable
 	name = "mon"
 
 	def __init__(self, myArgs = {}):
@@ -50,7 +50,6 @@ class MonitoringRemoteSensor(RemoteSensor):
 		RemoteSensor.__init__(self, args = myArgs)
 
 		self.updateHandler  = self.__updateHandler
-		self.messageHandler = self.__messageHandler
 
 	def __updateHandler(self, var, val):
 		'''
@@ -62,6 +61,8 @@ class MonitoringRemoteSensor(RemoteSensor):
 
 		logging.info("Received update: %s = %s" % (var, val))
 
+	# only logs, thus runs within the receiving thread
+	@broadcast('*', blocking = False)
 	def __messageHandler(self, t, msg):
 		'''
 		Handler called for incoming broadcast messages ... 
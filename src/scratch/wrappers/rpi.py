@@ -23,10 +23,31 @@
 This file is part of the Scratch Remote Sensor Library project
 '''
 
+import time
+import socket
 import logging
-import RPi.GPIO as GPIO
+import threading
 
 from scratch.remotesensor import RemoteSensor, DEFAULT_HOST, DEFAULT_PORT 
+from scratch.inputfilter import createFilter
+from scratch.tasks import PeriodicTask
+from scratch import gpio
+
+# GPIOs offered to Scratch (BCM numbers)
+PINS = [ 4, 17, 18, 21, 22, 23, 24, 25 ]
+
+# variables setting the direction (DIOx) and the value (IOx) of the pins
+DIRECTION_VARS 	= ["DIO%d" % pin for pin in PINS]
+VALUE_VARS 		= ["IO%d" % pin for pin in PINS]
+
+# pin -> name of its value variable
+VALUE_VAR 		= dict(zip(PINS, VALUE_VARS))
+
+# input filters (see @scratch.inputfilter) and the prefix of their variables
+FILTER_KINDS 	= [('debounce', 'DEB'), ('integrate', 'INT'), ('majority', 'MAJ')]
+
+# filter variable (e.g. DEB24) -> (filter kind, pin)
+FILTER_VARS 	= dict(("%s%d" % (prefix, pin), (kind, pin)) for (kind, prefix) in FILTER_KINDS for pin in PINS)
 
 class PiRemoteSensor(RemoteSensor):
 	'''
@@ -71,26 +92,115 @@ class PiRemoteSensor(RemoteSensor):
 	  and at the moment the message was received, check if the port of interest changed. This is
 	  much more efficent then polling a port variable directely in a loop.
 
-	Additonally, this remote sensor broadcasts a "heartbeat-pi" message every 5sec. to show it is
-	still alive. This is mainly used internally to get aware of connection loss and to initiate 
-	a reconnect. 
+	Bouncing contacts (e.g. of buttons) could be filtered per input pin by assigning
+	to one of the following variables (assigning 0 removes the filter):
+
+	* DEBx: debounce window in ms, a new value is only reported after it was stable
+	  for the window
+	* INTx: integrator length, the value is reported after it was sampled that 
+	  many times more often than the opposite value
+	* MAJx: majority filter length, the value reported is the value of the majority
+	  of the last samples
+
+	The same filters could be set by the wrapper arguments debounce, integrate and
+	majority, either for all pins (e.g. "debounce=20") or for a single pin (e.g. 
+	"majority24=5"). While a filter is set, the filtered inputs are sampled by an
+	own task every sampleInterval seconds (wrapper argument "sampleinterval" in ms),
+	which should be well below the filter window.
+
+	The GPIOs are accessed through a backend (see @scratch.gpio) selected by the
+	wrapper argument "gpio": 'rpi' (RPi.GPIO, the default), 'cdev' (GPIO character 
+	device) or 'fake' (no hardware, for testing). If the backend supports edge events,
+	input changes are sent as soon as they happen. With "inputs=poll", the inputs
+	are polled by the worker (every workerInterval seconds) instead.
+
+	The connection is checked by liveness probes (see @scratch.liveness), which also
+	initiate a reconnect if the server stops answering.
 	'''
 
-	__inputs 	= []
+	gpio = None		# @scratch.gpio.GpioBackend used
+
+	sampleInterval = 0.005	# seconds between two samples of the filtered inputs
 
-	# sensor name e.g. to use in heart-beat
+	# sensor name e.g. to use in the liveness probe variable
 	name = "pi"
 
 	def __init__(self, myArgs = {}):
 		'''
 		Create a new instance of the monitoring remote sensor. 
 
-		@param	myArgs	arguments for the sensor: host and port.
+		@param	myArgs	arguments for the sensor: host, port, gpio (backend), inputs 
+						('event' or 'poll'), input filters (debounce, integrate
+						and majority, optionally followed by a pin number) and
+						sampleinterval (ms between two samples of filtered inputs).
 		'''
 
+		# the handlers of different variables may run concurrently (see
+		# @scratch.dispatch), the pin state is shared with the worker
+		self.__lock 	= threading.Lock()
+
 		RemoteSensor.__init__(self, args = myArgs)
 
-		self.updateHandler = self.__updateHandler
+		backend = 'rpi'
+
+		if myArgs.has_key('gpio'):
+			backend = myArgs['gpio']
+
+		self.gpio 		= gpio.createBackend(backend)
+		self.__inputs 	= []
+		self.__events 	= self.gpio.events
+		self.__mask 	= 0		# bitmask of the polled inputs
+		self.__sampled 	= 0		# levels of the polled inputs as last sampled
+		self.__filters 	= {}	# pin -> @scratch.inputfilter.InputFilter
+		self.__filtered = 0		# bitmask of the pins with a filter
+		self.__sampler 	= None	# @PeriodicTask sampling the filtered inputs
+
+		if myArgs.has_key('inputs'):
+			if myArgs['inputs'] == 'poll':
+				self.__events = False
+			elif not myArgs['inputs'] == 'event':
+				logging.warn("Invalid input mode [%s] ignored" % myArgs['inputs'])
+			elif not self.gpio.events:
+				logging.warn("GPIO backend %s has no edge events, polling inputs" % backend)
+
+		if myArgs.has_key('sampleinterval'):
+			try:
+				interval = float(myArgs['sampleinterval'])
+				if interval <= 0:
+					raise ValueError()
+				self.sampleInterval = interval / 1000.0
+			except ValueError:
+				logging.warn("Invalid value [%s] for sampleinterval ignored" % myArgs['sampleinterval'])
+
+		for (kind, prefix) in FILTER_KINDS:
+			for key in [kind] + ["%s%d" % (kind, pin) for pin in PINS]:
+
+				if not myArgs.has_key(key):
+					continue
+
+				try:
+					param = int(myArgs[key])
+				except ValueError:
+					logging.warn("Invalid value [%s] for %s ignored" % (myArgs[key], key))
+					continue
+
+				if key == kind:
+					pins = PINS
+				else:
+					pins = [int(key[len(kind):])]
+
+				for pin in pins:
+					self.__setFilter(pin, createFilter(kind, param))
+
+		# Scratch keeps the case of variable names as typed by the user
+		for var in DIRECTION_VARS:
+			self.subscribe(var, self.__directionChanged, ignoreCase = True)
+
+		for var in VALUE_VARS:
+			self.subscribe(var, self.__valueChanged, ignoreCase = True)
+
+		for var in FILTER_VARS.keys():
+			self.subscribe(var, self.__filterChanged, ignoreCase = True)
 
 	def __del__(self):
 		'''	
@@ -98,52 +208,176 @@ class PiRemoteSensor(RemoteSensor):
 		'''
 
 		try:
-			GPIO.cleanup()
+			self.gpio.close()
 		except:
 			pass
 			
-	def __updateHandler(self, var, val):
+	def __directionChanged(self, var, val):
 		'''
-		Handler called for incoming sensor-updates ...
+		Handler called for incoming updates of the DIOx variables.
 
 		@param	var		name of variable which was updated
 		@param	val		new value assigned to var
 		'''
 
-		vu  = var.upper()
+		self.__lock.acquire()
 
-		if isinstance(val, (int)):
-			
-			if vu in ["DIO4", "DIO17", "DIO18", "DIO21", "DIO22", "DIO23", "DIO24", "DIO25" ]:
-
-				pin = int(var[3:])
-
-				if val == 0:
-					logging.debug("Setting %s as OUTPUT" % vu)
-					GPIO.setup(pin, GPIO.OUT)	
-					slef.__inputs[:] = (value for value in self.__inputs if value != pin)
-					logging.debug("Currently monitored inputs: %s" % self.__inputs)
-				elif val == 1:
-					logging.debug("Setting %s as INPUT" % vu)
-					GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)	
+		try:
+			vu = var.upper()
+
+			if not isinstance(val, (int)):
+				logging.warn("Allowed value for %s is only 0 or 1 (was %s)" % (vu, val))
+				return
+
+			pin = int(var[3:])
+
+			if val == 0:
+				logging.debug("Setting %s as OUTPUT" % vu)
+				self.__inputs[:] = (value for value in self.__inputs if value != pin)
+				self.__mask = self.__mask & ~(1 << pin)
+				self.gpio.setup(pin, gpio.OUT)	
+				logging.debug("Currently monitored inputs: %s" % self.__inputs)
+			elif val == 1:
+				logging.debug("Setting %s as INPUT" % vu)
+				self.gpio.setup(pin, gpio.IN)	
+				if not pin in self.__inputs:
 					self.__inputs.append(pin)
-					logging.debug("Currently monitored inputs: %s" % self.__inputs)
-				else:
-					logging.warn("Unknown direction %d for pin %s" % (val, vu))
+				self.__monitor(pin)
+				logging.debug("Currently monitored inputs: %s" % self.__inputs)
+			else:
+				logging.warn("Unknown direction %d for pin %s" % (val, vu))
+		finally:
+			self.__lock.release()
+
+	def __valueChanged(self, var, val):
+		'''
+		Handler called for incoming updates of the IOx variables.
 
-			elif vu in ["IO4", "IO17", "IO18", "IO21", "IO22", "IO23", "IO24", "IO25" ]:
+		@param	var		name of variable which was updated
+		@param	val		new value assigned to var
+		'''
 
-				pin = int(var[2:])
+		self.__lock.acquire()
 
-				if val == 0:
-					GPIO.output(pin, GPIO.LOW)
-				elif val == 1:
-					GPIO.output(pin, GPIO.HIGH)
-				else:
-					logging.warn("Unknown setting %d for pin %s" % (val, vu))
+		try:
+			vu = var.upper()
+
+			if not isinstance(val, (int)):
+				logging.warn("Allowed value for %s is only 0 or 1 (was %s)" % (vu, val))
+				return
+
+			pin = int(var[2:])
+
+			if val == 0:
+				self.gpio.output(pin, gpio.LOW)
+			elif val == 1:
+				self.gpio.output(pin, gpio.HIGH)
+			else:
+				logging.warn("Unknown setting %d for pin %s" % (val, vu))
+		finally:
+			self.__lock.release()
+
+	def __filterChanged(self, var, val):
+		'''
+		Handler called for incoming updates of the filter variables (e.g. DEB24).
 
+		@param	var		name of variable which was updated
+		@param	val		new value assigned to var
+		'''
+
+		self.__lock.acquire()
+
+		try:
+			vu = var.upper()
+
+			if not isinstance(val, (int)):
+				logging.warn("Allowed value for %s is an integer (was %s)" % (vu, val))
+				return
+
+			(kind, pin) = FILTER_VARS[vu]
+
+			logging.debug("Setting %s filter of IO%d to %d" % (kind, pin, val))
+			self.__setFilter(pin, createFilter(kind, val))
+
+			if pin in self.__inputs:
+				self.__monitor(pin)
+		finally:
+			self.__lock.release()
+
+	def __setFilter(self, pin, inputFilter):
+		'''
+		Set (or remove) the input filter of a pin.
+
+		@param	pin				BCM pin number
+		@param	inputFilter		@scratch.inputfilter.InputFilter, None for no filter
+		'''
+
+		if inputFilter == None:
+			self.__filters.pop(pin, None)
+			self.__filtered = self.__filtered & ~(1 << pin)
 		else:
-			logging.warn("Allowed value for %s is only 0 or 1 (was %s)" % (val, vu))
+			self.__filters[pin] = inputFilter
+			self.__filtered = self.__filtered | (1 << pin)
+
+		if not self.__sampler == None:
+			self.__sampler.period = self.__samplerPeriod()
+
+	def __samplerPeriod(self):
+		'''
+		@return		period of the sampler task: sampleInterval while any filter is set,
+					otherwise it only idles (at the pace of the worker)
+		'''
+
+		if self.__filtered:
+			return self.sampleInterval
+
+		return max(self.workerInterval or 0, self.sampleInterval)
+
+	def __monitor(self, pin):
+		'''
+		Start monitoring an input pin: by edge events if enabled and the pin has no 
+		filter, otherwise by the worker. The current value is reported right away.
+
+		@param	pin		BCM pin number
+		'''
+
+		bit = 1 << pin
+
+		if self.__events and not self.__filtered & bit:
+			self.__mask = self.__mask & ~bit
+			self.gpio.watch(pin, self.__inputChanged)
+			self.__inputChanged(pin, self.gpio.input(pin))
+			return
+
+		self.gpio.unwatch(pin)
+
+		value = self.gpio.input(pin)
+
+		if self.__filtered & bit:
+			self.__filters[pin].reset(value, time.time())
+
+		self.__sampled 	= self.__sampled & ~bit | (value << pin)
+		self.__mask 	= self.__mask | bit
+
+		self.__inputChanged(pin, value)
+
+	def __inputChanged(self, pin, value):
+		'''
+		Edge call-back of the GPIO backend: report the new value of an input pin right
+		away, followed by the "input-changed" broadcast.
+
+		@param	pin		BCM pin number
+		@param	value	new value of the pin
+		'''
+
+		if not self.isConnected():
+			return
+
+		try:
+			if self.values.set(VALUE_VAR[pin], value):
+				self.bcastMsg("input-changed")
+		except socket.error as e:
+			logging.debug("Reporting change of IO%d failed: %s" % (pin, e))
 
 	def setupVariables(self):
 		'''
@@ -151,33 +385,125 @@ class PiRemoteSensor(RemoteSensor):
 		message to the server to anounce in which state the pins are. 
 		'''
 		
-		GPIO.setmode(GPIO.BCM)
+		self.__lock.acquire()
+
+		try:
+			self.__inputs 	= []
+			self.__mask 	= 0
+			self.__sampled 	= 0
 
-		self.__inputs = []
+			with self.values.batch():
 
-		for pin in [ 4, 17, 18, 21, 22, 23, 24, 25 ]:
+				for pin in PINS:
 
-			GPIO.setup(pin, GPIO.OUT)	
-			GPIO.output(pin, GPIO.LOW)
-			self.values.set("DIO%d" % pin, 0)
-			self.values.set("IO%d" % pin, 0)
+					self.gpio.setup(pin, gpio.OUT)	
+					self.gpio.output(pin, gpio.LOW)
+					self.values.set("DIO%d" % pin, 0)
+					self.values.set("IO%d" % pin, 0)
+		finally:
+			self.__lock.release()
 	
+	def tasks(self):
+		'''
+		Periodic tasks of the sensor (see @RemoteSensor.tasks), with an additional task
+		sampling the filtered inputs every sampleInterval seconds. While no filter is
+		set, the task idles.
+
+		@return		list of @scratch.tasks.PeriodicTask
+		'''
+
+		tasks = RemoteSensor.tasks(self)
+
+		self.__sampler = PeriodicTask('%s.sample' % self.name, self.__samplerPeriod(),
+			self.__sampleFiltered, jitter = self.sampleInterval / 2.0)
+
+		tasks.append(self.__sampler)
+
+		return tasks
+
 	def worker(self):
 		'''
 		Check all ports which are configured as input for state change. If a 
 		state change was detected report the change through a sensor-update message.
-		Also a "input-changed" message is broadcasted.
+		Also a "input-changed" message is broadcasted. Only inputs with a filter are
+		checked if the others are reported by edge events, and these only if there
+		is no sampler task (see @tasks).
+
+		All inputs are read at once (see @scratch.gpio.GpioBackend.sample), and only
+		the pins which changed since the last sample are sent (in one update). Pins
+		with a filter are sent when their filtered value changed.
 		'''
-	
-		changed = False
 
-		for pin in self.__inputs:
+		self.__lock.acquire()
+
+		try:
+			if self.__sampler == None:
+				self.__sample(self.__mask)
+			else:
+				self.__sample(self.__mask & ~self.__filtered)
+		finally:
+			self.__lock.release()
+
+	def __sampleFiltered(self):
+		'''
+		Run by the sampler task: sample the filtered inputs.
+		'''
+
+		if not self.__mask & self.__filtered:
+			return
+
+		self.__lock.acquire()
+
+		try:
+			self.__sample(self.__mask & self.__filtered)
+		finally:
+			self.__lock.release()
+
+	def __sample(self, mask):
+		'''
+		Sample the given inputs and report the changed ones (the lock must be held).
+
+		@param	mask	bitmask of the pins to sample
+		'''
 
-			i = GPIO.input(pin)
+		if not mask:
+			return
 
-			if self.values.set("IO%d" % pin, i):
-				changed = True
+		bank 		= self.gpio.sample(mask)
+		filtered 	= self.__filtered & mask
+		diff 		= (bank ^ self.__sampled) & mask & ~filtered
+
+		if not diff and not filtered:
+			return
+
+		self.__sampled 	= self.__sampled & ~mask | bank
+		changed 		= False
+
+		with self.values.batch():
+
+			while diff:
+
+				bit 	= diff & -diff
+				pin 	= bit.bit_length() - 1
+				diff 	= diff ^ bit
+
+				if self.values.set(VALUE_VAR[pin], (bank >> pin) & 1):
+					changed = True
+
+			now = time.time()
+
+			while filtered:
+
+				bit 		= filtered & -filtered
+				pin 		= bit.bit_length() - 1
+				filtered 	= filtered ^ bit
+				inputFilter = self.__filters.get(pin)
+
+				if inputFilter == None or not inputFilter.feed((bank >> pin) & 1, now):
+					continue
+
+				if self.values.set(VALUE_VAR[pin], inputFilter.value):
+					changed = True
 
 		if changed:
 			self.bcastMsg("input-changed")
-
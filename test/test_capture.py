@@ -0,0 +1,156 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Tests for writing and replaying protocol captures (see @scratch.capture).
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import binascii
+
+from scratch.capture import CaptureWriter, CaptureReader, replayToSensor, info
+from scratch.prototrace import TRACE, HexDump
+from scratch.remotesensor import RemoteSensor
+from scratch.dispatch import createDispatcher
+
+class CaptureTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.dir 	= tempfile.mkdtemp()
+		self.path 	= os.path.join(self.dir, 'test.cap')
+
+	def tearDown(self):
+
+		TRACE.stopCapture()
+		shutil.rmtree(self.dir)
+
+	def testRoundTrip(self):
+
+		w = CaptureWriter(self.path)
+		w.record('>', 'sensor-update "a" 1')
+		w.record('<', 'broadcast "go"')
+		w.record('>', '')
+		w.close()
+
+		r = CaptureReader(self.path)
+
+		try:
+			records = list(r)
+
+			self.assertEqual([(d, m) for (o, d, m) in records],
+				[('>', 'sensor-update "a" 1'), ('<', 'broadcast "go"'), ('>', '')])
+
+			offsets = [o for (o, d, m) in records]
+			self.assertEqual(offsets, sorted(offsets))
+
+			self.assertEqual([m for (o, d, m) in r.frames('<')], ['broadcast "go"'])
+
+			s = info(r)
+			self.assertEqual((s['frames'], s['out'], s['in']), (3, 2, 1))
+			self.assertEqual(s['bytes'], len('sensor-update "a" 1') + len('broadcast "go"'))
+		finally:
+			r.close()
+
+	def testTruncatedRecord(self):
+
+		w = CaptureWriter(self.path)
+		w.record('>', 'broadcast "one"')
+		w.record('>', 'broadcast "two"')
+		w.close()
+
+		f = open(self.path, 'r+b')
+		f.truncate(os.path.getsize(self.path) - 3)
+		f.close()
+
+		r = CaptureReader(self.path)
+
+		try:
+			self.assertEqual([m for (o, d, m) in r], ['broadcast "one"'])
+		finally:
+			r.close()
+
+	def testNoCapture(self):
+
+		f = open(self.path, 'wb')
+		f.write('not a capture file')
+		f.close()
+
+		self.assertRaises(ValueError, CaptureReader, self.path)
+
+	def testReplayToSensor(self):
+
+		w = CaptureWriter(self.path)
+		w.record('<', 'sensor-update "x" 5 "y" "abc"')
+		w.record('>', 'sensor-update "ignored" 1')
+		w.record('<', 'broadcast "go"')
+		w.close()
+
+		received = []
+
+		rs = RemoteSensor()
+		rs.dispatcher = createDispatcher('inline')
+		rs.messageHandler = lambda t, m: received.append(m)
+
+		r = CaptureReader(self.path)
+
+		try:
+			self.assertEqual(replayToSensor(r, rs, None), 2)
+		finally:
+			r.close()
+
+		self.assertEqual(rs.values.get('x'), 5)
+		self.assertEqual(rs.values.get('y'), 'abc')
+		self.assertFalse('ignored' in rs.values.snapshot())
+		self.assertEqual(received, ['go'])
+
+	def testUnicodeFrame(self):
+
+		written = []
+
+		rs = RemoteSensor()
+		rs._writeFrame = written.append
+
+		TRACE.configure(capture = CaptureWriter(self.path))
+		rs.sendRawMsg(u'sensor-update "u" "caf\xe9"')
+		TRACE.stopCapture()
+
+		expected = u'sensor-update "u" "caf\xe9"'.encode('utf-8')
+
+		self.assertEqual(written, [expected])
+
+		r = CaptureReader(self.path)
+
+		try:
+			self.assertEqual([m for (o, d, m) in r], [expected])
+		finally:
+			r.close()
+
+		self.assertEqual(str(HexDump(expected)), "%08x %s" % (len(expected), binascii.hexlify(expected)))
+
+if __name__ == '__main__':
+	unittest.main()
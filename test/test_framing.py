@@ -0,0 +1,198 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Tests for the remote sensor protocol framing (see @scratch.framing).
+'''
+
+import socket
+import logging
+import unittest
+
+from scratch.framing import HEADER, encodeFrame, packFrames, FrameWriter, FrameReader
+
+def recvAll(sock, size):
+	'''
+	@return		exactly size bytes read from sock
+	'''
+
+	data = ''
+
+	while len(data) < size:
+		chunk = sock.recv(size - len(data))
+		if not chunk:
+			break
+		data = data + chunk
+
+	return data
+
+class FrameWriterTest(unittest.TestCase):
+
+	def setUp(self):
+
+		(self.a, self.b) = socket.socketpair()
+
+	def tearDown(self):
+
+		self.a.close()
+		self.b.close()
+
+	def testPackFrames(self):
+
+		buf = bytearray(2)
+		n = packFrames(buf, ['ab', '', 'xyz'])
+
+		self.assertEqual(3 * HEADER.size + 5, n)
+		self.assertEqual(HEADER.pack(2) + 'ab' + HEADER.pack(0) + HEADER.pack(3) + 'xyz', str(buf[:n]))
+
+	def testEncodeFrame(self):
+
+		self.assertEqual('h\xc3\xa4llo', encodeFrame(u'h\xe4llo'))
+		self.assertTrue(isinstance(encodeFrame(u'abc'), str))
+
+		msg = 'already bytes'
+		self.assertTrue(encodeFrame(msg) is msg)
+
+	def testWriteUnicode(self):
+
+		w = FrameWriter(self.a)
+		w.start()
+		w.put(encodeFrame(u'broadcast "gr\xfc\xdf"'))
+		w.put('broadcast "x"')
+		w.close()
+		w.join(5)
+
+		payload = 'broadcast "gr\xc3\xbc\xc3\x9f"'
+		expected = HEADER.pack(len(payload)) + payload + HEADER.pack(13) + 'broadcast "x"'
+
+		self.assertEqual(expected, recvAll(self.b, len(expected)))
+		self.assertEqual(None, w.error)
+
+	def testPutAfterError(self):
+
+		self.a.shutdown(socket.SHUT_WR)
+
+		w = FrameWriter(self.a)
+		w.start()
+
+		# the writer logs the failed write
+		logging.disable(logging.WARNING)
+
+		try:
+			w.put('broadcast "lost"')
+			w.join(5)
+		finally:
+			logging.disable(logging.NOTSET)
+
+		self.assertFalse(w.isAlive())
+		self.assertTrue(isinstance(w.error, socket.error))
+		self.assertRaises(socket.error, w.put, 'broadcast "again"')
+
+	def testPutAfterClose(self):
+
+		w = FrameWriter(self.a)
+		w.start()
+		w.close()
+		w.join(5)
+
+		self.assertRaises(socket.error, w.put, 'broadcast "late"')
+
+class FrameReaderTest(unittest.TestCase):
+
+	def setUp(self):
+
+		(self.a, self.b) = socket.socketpair()
+
+	def tearDown(self):
+
+		self.a.close()
+		self.b.close()
+
+	def frame(self, msg):
+
+		return HEADER.pack(len(msg)) + msg
+
+	def testSplitFrames(self):
+
+		data 	= self.frame('sensor-update "a" 1') + self.frame('') + self.frame('broadcast "go"')
+		r 		= FrameReader(self.b)
+		msgs 	= []
+
+		# feed the stream one byte at a time, splitting headers and payloads
+		for c in data:
+			self.a.sendall(c)
+			msgs.extend(r.frames(r.fill()))
+
+		self.assertEqual(['sensor-update "a" 1', '', 'broadcast "go"'], msgs)
+
+	def testFrameLargerThanBuffer(self):
+
+		msg = 'sensor-update "big" "%s"' % ('x' * 1000)
+		r 	= FrameReader(self.b, bufSize = 16)
+
+		self.a.sendall(self.frame('broadcast "a"') + self.frame(msg) + self.frame('broadcast "b"'))
+		self.a.close()
+
+		msgs = []
+
+		while True:
+			got = r.read()
+			if got == None:
+				break
+			msgs.extend(got)
+
+		self.assertEqual(['broadcast "a"', msg, 'broadcast "b"'], msgs)
+
+	def testUnicodeRoundTrip(self):
+
+		text 	= u'broadcast "\u00fcber \u20ac"'
+		w 		= FrameWriter(self.a)
+		w.start()
+		w.put(encodeFrame(text))
+		w.close()
+		w.join(5)
+
+		msgs = FrameReader(self.b).read()
+
+		self.assertEqual([text.encode('utf-8')], msgs)
+		self.assertEqual(text, msgs[0].decode('utf-8'))
+
+	def testOversizedFrame(self):
+
+		r = FrameReader(self.b)
+		r.maxFrame = 100
+
+		self.a.sendall(HEADER.pack(101) + 'x' * 10)
+
+		self.assertRaises(ValueError, r.frames, r.fill())
+
+	def testClosed(self):
+
+		r = FrameReader(self.b)
+		self.a.close()
+
+		self.assertEqual(None, r.read())
+
+if __name__ == '__main__':
+	unittest.main()
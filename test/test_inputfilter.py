@@ -0,0 +1,140 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Tests for the digital input filters (see @scratch.inputfilter).
+'''
+
+import unittest
+
+from scratch.inputfilter import createFilter, DebounceFilter, IntegratorFilter, MajorityFilter
+
+def feedAll(f, samples, start = 0.0, step = 0.001):
+	'''
+	Feed samples taken every step seconds.
+
+	@return		list of the filtered values after every sample
+	'''
+
+	values = []
+
+	for (i, s) in enumerate(samples):
+		f.feed(s, start + i * step)
+		values.append(f.value)
+
+	return values
+
+class CreateFilterTest(unittest.TestCase):
+
+	def testCreate(self):
+
+		f = createFilter('debounce', 20)
+
+		self.assertTrue(isinstance(f, DebounceFilter))
+		self.assertAlmostEqual(0.02, f.window)
+		self.assertTrue(isinstance(createFilter('integrate', 3), IntegratorFilter))
+		self.assertTrue(isinstance(createFilter('majority', 5), MajorityFilter))
+
+	def testNoFiltering(self):
+
+		self.assertEqual(None, createFilter('debounce', 0))
+		self.assertEqual(None, createFilter('majority', -1))
+
+	def testUnknown(self):
+
+		self.assertRaises(ValueError, createFilter, 'median', 3)
+		self.assertRaises(ValueError, createFilter, 'median', 0)
+
+class DebounceFilterTest(unittest.TestCase):
+
+	def testWindow(self):
+
+		f = DebounceFilter(0.005)
+		f.reset(0, 0.0)
+
+		# a bounce shorter than the window is suppressed
+		self.assertEqual([0] * 4, feedAll(f, [1, 1, 0, 1]))
+
+		# the output changes once the input kept its value for the window
+		f.reset(0, 0.0)
+		self.assertFalse(f.feed(1, 0.001))
+		self.assertFalse(f.feed(1, 0.005))
+		self.assertTrue(f.feed(1, 0.006))
+		self.assertEqual(1, f.value)
+		self.assertFalse(f.feed(1, 0.007))
+
+	def testBounceRestartsWindow(self):
+
+		f = DebounceFilter(0.005)
+		f.reset(1, 0.0)
+
+		self.assertFalse(f.feed(0, 0.001))
+		self.assertFalse(f.feed(1, 0.004))
+		self.assertFalse(f.feed(0, 0.005))
+		self.assertFalse(f.feed(0, 0.009))
+		self.assertTrue(f.feed(0, 0.010))
+		self.assertEqual(0, f.value)
+
+class IntegratorFilterTest(unittest.TestCase):
+
+	def testSaturation(self):
+
+		f = IntegratorFilter(3)
+		f.reset(0, 0.0)
+
+		self.assertEqual([0, 0, 0, 0, 1, 1], feedAll(f, [1, 1, 0, 1, 1, 1]))
+
+		# the counter is at its maximum, it takes 3 LOW samples to drop
+		self.assertEqual([1, 1, 0], feedAll(f, [0, 0, 0]))
+
+	def testReset(self):
+
+		f = IntegratorFilter(2)
+		f.reset(1, 0.0)
+
+		self.assertFalse(f.feed(0, 0.0))
+		self.assertTrue(f.feed(0, 0.0))
+		self.assertEqual(0, f.value)
+
+class MajorityFilterTest(unittest.TestCase):
+
+	def testVote(self):
+
+		f = MajorityFilter(3)
+		f.reset(0, 0.0)
+
+		# a single glitch is outvoted
+		self.assertEqual([0, 0, 0], feedAll(f, [1, 0, 0]))
+		self.assertEqual([0, 1, 1, 1], feedAll(f, [1, 1, 0, 1]))
+		self.assertEqual([0, 0], feedAll(f, [0, 0]))
+
+	def testReset(self):
+
+		f = MajorityFilter(5)
+		f.reset(1, 0.0)
+
+		self.assertEqual([1, 1, 0], feedAll(f, [0, 0, 0]))
+
+if __name__ == '__main__':
+	unittest.main()
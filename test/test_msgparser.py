@@ -0,0 +1,83 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Tests for the remote sensor protocol parser (see @scratch.msgparser).
+'''
+
+import unittest
+
+from scratch.msgparser import parseMsg, tokenize, SENSOR_UPDATE, BROADCAST
+
+class MsgParserTest(unittest.TestCase):
+
+	def testSensorUpdate(self):
+
+		pmsg = parseMsg('sensor-update "name" "hello world" "x" -12 "y" 0.5 "z" 17')
+
+		self.assertEqual(SENSOR_UPDATE, pmsg.type)
+		self.assertEqual([('name', 'hello world'), ('x', -12), ('y', 0.5), ('z', 17)], pmsg.pairs)
+		self.assertTrue(isinstance(pmsg.pairs[1][1], int))
+		self.assertTrue(isinstance(pmsg.pairs[2][1], float))
+
+	def testEscapedQuotes(self):
+
+		pmsg = parseMsg('sensor-update "say ""hi""" "" "a""b" "c"')
+
+		self.assertEqual([('say "hi"', ''), ('a"b', 'c')], pmsg.pairs)
+
+	def testNumbers(self):
+
+		self.assertEqual([-3, -0.25, 1e3, 2.5e-2, 7, '12abc'], tokenize('-3 -.25 1e3 2.5e-2 7 12abc'))
+
+	def testNumericName(self):
+
+		pmsg = parseMsg('sensor-update 42 "v"')
+
+		self.assertEqual([('42', 'v')], pmsg.pairs)
+
+	def testOddPairs(self):
+
+		pmsg = parseMsg('sensor-update "a" 1 "b"')
+
+		self.assertEqual([('a', 1)], pmsg.pairs)
+
+	def testBroadcast(self):
+
+		pmsg = parseMsg('Broadcast "turn left"')
+
+		self.assertEqual(BROADCAST, pmsg.type)
+		self.assertEqual('turn left', pmsg.message)
+		self.assertEqual(None, pmsg.pairs)
+
+		self.assertEqual('5', parseMsg('broadcast 5').message)
+		self.assertEqual(None, parseMsg('broadcast').message)
+
+	def testEmpty(self):
+
+		self.assertEqual(None, parseMsg(''))
+		self.assertEqual(None, parseMsg('   '))
+
+if __name__ == '__main__':
+	unittest.main()
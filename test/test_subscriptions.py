@@ -0,0 +1,183 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Tests for the subscriptions to variable updates (see @scratch.subscriptions).
+'''
+
+import re
+import unittest
+
+from scratch.subscriptions import Subscriptions, PrefixTrie, literalPrefix
+
+def handler(tag):
+	'''
+	@return		a distinct handler function, named tag
+	'''
+
+	def h(name, value):
+		pass
+
+	h.__name__ = tag
+
+	return h
+
+class LiteralPrefixTest(unittest.TestCase):
+
+	def testLiteralPrefix(self):
+
+		self.assertEqual('IO', literalPrefix(r'IO\d+'))
+		self.assertEqual('temp', literalPrefix('temp'))
+		self.assertEqual('a', literalPrefix('ab?c'))
+		self.assertEqual('', literalPrefix('x*'))
+		self.assertEqual('', literalPrefix('a|b'))
+		self.assertEqual('', literalPrefix('.*'))
+
+class PrefixTrieTest(unittest.TestCase):
+
+	def testMatches(self):
+
+		t = PrefixTrie()
+		t.add('', 'all')
+		t.add('DI', 'di')
+		t.add('DIO', 'dio')
+		t.add('X', 'x')
+
+		self.assertEqual(['all', 'di', 'dio'], t.matches('DIO1'))
+		self.assertEqual(['all', 'di'], t.matches('DI'))
+		self.assertEqual(['all'], t.matches('D'))
+
+	def testRemove(self):
+
+		t = PrefixTrie()
+		t.add('ab', 1)
+		t.add('abc', 2)
+
+		self.assertFalse(t.remove('abc', 1))
+		self.assertFalse(t.remove('xyz', 1))
+		self.assertTrue(t.remove('abc', 2))
+		self.assertEqual([1], t.matches('abcd'))
+		self.assertTrue(t.remove('ab', 1))
+
+		# nodes left without entries are dropped
+		self.assertEqual({}, t.root)
+
+class SubscriptionsTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.subs 	= Subscriptions()
+		self.a 		= handler('a')
+		self.b 		= handler('b')
+		self.c 		= handler('c')
+
+	def testExactName(self):
+
+		s = self.subs
+		s.subscribe('temp', self.a)
+
+		self.assertEqual((self.a, ), s.handlers('temp'))
+		self.assertEqual((), s.handlers('temp2'))
+		self.assertEqual((), s.handlers('TEMP'))
+		self.assertEqual(1, s.count)
+
+	def testPrefix(self):
+
+		s = self.subs
+		s.subscribe('DIO*', self.a)
+		s.subscribe('*', self.b)
+
+		self.assertEqual((self.a, self.b), s.handlers('DIO1'))
+		self.assertEqual((self.a, self.b), s.handlers('DIO'))
+		self.assertEqual((self.b, ), s.handlers('ADC1'))
+
+	def testRegex(self):
+
+		s = self.subs
+		s.subscribe(re.compile(r'IO\d+'), self.a)
+		s.subscribe(re.compile(r'adc\d', re.IGNORECASE), self.b)
+
+		self.assertEqual((self.a, ), s.handlers('IO12'))
+
+		# the expression must match the whole name
+		self.assertEqual((), s.handlers('IO12x'))
+		self.assertEqual((), s.handlers('IO'))
+
+		self.assertEqual((self.b, ), s.handlers('ADC3'))
+		self.assertEqual((self.b, ), s.handlers('adc3'))
+
+	def testIgnoreCase(self):
+
+		s = self.subs
+		s.subscribe('Temp', self.a, ignoreCase = True)
+		s.subscribe('dio*', self.b, ignoreCase = True)
+
+		self.assertEqual((self.a, ), s.handlers('TEMP'))
+		self.assertEqual((self.a, ), s.handlers('temp'))
+		self.assertEqual((self.b, ), s.handlers('DIO4'))
+		self.assertEqual((self.b, ), s.handlers('Dio4'))
+
+		self.assertTrue(s.unsubscribe('Temp', self.a, ignoreCase = True))
+		self.assertEqual((), s.handlers('temp'))
+
+	def testOrderAndDuplicates(self):
+
+		s = self.subs
+		s.subscribe('*', self.c)
+		s.subscribe('x1', self.a)
+		s.subscribe('x*', self.b)
+		s.subscribe(re.compile(r'x\d'), self.a)
+
+		# in the order of subscription, each handler once
+		self.assertEqual((self.c, self.a, self.b), s.handlers('x1'))
+		self.assertEqual(4, s.count)
+
+	def testUnsubscribe(self):
+
+		s = self.subs
+		r = re.compile(r'IO\d+')
+
+		s.subscribe('temp', self.a)
+		s.subscribe('temp', self.b)
+		s.subscribe('IO*', self.a)
+		s.subscribe(r, self.b)
+
+		# fills the cache, which must be dropped by unsubscribe
+		self.assertEqual((self.a, self.b), s.handlers('temp'))
+		self.assertEqual((self.a, self.b), s.handlers('IO1'))
+
+		self.assertTrue(s.unsubscribe('temp', self.a))
+		self.assertFalse(s.unsubscribe('temp', self.a))
+		self.assertTrue(s.unsubscribe(r, self.b))
+		self.assertFalse(s.unsubscribe('IO*', self.b))
+
+		self.assertEqual((self.b, ), s.handlers('temp'))
+		self.assertEqual((self.a, ), s.handlers('IO1'))
+		self.assertEqual(2, s.count)
+
+		self.assertTrue(s.unsubscribe('IO*', self.a))
+		self.assertEqual((), s.handlers('IO1'))
+
+if __name__ == '__main__':
+	unittest.main()
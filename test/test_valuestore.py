@@ -0,0 +1,135 @@
+##
+# This file is part of the Scratch Remote Sensor (SRS) Library project
+#
+# Copyright (C) 2012 Stefan Wendler <sw@kaltpost.de>
+#
+# The SRS Library is free software; you can redistribute
+# it and/or modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+#  version 2.1 of the License, or (at your option) any later version.
+#
+#  SRS Library is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with the JSherpa firmware; if not, write to the Free
+#  Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA
+#  02111-1307 USA.
+##
+
+
+'''
+This file is part of the Scratch Remote Sensor Library project
+
+Tests for the versioned value store (see @scratch.valuestore).
+'''
+
+import unittest
+
+from scratch.valuestore import ValueStore
+
+class ValueStoreTest(unittest.TestCase):
+
+	def setUp(self):
+
+		self.store = ValueStore()
+
+	def testSet(self):
+
+		s = self.store
+
+		self.assertTrue(s.set('x', 1))
+		self.assertTrue(s.set('y', 'a'))
+		self.assertFalse(s.set('x', 1))
+		self.assertTrue(s.set('x', 2))
+
+		self.assertEqual(3, s.version)
+		self.assertEqual(2, s.get('x'))
+		self.assertEqual(3, s.versionOf('x'))
+		self.assertEqual(2, s.versionOf('y'))
+		self.assertEqual(0, s.versionOf('z'))
+		self.assertRaises(KeyError, s.get, 'z')
+		self.assertTrue('y' in s)
+		self.assertEqual(2, len(s))
+
+	def testSnapshot(self):
+
+		s = self.store
+		s.set('x', 1)
+		s.set('y', 2)
+
+		snap = s.snapshot()
+
+		s.set('x', 10)
+		s.set('z', 3)
+
+		# the snapshot keeps the values at the time it was taken
+		self.assertEqual(2, snap.version)
+		self.assertEqual(1, snap.get('x'))
+		self.assertEqual(1, snap.versionOf('x'))
+		self.assertFalse('z' in snap)
+		self.assertEqual([('x', 1), ('y', 2)], sorted(snap.items()))
+
+		self.assertEqual(10, s.get('x'))
+		self.assertEqual(3, s.get('z'))
+
+		# a second snapshot does not see later changes either
+		snap2 = s.snapshot()
+		s.set('y', 20)
+
+		self.assertEqual(2, snap2.get('y'))
+		self.assertEqual(['x', 'y', 'z'], sorted(snap2.names()))
+		self.assertEqual(1, snap.get('x'))
+
+	def testDiff(self):
+
+		s = self.store
+		s.set('x', 1)
+		s.set('y', 2)
+
+		since = s.version
+
+		self.assertEqual({}, s.diff(since))
+
+		s.set('x', 3)
+		s.set('z', 4)
+		s.set('x', 5)
+		s.set('y', 2)
+
+		self.assertEqual({'x' : 5, 'z' : 4}, s.diff(since))
+		self.assertEqual({'x' : 5, 'y' : 2, 'z' : 4}, s.diff(0))
+		self.assertEqual({}, s.diff(s.version))
+
+	def testDiffAfterCompaction(self):
+
+		s = self.store
+		s.set('a', 0)
+		since = s.version
+
+		# many changes of one variable compact the change log
+		for i in xrange(1000):
+			s.set('x', i)
+
+		self.assertEqual({'x' : 999}, s.diff(since))
+		self.assertEqual({'a' : 0, 'x' : 999}, s.diff(0))
+
+	def testTakeDirty(self):
+
+		s = self.store
+		s.set('x', 1)
+		s.set('y', 2)
+		s.set('x', 3)
+
+		self.assertEqual(set(['x', 'y']), s.takeDirty())
+		self.assertEqual(set(), s.takeDirty())
+
+		s.set('y', 2)
+		self.assertEqual(set(), s.takeDirty())
+
+		s.set('y', 4)
+		self.assertEqual(set(['y']), s.takeDirty())
+
+if __name__ == '__main__':
+	unittest.main()